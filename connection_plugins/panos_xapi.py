@@ -0,0 +1,183 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+author: "Rob Maas (@robm83)"
+connection: panos_xapi
+short_description: Persistent keep-alive connection to the PAN-OS XML API
+description:
+    - Keeps one HTTPS connection and API key per device open for the whole play. The panos_vr, panos_interface,
+      panos_int_mgt_profile, panos_commit and panos_commit_wait modules send their XML API requests through it,
+      so only the first task of a play does the TLS handshake and keygen request.
+options:
+    host:
+        description:
+            - IP address (or hostname) of the PAN-OS device.
+        default: inventory_hostname
+        vars:
+            - name: ansible_host
+    port:
+        type: int
+        description:
+            - HTTPS port of the XML API.
+        default: 443
+        ini:
+            - section: defaults
+              key: remote_port
+        env:
+            - name: ANSIBLE_REMOTE_PORT
+        vars:
+            - name: ansible_port
+    remote_user:
+        description:
+            - Username credentials to use for auth.
+        env:
+            - name: ANSIBLE_REMOTE_USER
+        vars:
+            - name: ansible_user
+    password:
+        description:
+            - Password credentials to use for auth.
+        vars:
+            - name: ansible_password
+    api_key:
+        description:
+            - API key to use instead of username and password.
+        vars:
+            - name: panos_api_key
+    validate_certs:
+        type: boolean
+        description:
+            - Validate the certificate of the device.
+        default: true
+        vars:
+            - name: panos_validate_certs
+    persistent_connect_timeout:
+        type: int
+        description:
+            - Seconds the connection is kept open without requests.
+        default: 30
+        ini:
+            - section: persistent_connection
+              key: connect_timeout
+        env:
+            - name: ANSIBLE_PERSISTENT_CONNECT_TIMEOUT
+        vars:
+            - name: ansible_connect_timeout
+    persistent_command_timeout:
+        type: int
+        description:
+            - Seconds to wait for a response of the device.
+        default: 30
+        ini:
+            - section: persistent_connection
+              key: command_timeout
+        env:
+            - name: ANSIBLE_PERSISTENT_COMMAND_TIMEOUT
+        vars:
+            - name: ansible_command_timeout
+    persistent_log_messages:
+        type: boolean
+        description:
+            - Log the messages of the persistent connection.
+        default: false
+        ini:
+            - section: persistent_connection
+              key: log_messages
+        env:
+            - name: ANSIBLE_PERSISTENT_LOG_MESSAGES
+        vars:
+            - name: ansible_persistent_log_messages
+'''
+
+import socket
+import ssl
+import xml.etree.ElementTree as ET
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible.plugins.connection import NetworkConnectionBase, ensure_connect
+
+
+class Connection(NetworkConnectionBase):
+
+    transport = 'panos_xapi'
+    has_pipelining = False
+
+    def __init__(self, play_context, new_stdin, *args, **kwargs):
+        super(Connection, self).__init__(play_context, new_stdin, *args, **kwargs)
+        self._conn = None
+        self._api_key = None
+
+    def _new_conn(self):
+        if self.get_option('validate_certs'):
+            context = ssl.create_default_context()
+        else:
+            context = ssl._create_unverified_context()
+        return http_client.HTTPSConnection(self.get_option('host'), self.get_option('port'),
+                                           timeout=self.get_option('persistent_command_timeout'),
+                                           context=context)
+
+    def _connect(self):
+        if not self.connected:
+            self._conn = self._new_conn()
+            self._connected = True
+            self._api_key = self.get_option('api_key') or self._keygen()
+            self.queue_message('vvvv', 'panos_xapi connected to %s' % self.get_option('host'))
+
+    def _keygen(self):
+        body = self._send(dict(type='keygen',
+                               user=self.get_option('remote_user'),
+                               password=self.get_option('password')))
+        key = ET.fromstring(body).findtext('./result/key')
+        if not key:
+            raise AnsibleConnectionFailure('keygen on %s failed: %s' % (self.get_option('host'), body))
+        return key
+
+    #POST a query on the open connection, reconnect once when the device closed it.
+    #Failures are raised with the code or connection message panos_retry retries.
+    def _send(self, query):
+        data = urlencode(query)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        for attempt in range(2):
+            try:
+                self._conn.request('POST', '/api/', data, headers)
+                response = self._conn.getresponse()
+                body = response.read().decode('utf-8')
+            except (http_client.HTTPException, socket.error) as exc:
+                self._conn.close()
+                if attempt:
+                    raise AnsibleConnectionFailure('connection failed: %s' % (str(exc) or type(exc).__name__))
+                self._conn = self._new_conn()
+                continue
+            if response.status != 200:
+                raise AnsibleConnectionFailure('code: %s reason: %s' % (response.status, response.reason))
+            return body
+
+    @ensure_connect
+    def xapi_request(self, query):
+        query = dict(query)
+        query['key'] = self._api_key
+        return self._send(query)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        super(Connection, self).close()
@@ -0,0 +1,176 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Deferred commits for the ON2IT panos modules.
+#
+# With commit_mode deferred a module does not commit itself, it marks the
+# device dirty in a small state file. The panos_commit module then runs one
+# commit per device for all changes, optionally a partial commit for only the
+# admins that made the changes.
+#
+# With commit_mode async the commit is started and the job id is returned right
+# away. wait_jobs polls any number of job ids with one show jobs call per round,
+# backing off exponentially with jitter so many devices can be committed in
+# parallel without flooding their management planes.
+
+import json
+import os
+import random
+import re
+import tempfile
+import time
+
+DEFAULT_STATE_DIR = '~/.ansible/panos_commit'
+
+
+def _state_path(hostname, state_dir=None):
+    return os.path.join(os.path.expanduser(state_dir or DEFAULT_STATE_DIR),
+                        re.sub(r'[^\w.-]', '_', hostname) + '.json')
+
+
+#Read the commit state of a device
+def read_state(hostname, state_dir=None):
+    path = _state_path(hostname, state_dir)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def write_state(hostname, state, state_dir=None):
+    path = _state_path(hostname, state_dir)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp, path)
+
+
+#Mark the device dirty, remember which admin made the change
+def mark_dirty(hostname, username, state_dir=None):
+    state = read_state(hostname, state_dir)
+    admins = state.get('admins', [])
+    if username not in admins:
+        admins.append(username)
+    state['admins'] = admins
+    state.setdefault('dirty_since', time.time())
+    write_state(hostname, state, state_dir)
+
+
+def is_dirty(hostname, state_dir=None):
+    return bool(read_state(hostname, state_dir).get('admins'))
+
+
+#Commit command, partial when admins are given
+def commit_cmd(admins=None):
+    if not admins:
+        return '<commit></commit>'
+    members = ''.join('<member>%s</member>' % admin for admin in admins)
+    return '<commit><partial><admin>' + members + '</admin></partial></commit>'
+
+
+#Job id from a commit or show jobs response
+def job_id(element_root):
+    job = element_root.find('.//job') if element_root is not None else None
+    if job is None:
+        return None
+    return job.findtext('id') or (job.text or '').strip() or None
+
+
+#Commit and wait for the job, returns the job id and duration in seconds
+def commit(xapi, admins=None):
+    start = time.time()
+    xapi.commit(cmd=commit_cmd(admins), action='partial' if admins else None, sync=True, interval=1)
+    return dict(job_id=job_id(xapi.element_root),
+                duration=round(time.time() - start, 3))
+
+
+#Start a commit without waiting, returns the job id
+def commit_async(xapi, admins=None):
+    xapi.commit(cmd=commit_cmd(admins), action='partial' if admins else None)
+    return job_id(xapi.element_root)
+
+
+#Commit the pending changes of a device and clear its dirty marker
+def commit_pending(xapi, hostname, admins=None, state_dir=None, wait=True):
+    if wait:
+        result = commit(xapi, admins)
+    else:
+        result = dict(job_id=commit_async(xapi, admins), duration=None)
+    result['finished'] = time.time()
+    result['admins'] = admins
+    write_state(hostname, dict(last_commit=result), state_dir)
+    return result
+
+
+#Parse the jobs of a show jobs response, keyed by job id
+def parse_jobs(element_root):
+    jobs = {}
+    for job in element_root.iter('job'):
+        if job.findtext('id') is None:
+            continue
+        progress = job.findtext('progress')
+        jobs[job.findtext('id')] = dict(
+            id=job.findtext('id'),
+            type=job.findtext('type'),
+            status=job.findtext('status'),
+            result=job.findtext('result'),
+            progress=int(progress) if progress and progress.isdigit() else None,
+            tenq=job.findtext('tenq'),
+            tfin=job.findtext('tfin'),
+        )
+    return jobs
+
+
+#Get the state of the jobs with a single op call
+def poll_jobs(xapi, job_ids):
+    if len(job_ids) == 1:
+        xapi.op(cmd='<show><jobs><id>%s</id></jobs></show>' % list(job_ids)[0])
+    else:
+        xapi.op(cmd='<show><jobs><all></all></jobs></show>')
+    return parse_jobs(xapi.element_root)
+
+
+#Wait for jobs to finish, polling with exponential back-off and jitter.
+#Returns the jobs by id and the ids that did not finish within the timeout.
+def wait_jobs(xapi, job_ids, timeout=600, interval=1.0, max_interval=30.0,
+              backoff=2.0, jitter=0.25, sleep=time.sleep):
+    start = time.time()
+    pending = set(str(j) for j in job_ids)
+    jobs = dict((j, dict(id=j, status=None, polls=0)) for j in pending)
+    delay = interval
+
+    while pending:
+        polled = poll_jobs(xapi, pending)
+        now = time.time()
+        for jid in list(pending):
+            jobs[jid]['polls'] += 1
+            if jid not in polled:
+                continue
+            jobs[jid].update(polled[jid])
+            if polled[jid]['status'] == 'FIN':
+                jobs[jid]['waited'] = round(now - start, 3)
+                pending.discard(jid)
+        if not pending or now - start >= timeout:
+            break
+        pause = min(delay * random.uniform(1 - jitter, 1 + jitter), timeout - (now - start))
+        sleep(max(pause, 0))
+        delay = min(delay * backoff, max_interval)
+
+    return jobs, pending
@@ -0,0 +1,174 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Offline config compiler for the ON2IT panos modules.
+#
+# CompiledConfig is used in place of the xapi when a module runs with
+# compile_to. The set, edit and delete calls of the module are applied to a
+# local candidate config file, get and show read from it, so the modules build
+# the same XML they would send to the device without any API call. The
+# panos_config_push module imports the file and loads the network and zone
+# subtrees with load config partial.
+#
+# In check mode the modules run against a PlannedConfig instead: a copy of the
+# cached snapshot of the device or of an exported config file. It records the
+# set, edit and delete calls as the plan and diffs the VRs, interfaces,
+# profiles and zones they change, without connecting to the device.
+
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from copy import deepcopy
+
+from ansible.module_utils.panos_snapshot import apply_config, find_xpath, index_config, read_snapshot, select_xpath
+from ansible.module_utils.panos_transaction import replay
+
+_DEVICE_XPATH = "/config/devices/entry[@name='localhost.localdomain']"
+NETWORK_XPATH = _DEVICE_XPATH + "/network"
+ZONE_XPATH = _DEVICE_XPATH + "/vsys/entry[@name='vsys1']/zone"
+
+
+#Empty candidate config with the network and zone nodes
+def empty_config():
+    root = ET.Element('config')
+    find_xpath(root, NETWORK_XPATH, create=True)
+    find_xpath(root, ZONE_XPATH, create=True)
+    return root
+
+
+class CompiledConfig(object):
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        if os.path.exists(self.path):
+            self.root = ET.parse(self.path).getroot()
+        else:
+            self.root = empty_config()
+        self.element_root = None
+        self.status = None
+
+    def get(self, xpath=None):
+        self.element_root = ET.Element('response', status='success')
+        result = ET.SubElement(self.element_root, 'result')
+        result.extend(select_xpath(self.root, xpath))
+        self.status = 'success'
+
+    def show(self, xpath=None):
+        self.get(xpath=xpath)
+
+    def set(self, xpath=None, element=None):
+        self.apply('set', xpath, element)
+
+    def edit(self, xpath=None, element=None):
+        self.apply('edit', xpath, element)
+
+    def delete(self, xpath=None):
+        self.apply('delete', xpath)
+
+    def multi_config(self, element=None):
+        replay(element, self.apply)
+
+    def apply(self, action, xpath, element=None):
+        apply_config(self.root, action, xpath, element)
+
+    def save(self):
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ET.tostring(self.root))
+        os.rename(tmp, self.path)
+
+
+class PlannedConfig(CompiledConfig):
+    # Config of a check mode run, the changes are recorded and never saved
+
+    def __init__(self, root, source):
+        self.path = None
+        self.source = source
+        self.root = root
+        self.before = deepcopy(root)
+        self.element_root = None
+        self.status = None
+        self.plan = []
+
+    def apply(self, action, xpath, element=None):
+        self.plan.append(dict(action=action, xpath=xpath, element=element))
+        apply_config(self.root, action, xpath, element)
+
+    def save(self):
+        pass
+
+    #Ansible diff of the VRs, interfaces, profiles and zones that the plan changes
+    def diff(self):
+        before, after = index_config(self.before), index_config(self.root)
+        old, new = [], []
+        for kind in sorted(before):
+            for name in sorted(set(before[kind]) | set(after[kind])):
+                a, b = before[kind].get(name), after[kind].get(name)
+                if (a is not None and b is not None and ET.tostring(a) == ET.tostring(b)):
+                    continue
+                header = '# %s %s\n' % (kind, name)
+                old.append(header + (pretty_xml(a) if a is not None else ''))
+                new.append(header + (pretty_xml(b) if b is not None else ''))
+        return dict(before=''.join(old), after=''.join(new),
+                    before_header=self.source, after_header='%s (planned)' % self.source)
+
+
+def pretty_xml(node):
+    from xml.dom import minidom
+    text = minidom.parseString(ET.tostring(node)).toprettyxml(indent='  ')
+    return '\n'.join(line for line in text.splitlines()[1:] if line.strip()) + '\n'
+
+
+#Config tree of an exported config file, the response of a config show is unwrapped.
+#None when the response holds no config.
+def read_config(path):
+    root = ET.parse(os.path.expanduser(path)).getroot()
+    if root.tag == 'response':
+        root = root.find('./result/config')
+    return root
+
+
+#PlannedConfig for a check mode run on check_config, else on the cached
+#snapshot of the device. None when there is neither.
+def plan_config(check_config, hostname, snapshot_dir=None):
+    if check_config:
+        root, source = read_config(check_config), check_config
+    else:
+        root, source = read_snapshot(hostname, snapshot_dir), 'snapshot of %s' % hostname
+    if root is None:
+        return None
+    return PlannedConfig(root, source)
+
+
+#op command to load a subtree of an imported config file into the candidate config
+def load_partial_cmd(filename, xpath, mode='merge'):
+    return ('<load><config><partial>'
+            '<from>%s</from><from-xpath>%s</from-xpath><to-xpath>%s</to-xpath><mode>%s</mode>'
+            '</partial></config></load>') % (filename, xpath, xpath, mode)
+
+
+#Import the compiled config and load the subtrees, returns the loaded xpaths
+def push_config(xapi, path, xpaths=None, mode='merge'):
+    path = os.path.expanduser(path)
+    filename = os.path.basename(path)
+    root = ET.parse(path).getroot()
+    xpaths = [x for x in (xpaths or [NETWORK_XPATH, ZONE_XPATH]) if find_xpath(root, x) is not None]
+
+    xapi.import_file(category='configuration', file=path, filename=filename)
+    for xpath in xpaths:
+        xapi.op(cmd=load_partial_cmd(filename, xpath, mode))
+    return xpaths
@@ -0,0 +1,111 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Panorama templates for the ON2IT panos modules.
+#
+# The modules build firewall xpaths below
+# /config/devices/entry[@name='localhost.localdomain']. TemplateXapi is used in
+# place of the xapi when a template or template stack is given, it moves those
+# xpaths into the template tree of Panorama and puts the zones in the given
+# vsys. After the commit on Panorama, commit_push() sends a single commit-all
+# to the device group, template or template stack, so all devices are
+# configured with one change and one push.
+
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.panos_commit import job_id
+from ansible.module_utils.panos_snapshot import split_union
+from ansible.module_utils.panos_transaction import multi_config
+
+_DEVICE_XPATH = "/config/devices/entry[@name='localhost.localdomain']"
+_VSYS_STEP = "/vsys/entry/"
+
+DEFAULT_VSYS = 'vsys1'
+
+
+#Device entry of a template or template stack on Panorama
+def template_xpath(template=None, template_stack=None):
+    if template_stack:
+        target = "/template-stack/entry[@name='%s']" % template_stack
+    else:
+        target = "/template/entry[@name='%s']" % template
+    return _DEVICE_XPATH + target + "/config/devices/entry[@name='localhost.localdomain']"
+
+
+#Name of the target for snapshots, a template on Panorama has its own config
+def target_name(hostname, template=None, template_stack=None, vsys=None):
+    return '_'.join(n for n in (hostname, template, template_stack, vsys) if n)
+
+
+class TemplateXapi(object):
+    # Passes calls to the xapi with the device xpaths moved into the template
+
+    def __init__(self, xapi, template=None, template_stack=None, vsys=None):
+        self._xapi = xapi
+        self.prefix = template_xpath(template, template_stack) if (template or template_stack) else _DEVICE_XPATH
+        self.vsys = vsys or DEFAULT_VSYS
+
+    def xpath(self, xpath):
+        if xpath and '|' in xpath:
+            return '|'.join(self.xpath(x) for x in split_union(xpath))
+        if not xpath or not xpath.startswith(_DEVICE_XPATH):
+            return xpath
+        path = xpath[len(_DEVICE_XPATH):].replace(_VSYS_STEP, "/vsys/entry[@name='%s']/" % self.vsys, 1)
+        return self.prefix + path
+
+    def get(self, xpath=None):
+        self._xapi.get(xpath=self.xpath(xpath))
+
+    def show(self, xpath=None):
+        self._xapi.show(xpath=self.xpath(xpath))
+
+    def set(self, xpath=None, element=None):
+        self._xapi.set(xpath=self.xpath(xpath), element=element)
+
+    def edit(self, xpath=None, element=None):
+        self._xapi.edit(xpath=self.xpath(xpath), element=element)
+
+    def delete(self, xpath=None):
+        self._xapi.delete(xpath=self.xpath(xpath))
+
+    def multi_config(self, element=None):
+        request = ET.fromstring(element)
+        for op in request:
+            op.set('xpath', self.xpath(op.get('xpath')))
+        multi_config(self._xapi, ET.tostring(request).decode('utf-8'))
+
+    def __getattr__(self, name):
+        return getattr(self._xapi, name)
+
+
+#commit-all command for a device group (with its templates), a template or a template stack
+def commit_all_cmd(device_group=None, template=None, template_stack=None):
+    if device_group:
+        return ('<commit-all><shared-policy><device-group><entry name="%s"/></device-group>'
+                '<include-template>yes</include-template></shared-policy></commit-all>') % device_group
+    if template_stack:
+        return '<commit-all><template-stack><name>%s</name></template-stack></commit-all>' % template_stack
+    return '<commit-all><template><name>%s</name></template></commit-all>' % template
+
+
+#Push the committed Panorama config to the devices, returns the job id of the push
+def push(xapi, device_group=None, template=None, template_stack=None, wait=True):
+    xapi.commit(cmd=commit_all_cmd(device_group, template, template_stack), action='all', sync=wait, interval=1)
+    return job_id(xapi.element_root)
+
+
+#Commit on Panorama and push to the devices, returns the job id of the push
+def commit_push(xapi, device_group=None, template=None, template_stack=None, wait=True):
+    xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+    return push(xapi, device_group, template, template_stack, wait)
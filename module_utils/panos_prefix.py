@@ -0,0 +1,160 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# IP prefix lists for the ON2IT panos modules.
+#
+# Prefixes come as a comma separated string, a list or a file with one or more
+# prefixes per line. normalize_prefixes() parses them with the ipaddress
+# module, drops duplicates and collapses adjacent and overlapping networks, so
+# two lists with the same addresses compare equal as sets whatever the notation
+# (10.0.0.1 and 10.0.0.1/32, 10.0.0.0/25 and 10.0.0.128/25 and 10.0.0.0/24).
+#
+# PrefixTable holds prefixes with a value for overlap checks of routing tables.
+# It keeps a dict per prefix length, keyed by the network as integer, so the
+# prefixes covering an address are found with one probe per prefix length in
+# use instead of a walk over every bit.
+
+import binascii
+import socket
+from bisect import insort
+
+from ansible.module_utils.six import string_types, text_type
+
+try:
+    import ipaddress
+    HAS_IPADDRESS = True
+except ImportError:
+    HAS_IPADDRESS = False
+
+
+#Split a comma separated string or a list of strings in prefixes
+def split_prefixes(prefixes):
+    if not prefixes:
+        return []
+    if isinstance(prefixes, string_types):
+        prefixes = [prefixes]
+    return [p.strip() for item in prefixes for p in text_type(item).split(',') if p.strip()]
+
+
+#Prefixes of a file, comma or line separated, # starts a comment
+def read_prefixes(path):
+    prefixes = []
+    with open(path) as f:
+        for line in f:
+            prefixes.extend(split_prefixes(line.split('#', 1)[0]))
+    return prefixes
+
+
+#Network of a prefix, host bits are cleared. Raises ValueError when invalid.
+def parse_prefix(prefix):
+    return ipaddress.ip_network(text_type(prefix).strip(), strict=False)
+
+
+#Deduplicated, collapsed and sorted prefixes, IPv4 before IPv6
+def normalize_prefixes(prefixes):
+    networks = {4: [], 6: []}
+    for prefix in split_prefixes(prefixes):
+        network = parse_prefix(prefix)
+        networks[network.version].append(network)
+    return [str(n) for version in (4, 6) for n in ipaddress.collapse_addresses(networks[version])]
+
+
+#Set difference of the wanted and current prefixes: (added, removed). Both
+#sides are collapsed, so the same addresses in another notation or split in
+#other networks are no change. A current prefix is removed when the collapsed
+#network it is part of is not wanted, or when it is not an IP prefix and not
+#wanted. The removed prefixes keep the notation of current, so they can be
+#deleted by name.
+def diff_prefixes(wanted, current):
+    wanted = normalize_prefixes(wanted)
+    networks = {}
+    for name in current:
+        try:
+            networks[name] = parse_prefix(name)
+        except ValueError:
+            networks[name] = None
+    collapsed = set(normalize_prefixes([str(n) for n in networks.values() if n is not None]))
+    wanted_keys = set(wanted)
+    gone = collapsed - wanted_keys
+    added = [p for p in wanted if p not in collapsed]
+    removed = [name for name, network in networks.items()
+               if (network is None and name not in wanted_keys) or
+               (network is not None and gone and _collapsed_into(network, gone))]
+    return added, sorted(removed)
+
+
+#True when network is part of one of the collapsed prefixes
+def _collapsed_into(network, prefixes):
+    return any(str(network.supernet(new_prefix=length)) in prefixes for length in range(network.prefixlen + 1))
+
+
+#Width (32 or 128), network as integer and length of a prefix, None when it
+#is not an IP prefix (an address object for example)
+def prefix_bits(prefix):
+    address, _, length = text_type(prefix).strip().partition('/')
+    family, width = (socket.AF_INET6, 128) if ':' in address else (socket.AF_INET, 32)
+    try:
+        value = int(binascii.hexlify(socket.inet_pton(family, address)), 16)
+        length = int(length) if length else width
+    except (socket.error, ValueError):
+        return None
+    if not 0 <= length <= width:
+        return None
+    return width, value & _mask(width, length), length
+
+
+def _mask(width, length):
+    return ((1 << length) - 1) << (width - length)
+
+
+class PrefixTable(object):
+    # Prefixes with their values, a dict of networks per prefix length
+
+    def __init__(self):
+        self.tables = {}
+        self.lengths = {32: [], 128: []}
+
+    #Add a value for prefix, False when prefix is not an IP prefix
+    def add(self, prefix, value):
+        key = prefix_bits(prefix)
+        if key is None:
+            return False
+        width, network, length = key
+        table = self.tables.get((width, length))
+        if table is None:
+            table = self.tables[(width, length)] = {}
+            insort(self.lengths[width], length)
+        table.setdefault(network, []).append(value)
+        return True
+
+    #(length, values) of the prefixes that contain prefix, the longest first and
+    #prefix itself included
+    def covering(self, prefix):
+        key = prefix_bits(prefix)
+        if key is None:
+            return []
+        width, network, length = key
+        found = []
+        for l in reversed(self.lengths[width]):
+            if l > length:
+                continue
+            values = self.tables[(width, l)].get(network & _mask(width, l))
+            if values:
+                found.append((l, values))
+        return found
+
+    #Values of the longest prefix that contains prefix, [] when there is none
+    def longest(self, prefix):
+        found = self.covering(prefix)
+        return found[0][1] if found else []
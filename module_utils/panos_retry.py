@@ -0,0 +1,241 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Retries and rate limits for the ON2IT panos modules.
+#
+# connect() puts a RetryXapi between the modules and the device. The errors of
+# the XML API are classified: a busy or unreachable management plane (timeouts,
+# HTTP 429, 502, 503 and 504, refused, reset or failed connections) is retried
+# with exponential back-off and jitter, a config or commit lock held by another
+# admin or commit is waited out up to lock_timeout seconds, any other error is
+# raised right away. A commit is not sent again after a transient error, the
+# first one may have been queued on the device.
+#
+# The requests to a device pass a Limiter, shared by all threads of the
+# process. It is a token bucket whose rate follows AIMD: the rate grows by a
+# fixed step after every answer within the target latency and halves after a
+# busy error or a slower answer. The requests of a task are sent one at a time,
+# so the rate is the concurrency the device gets; it settles just below what the
+# management plane can handle.
+#
+# Every task is a new process, so connect() passes a state directory: a
+# limiter that was slowed down saves its rate for the device when the process
+# exits, and the limiter of the next task starts from it. The saved rate grows
+# by the additive step for every second that passed and is ignored after
+# RATE_STATE_TTL seconds.
+#
+# pan.xapi is imported where it is used, a RetryXapi only exists after
+# panos_xapi.load_pan().
+
+import atexit
+import json
+import os
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+
+TRANSIENT = 'transient'
+LOCKED = 'locked'
+FATAL = 'fatal'
+
+_TRANSIENT_ERRORS = ('timed out', 'code: 429', 'code: 502', 'code: 503', 'code: 504', 'connection refused',
+                     'connection reset', 'connection aborted', 'connection failed', 'remote end closed',
+                     'temporarily unavailable', 'server busy', 'too many requests')
+_LOCK_ERRORS = ('commit is in progress', 'commit in progress', 'locked by', 'is locked', 'config lock',
+                'commit lock', 'being committed')
+#Calls with a predictable latency, only these adjust the rate on a slow answer
+_PACED_CALLS = ('keygen', 'get', 'show', 'set', 'edit', 'delete', 'op')
+
+RATE_STATE_TTL = 600
+
+
+#TRANSIENT, LOCKED or FATAL for an error of a request
+def classify(exc):
+    from pan.xapi import PanXapiError
+    if isinstance(exc, socket.error) and not isinstance(exc, PanXapiError):
+        return TRANSIENT
+    message = str(getattr(exc, 'message', '') or exc).lower()
+    if any(e in message for e in _LOCK_ERRORS):
+        return LOCKED
+    if any(e in message for e in _TRANSIENT_ERRORS):
+        return TRANSIENT
+    return FATAL
+
+
+class Limiter(object):
+    # Token bucket for the requests to one device, the rate follows AIMD.
+    # A rate of 0 is unlimited until the first busy error.
+
+    def __init__(self, rate=0, target_latency=5.0, increase=0.5, decrease=0.5, min_rate=0.2):
+        self.max_rate = float(rate or 0)
+        self.rate = self.max_rate
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.last = time.time()
+        self.lock = threading.Lock()
+        self.slowed = False
+
+    #Wait for a token
+    def acquire(self, sleep=time.sleep):
+        while True:
+            with self.lock:
+                if not self.rate:
+                    return
+                now = time.time()
+                self.tokens = min(1.0, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    #Additive increase after an answer within the target latency
+    def success(self, latency):
+        if latency > self.target_latency:
+            self.overload(latency)
+            return
+        with self.lock:
+            if self.rate:
+                self.rate += self.increase
+                if self.max_rate:
+                    self.rate = min(self.rate, self.max_rate)
+
+    #Multiplicative decrease after a busy error or a slow answer
+    def overload(self, latency):
+        with self.lock:
+            #Unlimited so far, start from the rate of sequential requests
+            current = self.rate or 1.0 / max(latency, 0.001)
+            self.rate = max(self.min_rate, current * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self.slowed = True
+
+    #Start from the rate an earlier process saved, raised by the additive step
+    #for every second since. A missing, old or unreadable state is ignored.
+    def restore(self, path, ttl=RATE_STATE_TTL):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            age = time.time() - float(data['time'])
+            rate = float(data['rate'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return
+        if (not rate or not 0 <= age <= ttl):
+            return
+        rate += self.increase * age
+        if (self.max_rate and rate >= self.max_rate):
+            return
+        with self.lock:
+            self.rate = rate
+            self.slowed = True
+
+    #Save the rate when the device slowed it down, for the next process
+    def save(self, path):
+        if not self.slowed:
+            return
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(rate=self.rate, time=time.time()), f)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+#Limiter of a device, shared by the threads of the process. With state_dir it
+#starts from the rate saved by an earlier process and saves its own at exit.
+def device_limiter(hostname, rate=0, state_dir=None):
+    with _LIMITERS_LOCK:
+        if hostname not in _LIMITERS:
+            limiter = Limiter(rate)
+            if state_dir:
+                path = os.path.join(os.path.expanduser(state_dir), re.sub(r'[^\w.-]', '_', hostname) + '.rate.json')
+                limiter.restore(path)
+                atexit.register(limiter.save, path)
+            _LIMITERS[hostname] = limiter
+        return _LIMITERS[hostname]
+
+
+class RetryXapi(object):
+    # Passes calls to the xapi through the limiter, retries transient errors and waits out locks
+
+    def __init__(self, xapi, limiter=None, retries=3, lock_timeout=300, backoff=1.0, max_backoff=30.0,
+                 sleep=time.sleep):
+        self._xapi = xapi
+        self._limiter = limiter or Limiter()
+        self._max_retries = retries
+        self._lock_timeout = lock_timeout
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._sleep = sleep
+        self.retries = 0
+        self.calls = 0
+
+    def _retry(self, name, kind, attempt, start):
+        if kind == TRANSIENT:
+            return name != 'commit' and attempt < self._max_retries
+        if kind == LOCKED:
+            return time.time() - start < self._lock_timeout
+        return False
+
+    #Exponential back-off with jitter, a lock is polled at most every 10 seconds
+    def _delay(self, kind, attempt):
+        limit = 10.0 if kind == LOCKED else self._max_backoff
+        return min(self._backoff * 2 ** (attempt - 1), limit) * random.uniform(0.75, 1.25)
+
+    def __getattr__(self, name):
+        attr = getattr(self._xapi, name)
+        if not callable(attr):
+            return attr
+
+        from pan.xapi import PanXapiError
+
+        def call(*args, **kwargs):
+            start = time.time()
+            attempt = 0
+            while True:
+                self._limiter.acquire()
+                sent = time.time()
+                self.calls += 1
+                try:
+                    result = attr(*args, **kwargs)
+                except (PanXapiError, socket.error) as exc:
+                    kind = classify(exc)
+                    if kind == TRANSIENT:
+                        self._limiter.overload(time.time() - sent)
+                    if not self._retry(name, kind, attempt, start):
+                        if isinstance(exc, PanXapiError):
+                            raise
+                        raise PanXapiError('%s: %s' % (type(exc).__name__, exc))
+                    attempt += 1
+                    self.retries += 1
+                    self._sleep(self._delay(kind, attempt))
+                    continue
+                if name in _PACED_CALLS:
+                    self._limiter.success(time.time() - sent)
+                return result
+        return call
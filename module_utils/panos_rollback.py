@@ -0,0 +1,276 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Rollback points for the ON2IT panos modules.
+#
+# A module with rollback_points set wraps its xapi in a RollbackXapi and tells
+# it which config subtrees the task changes (a VR, a static route, an
+# interface with its zone and VR member lists, a profile). Before the first
+# set, edit, delete or multi-config passes, the subtrees are saved as a
+# rollback point of the device. Subtrees the module read already are passed in
+# known, the others are read with one get per xpath, or from the snapshot.
+# Tasks that change nothing save nothing.
+#
+# The store on the controller is content addressed: every subtree is saved once
+# as zlib compressed XML named by its sha256, so the same subtree of many
+# devices or runs takes the space of one. A point is a record in the JSON file
+# of the device with the xpaths and the hashes of their subtrees, the newest
+# MAX_POINTS points per device are kept.
+#
+# Replaying a point reads every subtree and puts back the ones that differ with
+# a single edit each. A subtree that did not exist is deleted together with the
+# containers the change created for it (a new zone, a <network/> node): the
+# point records the highest missing ancestor, and the highest node between it
+# and the subtree that holds nothing else is deleted. The replay only reports
+# a change when it sent one, and saves a point itself, so a rollback can be
+# undone the same way.
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import zlib
+
+from ansible.module_utils.panos_snapshot import split_xpath, find_xpath
+from ansible.module_utils.panos_transaction import multi_config
+
+DEFAULT_ROLLBACK_DIR = '~/.ansible/panos_rollback'
+MAX_POINTS = 100
+
+#Attributes the device adds to changed config, not part of the config itself
+_META_ATTRIBUTES = ('admin', 'dirtyId', 'time')
+
+
+#Atomic write of data to path
+def _write(path, data, mode='wb'):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, mode) as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+class RollbackStore(object):
+    # Compressed, content addressed subtrees and the rollback points per device
+
+    def __init__(self, directory=None):
+        self.directory = os.path.expanduser(directory or DEFAULT_ROLLBACK_DIR)
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest + '.xml.z')
+
+    def _points_path(self, hostname):
+        return os.path.join(self.directory, 'points', re.sub(r'[^\w.-]', '_', hostname) + '.json')
+
+    #Save a subtree, returns its hash. A subtree that is stored already is not written again.
+    def put(self, xml):
+        data = xml.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            _write(path, zlib.compress(data, 9))
+        return digest
+
+    def read(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    #Rollback points of a device, oldest first
+    def points(self, hostname):
+        path = self._points_path(hostname)
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            return []
+
+    #Save a rollback point of subtrees, a list of (xpath, xml, missing) where xml is
+    #None and missing the highest missing ancestor when the subtree did not exist
+    def save_point(self, hostname, module_name, subtrees):
+        saved = [[xpath, self.put(xml)] if xml is not None else [xpath, None, missing]
+                 for xpath, xml, missing in subtrees]
+        now = time.time()
+        digest = hashlib.sha256(json.dumps([now, saved]).encode('utf-8')).hexdigest()
+        point = dict(id='%s-%s' % (time.strftime('%Y%m%dT%H%M%S', time.localtime(now)), digest[:8]), time=now,
+                     module=module_name, subtrees=saved)
+        points = (self.points(hostname) + [point])[-MAX_POINTS:]
+        _write(self._points_path(hostname), json.dumps(points, indent=1), 'w')
+        return point
+
+    #Rollback point by id, last is the newest point of module_name. None when not found.
+    def find_point(self, hostname, point_id, module_name=None):
+        points = self.points(hostname)
+        if (point_id == "last"):
+            points = [p for p in points if module_name is None or p['module'] == module_name]
+            return points[-1] if points else None
+        for point in points:
+            if point['id'] == point_id:
+                return point
+        return None
+
+
+#Node at xpath from the snapshot or read with a get, None when missing
+def read_subtree(xapi, xpath, snapshot=None):
+    if snapshot:
+        return snapshot.get(xpath)
+    xapi.get(xpath=xpath)
+    result = xapi.element_root.find('./result') if xapi.element_root is not None else None
+    tag = re.match(r'[\w-]+', split_xpath(xpath)[-1]).group(0)
+    return result.find(tag) if result is not None else None
+
+
+#Highest ancestor of a missing xpath that is missing too, the xpath itself when
+#its parent exists. Reads one parent per level.
+def missing_root(xapi, xpath, snapshot=None):
+    steps = split_xpath(xpath)
+    while len(steps) > 2:
+        parent = '/' + '/'.join(steps[:-1])
+        if read_subtree(xapi, parent, snapshot) is not None:
+            break
+        steps = steps[:-1]
+    return '/' + '/'.join(steps)
+
+
+#The subtrees at xpaths as (xpath, xml or None, highest missing ancestor or
+#None), taken from known (xpath -> node or None), the snapshot or read with a
+#get per xpath
+def capture(xapi, xpaths, snapshot=None, known=None):
+    subtrees = []
+    for xpath in xpaths:
+        if known and xpath in known:
+            node = known[xpath]
+        else:
+            node = read_subtree(xapi, xpath, snapshot)
+        if node is None:
+            subtrees.append((xpath, None, missing_root(xapi, xpath, snapshot)))
+        else:
+            subtrees.append((xpath, ET.tostring(node).decode('utf-8'), None))
+    return subtrees
+
+
+#Comparable form of a node, without whitespace and the attributes of the device
+def _canonical(node):
+    return (node.tag, sorted((k, v) for k, v in node.attrib.items() if k not in _META_ATTRIBUTES),
+            (node.text or '').strip(), [_canonical(child) for child in node])
+
+
+#True when node holds no config: no name, text or children that do
+def _empty(node):
+    return not node.get('name') and not (node.text or '').strip() and all(_empty(child) for child in node)
+
+
+#True when node holds nothing but the path of steps below it, the node at the
+#end of the path left out
+def _bare(node, steps):
+    if not steps:
+        return True
+    if (node.text or '').strip():
+        return False
+    on_path = find_xpath(node, node.tag + '/' + steps[0])
+    return all(_bare(child, steps[1:]) if child is on_path else _empty(child) for child in node)
+
+
+#Xpath of the highest node from root down to xpath that holds nothing but the
+#path to xpath, None when there is none
+def _removable(root_node, root, xpath):
+    steps = split_xpath(xpath)[len(split_xpath(root)):]
+    node = root_node
+    for depth in range(len(steps) + 1):
+        if node is None:
+            return None
+        if _bare(node, steps[depth:]):
+            return '/'.join([root] + steps[:depth])
+        if depth < len(steps):
+            node = find_xpath(node, node.tag + '/' + steps[depth])
+    return None
+
+
+#Xpaths a replay of point changes, for the rollback point of the replay: the
+#subtrees, and the missing ancestor of those that did not exist
+def point_xpaths(point):
+    return [subtree[2] if len(subtree) > 2 else subtree[0] for subtree in point['subtrees']]
+
+
+#Put back the subtrees of a point that differ from the device, one edit per
+#subtree. A subtree that did not exist is deleted with the containers that
+#only hold it, up to its missing ancestor. known (xpath -> node) gets the
+#subtrees read, for the rollback point of the replay. Returns True when the
+#config changed.
+def replay_point(xapi, store, point, snapshot=None, known=None):
+    changed = False
+    for subtree in point['subtrees']:
+        xpath, digest = subtree[:2]
+        if digest is not None:
+            node = read_subtree(xapi, xpath, snapshot)
+            if known is not None:
+                known[xpath] = node
+            saved = store.read(digest)
+            if (node is None or _canonical(node) != _canonical(ET.fromstring(saved))):
+                xapi.edit(xpath=xpath, element=saved)
+                changed = True
+            continue
+        root = subtree[2] if len(subtree) > 2 else xpath
+        root_node = read_subtree(xapi, root, snapshot)
+        if known is not None:
+            known[root] = root_node
+        removable = _removable(root_node, root, xpath)
+        if removable is not None:
+            xapi.delete(xpath=removable)
+            changed = True
+    return changed
+
+
+class RollbackXapi(object):
+    # Passes calls to the xapi, saves a rollback point of xpaths before the first change
+
+    def __init__(self, xapi, store, hostname, module_name, snapshot=None):
+        self._xapi = xapi
+        self._store = store
+        self._hostname = hostname
+        self._module_name = module_name
+        self._snapshot = snapshot
+        self.xpaths = []
+        self.known = {}
+        self.point = None
+
+    def _capture(self):
+        if self.point is None and self.xpaths:
+            subtrees = capture(self._xapi, self.xpaths, self._snapshot, self.known)
+            self.point = self._store.save_point(self._hostname, self._module_name, subtrees)
+
+    def set(self, xpath=None, element=None, **kwargs):
+        self._capture()
+        self._xapi.set(xpath=xpath, element=element, **kwargs)
+
+    def edit(self, xpath=None, element=None, **kwargs):
+        self._capture()
+        self._xapi.edit(xpath=xpath, element=element, **kwargs)
+
+    def delete(self, xpath=None, **kwargs):
+        self._capture()
+        self._xapi.delete(xpath=xpath, **kwargs)
+
+    def multi_config(self, element=None):
+        self._capture()
+        multi_config(self._xapi, element)
+
+    def __getattr__(self, name):
+        return getattr(self._xapi, name)
@@ -0,0 +1,363 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Shared config snapshot for the ON2IT panos modules.
+#
+# The candidate network config (and the zones) of a device are fetched once,
+# stored on disk and used for all existence checks until the TTL expires. After
+# the TTL the last commit job id is compared, the snapshot is only fetched again
+# when somebody committed in the meantime. Changes made through the wrapped
+# xapi (set, edit, delete) are applied to the snapshot as well, so it stays in
+# line with the candidate config during the play.
+
+import json
+import os
+import re
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from copy import deepcopy
+
+from ansible.module_utils.panos_transaction import multi_config, replay
+
+_DEVICE_XPATH = "/config/devices/entry[@name='localhost.localdomain']"
+_NETWORK_XPATH = _DEVICE_XPATH + "/network"
+_ZONE_XPATH = _DEVICE_XPATH + "/vsys/entry/zone"
+
+# Where the named objects live in the snapshot, relative to the device entry
+_INDEX_PATHS = {
+    'vr': 'network/virtual-router/entry',
+    'interface': 'network/interface/ethernet/entry',
+    'profile': 'network/profiles/interface-management-profile/entry',
+    'zone': 'vsys/entry/zone/entry',
+}
+
+_STEP_RE = re.compile(r"^([\w-]+)(?:\[@name='([^']*)'\])?$")
+_SELECT_RE = re.compile(r"^([\w-]+)(?:\[(.*)\])?$")
+_TERM_RE = re.compile(r"(@name|text\(\))='([^']*)'")
+_DELETE_RE = re.compile(r"^([\w-]+)\[((?:@name|text\(\))='[^']*'(?: or (?:@name|text\(\))='[^']*')+)\]$")
+
+DEFAULT_SNAPSHOT_DIR = '~/.ansible/panos_snapshot'
+
+
+#Split an xpath in steps, slashes inside predicates (ethernet1/1) are kept
+def split_xpath(xpath):
+    steps = []
+    step = ''
+    depth = 0
+    for ch in xpath:
+        if ch == '[':
+            depth += 1
+        elif ch == ']':
+            depth -= 1
+        if ch == '/' and depth == 0:
+            if step:
+                steps.append(step)
+            step = ''
+        else:
+            step += ch
+    if step:
+        steps.append(step)
+    return steps
+
+
+#Find a node by absolute xpath, create missing nodes when create is set
+def find_xpath(root, xpath, create=False):
+    steps = split_xpath(xpath)
+    if not steps or steps[0] != root.tag:
+        return None
+    node = root
+    for step in steps[1:]:
+        child = node.find(step.replace('text()=', '.='))
+        if child is None:
+            match = _STEP_RE.match(step)
+            if not create or match is None:
+                return None
+            child = ET.SubElement(node, match.group(1))
+            if match.group(2) is not None:
+                child.set('name', match.group(2))
+        node = child
+    return node
+
+
+#Split a union of xpaths (a|b) in its xpaths
+def split_union(xpath):
+    parts = ['']
+    depth = 0
+    for ch in xpath:
+        if ch == '[':
+            depth += 1
+        elif ch == ']':
+            depth -= 1
+        if ch == '|' and depth == 0:
+            parts.append('')
+        else:
+            parts[-1] += ch
+    return [p.strip() for p in parts if p.strip()]
+
+
+#Children of node that match an xpath step, entry, entry[@name='a'],
+#entry[@name='a' or @name='b'] or member[text()='a']
+def _select_step(node, step):
+    match = _SELECT_RE.match(step)
+    if match is None:
+        return []
+    children = node.findall(match.group(1))
+    if not match.group(2):
+        return children
+    terms = _TERM_RE.findall(match.group(2))
+    return [c for c in children
+            if any((c.get('name') if key == '@name' else c.text) == value for key, value in terms)]
+
+
+#Copies of the nodes at xpath the way the xml api get returns them. Every
+#step can select several nodes, an xpath ending in /@name only returns the
+#entries with their name. A union (a|b) returns the nodes of all its xpaths in
+#document order, so vr/entry/@name|vr/entry/interface gives each VR name
+#followed by its interface list.
+def select_xpath(root, xpath):
+    found = []
+    for part in split_union(xpath):
+        names_only = part.endswith('/@name')
+        if names_only:
+            part = part[:-len('/@name')]
+        steps = split_xpath(part)
+        if not steps or steps[0] != root.tag:
+            continue
+        nodes = [root]
+        for step in steps[1:]:
+            nodes = [child for node in nodes for child in _select_step(node, step)]
+        found.extend((node, names_only) for node in nodes)
+    if len(found) > 1 and '|' in xpath:
+        order = dict((node, i) for i, node in enumerate(root.iter()))
+        found.sort(key=lambda item: order[item[0]])
+    return [ET.Element(node.tag, name=node.get('name')) if names_only else deepcopy(node)
+            for node, names_only in found]
+
+
+#Merge element into node, the way the xml api set does
+def merge_element(node, element):
+    for child in element:
+        if child.tag == 'member':
+            if child.text not in [m.text for m in node.findall('member')]:
+                node.append(child)
+            continue
+        if child.get('name') is not None:
+            existing = node.find("%s[@name='%s']" % (child.tag, child.get('name')))
+        else:
+            existing = node.find(child.tag)
+        if existing is None:
+            node.append(child)
+        elif len(child) == 0:
+            existing.text = child.text
+        else:
+            merge_element(existing, child)
+
+
+#Apply a set, edit or delete to a config tree. A delete can remove several
+#entries or members of a parent with [@name='a' or @name='b'].
+def apply_config(root, action, xpath, element=None):
+    if action == 'set':
+        node = find_xpath(root, xpath, create=True)
+        merge_element(node, ET.fromstring('<root>%s</root>' % element))
+    elif action == 'edit':
+        steps = split_xpath(xpath)
+        parent = find_xpath(root, '/' + '/'.join(steps[:-1]), create=True)
+        new = ET.fromstring(element)
+        old = find_xpath(root, xpath)
+        if old is not None:
+            index = list(parent).index(old)
+            parent.remove(old)
+            parent.insert(index, new)
+        else:
+            parent.append(new)
+    elif action == 'delete':
+        steps = split_xpath(xpath)
+        match = _DELETE_RE.match(steps[-1])
+        if match is not None:
+            parent = find_xpath(root, '/' + '/'.join(steps[:-1]))
+            keys = re.findall(r"(@name|text\(\))='([^']*)'", match.group(2))
+            for node in list(parent) if parent is not None else []:
+                value = node.get('name') if keys[0][0] == '@name' else node.text
+                if (node.tag == match.group(1) and value in [v for k, v in keys]):
+                    parent.remove(node)
+            return
+        node = find_xpath(root, xpath)
+        if node is not None:
+            find_xpath(root, '/' + '/'.join(steps[:-1])).remove(node)
+
+
+#Named objects of a config tree by kind (vr, interface, profile, zone) and name
+def index_config(root):
+    device = find_xpath(root, _DEVICE_XPATH)
+    if device is None:
+        return dict((kind, {}) for kind in _INDEX_PATHS)
+    return dict((kind, dict((e.get('name'), e) for e in device.findall(path)))
+                for kind, path in _INDEX_PATHS.items())
+
+
+def snapshot_path(hostname, snapshot_dir=None):
+    return os.path.join(os.path.expanduser(snapshot_dir or DEFAULT_SNAPSHOT_DIR),
+                        re.sub(r'[^\w.-]', '_', hostname) + '.json')
+
+
+#Config tree of the snapshot on disk without contacting the device, whatever
+#its age. None when there is no snapshot.
+def read_snapshot(hostname, snapshot_dir=None):
+    path = snapshot_path(hostname, snapshot_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return ET.fromstring(json.load(f)['config'])
+    except (ValueError, KeyError, ET.ParseError):
+        return None
+
+
+#Id of the last commit job, used to see if the config changed on the device
+def config_version(xapi):
+    xapi.op(cmd='<show><jobs><all></all></jobs></show>')
+    ids = [int(job.findtext('id')) for job in xapi.element_root.iter('job')
+           if job.findtext('type') == 'Commit' and job.findtext('id')]
+    return max(ids) if ids else 0
+
+
+class Snapshot(object):
+
+    def __init__(self, xapi, hostname, snapshot_dir=None, ttl=300):
+        self.xapi = xapi
+        self.ttl = ttl
+        self.path = snapshot_path(hostname, snapshot_dir)
+        self.root = None
+        self.version = None
+        self.fetched = None
+        self.index = {}
+
+    #Load the snapshot from disk, fetch it from the device when stale
+    def load(self):
+        if self.root is not None:
+            return
+        data = self._read()
+        if data is None:
+            self.refresh()
+            return
+        self.root = ET.fromstring(data['config'])
+        self.version = data['version']
+        self.fetched = data['fetched']
+        if time.time() - self.fetched >= self.ttl:
+            if config_version(self.xapi) != self.version:
+                self.refresh()
+                return
+            self.fetched = time.time()
+            self.save()
+        self._build_index()
+
+    #Fetch the network config and zones from the device
+    def refresh(self):
+        self.version = config_version(self.xapi)
+        self.root = ET.Element('config')
+        device = find_xpath(self.root, _DEVICE_XPATH, create=True)
+
+        self.xapi.get(xpath=_NETWORK_XPATH)
+        network = self.xapi.element_root.find('./result/network')
+        device.append(network if network is not None else ET.Element('network'))
+
+        self.xapi.get(xpath=_ZONE_XPATH)
+        zones = find_xpath(self.root, _ZONE_XPATH, create=True)
+        for zone in self.xapi.element_root.findall('./result/zone'):
+            merge_element(zones, zone)
+
+        self.fetched = time.time()
+        self.save()
+        self._build_index()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        data = dict(fetched=self.fetched, version=self.version,
+                    config=ET.tostring(self.root).decode('utf-8'))
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, self.path)
+
+    def invalidate(self):
+        self.root = None
+        self.index = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    #Lookup a vr, interface, profile or zone by name
+    def find(self, kind, name):
+        self.load()
+        return self.index[kind].get(name)
+
+    def exists(self, kind, name):
+        return self.find(kind, name) is not None
+
+    #Get a node by device xpath
+    def get(self, xpath):
+        self.load()
+        return find_xpath(self.root, xpath)
+
+    #Mirror a change that was sent to the device
+    def apply(self, action, xpath, element=None):
+        if self.root is None or not xpath.startswith(_DEVICE_XPATH):
+            return
+        apply_config(self.root, action, xpath, element)
+        self.save()
+        self._build_index()
+
+    def wrap(self, xapi=None):
+        return SnapshotXapi(xapi or self.xapi, self)
+
+    def _read(self):
+        if not self.ttl or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def _build_index(self):
+        self.index = index_config(self.root)
+
+
+class SnapshotXapi(object):
+    # Passes calls to the xapi and mirrors the config changes in the snapshot
+
+    def __init__(self, xapi, snapshot):
+        self._xapi = xapi
+        self._snapshot = snapshot
+
+    def set(self, xpath=None, element=None, **kwargs):
+        self._xapi.set(xpath=xpath, element=element, **kwargs)
+        self._snapshot.apply('set', xpath, element)
+
+    def edit(self, xpath=None, element=None, **kwargs):
+        self._xapi.edit(xpath=xpath, element=element, **kwargs)
+        self._snapshot.apply('edit', xpath, element)
+
+    def delete(self, xpath=None, **kwargs):
+        self._xapi.delete(xpath=xpath, **kwargs)
+        self._snapshot.apply('delete', xpath)
+
+    def multi_config(self, element=None):
+        multi_config(self._xapi, element)
+        replay(element, self._snapshot.apply)
+
+    def __getattr__(self, name):
+        return getattr(self._xapi, name)
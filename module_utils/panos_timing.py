@@ -0,0 +1,111 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Per call timings for the ON2IT panos modules.
+#
+# connect() wraps the xapi in a TimedXapi when the module has a Timer. Every
+# XML API request (keygen, get, set, op, commit, ...) is recorded with its
+# xpath, request and response size, latency and retries. Timer.attach() adds
+# the records as timings to the result of the module and appends them to a
+# JSON-lines file, so slow devices and slow xpaths can be found across runs.
+
+import json
+import os
+import time
+
+_SIZE_ARGS = ('xpath', 'element', 'cmd')
+_CALLS = ('keygen', 'get', 'show', 'set', 'edit', 'delete', 'op', 'commit', 'multi_config', 'import_file', 'ad_hoc')
+
+
+class Timer(object):
+
+    def __init__(self, log_path=None, module_name=None):
+        self.log_path = os.path.expanduser(log_path) if log_path else None
+        self.module_name = module_name
+        self.records = []
+
+    def wrap(self, xapi):
+        return TimedXapi(xapi, self)
+
+    def report(self):
+        return dict(calls=self.records,
+                    count=len(self.records),
+                    total=round(sum(r['latency'] for r in self.records), 3))
+
+    #Append the records to the JSON-lines log
+    def flush(self, hostname):
+        if not self.log_path or not self.records:
+            return
+        directory = os.path.dirname(self.log_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.log_path, 'a') as f:
+            for record in self.records:
+                line = dict(record, host=hostname, module=self.module_name)
+                f.write(json.dumps(line, sort_keys=True) + '\n')
+        self.records = []
+
+    #Add the timings to the result of every exit_json and fail_json of the module
+    def attach(self, module, hostname, report=True):
+        def wrap(func):
+            def call(**kwargs):
+                if report:
+                    kwargs['timings'] = self.report()
+                self.flush(hostname)
+                func(**kwargs)
+            return call
+        module.exit_json = wrap(module.exit_json)
+        module.fail_json = wrap(module.fail_json)
+
+
+class TimedXapi(object):
+    # Passes calls to the xapi and records a timing per call
+
+    def __init__(self, xapi, timer):
+        self._xapi = xapi
+        self._timer = timer
+
+    def _response_size(self):
+        document = getattr(self._xapi, 'xml_document', None)
+        return len(document) if document else 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._xapi, name)
+        if name not in _CALLS:
+            return attr
+
+        def call(*args, **kwargs):
+            #pan-python generates the key on the first call, time it on its own
+            if (name != 'keygen' and hasattr(self._xapi, 'keygen') and
+                    getattr(self._xapi, 'api_key', '') is None):
+                self.keygen()
+            retries = getattr(self._xapi, 'retries', 0)
+            start = time.time()
+            status = 'success'
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                self._timer.records.append(dict(
+                    call=name,
+                    xpath=kwargs.get('xpath'),
+                    request_size=sum(len(kwargs[k]) for k in _SIZE_ARGS if kwargs.get(k)),
+                    response_size=self._response_size(),
+                    latency=round(time.time() - start, 4),
+                    retries=getattr(self._xapi, 'retries', 0) - retries,
+                    status=status,
+                    start=round(start, 3)))
+        return call
@@ -0,0 +1,118 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Multi-config transactions for the ON2IT panos modules.
+#
+# A Transaction is used in place of the xapi. set, edit and delete calls are
+# queued, flush() sends them as type=config&action=multi-config requests. The
+# device applies all operations of a request or none of them. Large queues are
+# split in batches of at most max_ops operations and max_payload bytes, each
+# batch is atomic on its own. Other calls (get, op, commit) go straight to the
+# xapi.
+
+import xml.etree.ElementTree as ET
+
+DEFAULT_MAX_OPS = 500
+DEFAULT_MAX_PAYLOAD = 500000
+
+
+#Send a multi-config request, pan-python versions without multi_config use ad_hoc
+def multi_config(xapi, element):
+    if hasattr(xapi, 'multi_config'):
+        xapi.multi_config(element=element)
+    else:
+        try:
+            from urllib import urlencode
+        except ImportError:
+            from urllib.parse import urlencode
+        xapi.ad_hoc(qs=urlencode(dict(type='config', action='multi-config', element=element)),
+                    modify_qs=True)
+
+
+#xpath as XML attribute value, xml.sax.saxutils is not imported for this as it
+#loads urllib.request and ssl
+def escape_attr(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+#Operation element of a multi-configure-request
+def operation_xml(op_id, action, xpath, element=None):
+    attrs = 'id="%d" xpath="%s"' % (op_id, escape_attr(xpath))
+    if element is None:
+        return '<%s %s/>' % (action, attrs)
+    return '<%s %s>%s</%s>' % (action, attrs, element, action)
+
+
+class Transaction(object):
+
+    def __init__(self, xapi, max_ops=DEFAULT_MAX_OPS, max_payload=DEFAULT_MAX_PAYLOAD):
+        self._xapi = xapi
+        self.max_ops = max_ops
+        self.max_payload = max_payload
+        self.queue = []
+        self.results = []
+
+    def set(self, xpath=None, element=None):
+        self.queue.append(('set', xpath, element))
+
+    def edit(self, xpath=None, element=None):
+        self.queue.append(('edit', xpath, element))
+
+    def delete(self, xpath=None):
+        self.queue.append(('delete', xpath, None))
+
+    #Queued operations as multi-configure-request elements, split in batches
+    def batches(self):
+        batches = []
+        ops = []
+        size = 0
+        for op_id, (action, xpath, element) in enumerate(self.queue, 1):
+            xml = operation_xml(op_id, action, xpath, element)
+            if ops and (len(ops) >= self.max_ops or size + len(xml) > self.max_payload):
+                batches.append(ops)
+                ops = []
+                size = 0
+            ops.append((op_id, action, xpath, xml))
+            size += len(xml)
+        if ops:
+            batches.append(ops)
+        return batches
+
+    #Send the queued operations, returns the result per operation
+    def flush(self):
+        for ops in self.batches():
+            element = '<multi-configure-request>' + ''.join(op[3] for op in ops) + '</multi-configure-request>'
+            multi_config(self._xapi, element)
+            responses = {}
+            if self._xapi.element_root is not None:
+                for response in self._xapi.element_root.findall('./result/response'):
+                    responses[response.get('id')] = response
+            for op_id, action, xpath, xml in ops:
+                response = responses.get(str(op_id))
+                self.results.append(dict(
+                    id=op_id, action=action, xpath=xpath,
+                    status=response.get('status') if response is not None else 'success',
+                    msg=' '.join(t.strip() for t in response.itertext() if t.strip()) if response is not None else None))
+        self.queue = []
+        return self.results
+
+    def __getattr__(self, name):
+        return getattr(self._xapi, name)
+
+
+#Apply the operations of a multi-configure-request with apply(action, xpath, element)
+def replay(element, apply):
+    for op in ET.fromstring(element):
+        inner = ''.join(ET.tostring(child).decode('utf-8') for child in op)
+        apply(op.tag, op.get('xpath'), inner or None)
@@ -0,0 +1,147 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Operational state checks after a commit for the ON2IT panos modules.
+#
+# A committed config is not the same as a working one: a DHCP interface may not
+# get a lease, a link may be down, a static route may not be installed because
+# its nexthop is not reachable. With verify set the modules check the changed
+# objects after the commit. All interfaces come from a single show interface
+# all, all routes of a VR from a single show routing route, the response is
+# indexed by name or prefix and every changed object is looked up in it.
+#
+# wait_converged() repeats that one op call until every object is as expected
+# or the timeout passes, backing off like wait_jobs, so a task with a hundred
+# routes costs a handful of requests instead of a hundred polls.
+
+import random
+import time
+
+from ansible.module_utils.panos_prefix import prefix_bits
+
+INTERFACES_CMD = '<show><interface>all</interface></show>'
+
+
+#show routing route of one VR
+def routes_cmd(vr_name):
+    return '<show><routing><route><virtual-router>%s</virtual-router></route></routing></show>' % vr_name
+
+
+#Logical interfaces of a show interface all response by name, with zone, vr,
+#ip and the link state of their port (None when the port has no hw entry)
+def interface_index(element_root):
+    hw = {}
+    for entry in element_root.findall('./result/hw/entry'):
+        hw[entry.findtext('name')] = entry.findtext('state')
+    index = {}
+    for entry in element_root.findall('./result/ifnet/entry'):
+        name = entry.findtext('name')
+        fwd = entry.findtext('fwd') or ''
+        index[name] = dict(
+            zone=entry.findtext('zone') or None,
+            vr=fwd[3:] if fwd.startswith('vr:') else None,
+            ip=entry.findtext('ip'),
+            state=hw.get(name, hw.get(name.split('.')[0])),
+        )
+    return index
+
+
+#Routes of a show routing route response by prefix, a list of entries per
+#prefix for ECMP routes
+def route_index(element_root):
+    index = {}
+    for entry in element_root.findall('./result/entry'):
+        index.setdefault(prefix_bits(entry.findtext('destination') or ''), []).append(dict(
+            nexthop=entry.findtext('nexthop'),
+            flags=(entry.findtext('flags') or '').split(),
+            interface=entry.findtext('interface'),
+        ))
+    return index
+
+
+#What is wrong with interface (if_name, zone_name, vr_name, if_type and
+#if_address) in the index, None when it is up as configured
+def check_interface(index, interface):
+    state = index.get(interface['if_name'])
+    if state is None:
+        return "not in show interface all"
+    if state['zone'] != interface['zone_name']:
+        return "zone is %s" % state['zone']
+    if state['vr'] != interface['vr_name']:
+        return "virtual router is %s" % state['vr']
+    if state['state'] not in (None, 'up'):
+        return "link is %s" % state['state']
+    if (interface['if_type'] == "static"):
+        if (prefix_bits(interface['if_address']) is not None and state['ip'] != interface['if_address']):
+            return "address is %s" % state['ip']
+    else:
+        address = prefix_bits(state['ip'] or '')
+        if (address is None or address[1] == 0):
+            return "no DHCP lease"
+    return None
+
+
+#What is wrong with route (destination, nexthop and nexthoptype) in the index,
+#None when an active static route to the nexthop is installed
+def check_route(index, route):
+    entries = [e for e in index.get(prefix_bits(route['destination']), []) if 'S' in e['flags']]
+    if not entries:
+        return "not in the route table"
+    if (route.get('nexthoptype') or 'ip') == "ip":
+        matching = [e for e in entries if e['nexthop'] == route['nexthop']]
+        if not matching:
+            return "nexthop is %s" % ', '.join(sorted(set(e['nexthop'] or '' for e in entries)))
+        entries = matching
+    if not any('A' in e['flags'] for e in entries):
+        return "not active"
+    return None
+
+
+#Objects the op call cannot show, routes to an address object for example
+def unverifiable(route):
+    return prefix_bits(route['destination']) is None
+
+
+#Run cmd until check finds nothing wrong with any of objects (name, object),
+#one op call per round with exponential back-off and jitter. Returns per object
+#name, verified and msg, and the number of op calls.
+def wait_converged(xapi, cmd, index, check, objects, timeout=60, interval=1.0, max_interval=10.0,
+                   backoff=2.0, jitter=0.25, sleep=time.sleep):
+    start = time.time()
+    results = dict((name, dict(name=name, verified=False, msg=None)) for name, obj in objects)
+    pending = list(objects)
+    delay = interval
+    polls = 0
+
+    while pending:
+        xapi.op(cmd=cmd)
+        polls += 1
+        state = index(xapi.element_root)
+        now = time.time()
+        waiting = []
+        for name, obj in pending:
+            problem = check(state, obj)
+            if problem is None:
+                results[name].update(verified=True, msg="ok", waited=round(now - start, 3))
+            else:
+                results[name]['msg'] = problem
+                waiting.append((name, obj))
+        pending = waiting
+        if not pending or now - start >= timeout:
+            break
+        pause = min(delay * random.uniform(1 - jitter, 1 + jitter), timeout - (now - start))
+        sleep(max(pause, 0))
+        delay = min(delay * backoff, max_interval)
+
+    return [results[name] for name, obj in objects], polls
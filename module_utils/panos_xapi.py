@@ -0,0 +1,312 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Connection to the XML API for the ON2IT panos modules.
+#
+# connect() builds the PanXapi from the module parameters. With api_key the key
+# is used as is. With api_key_cache the key generated for (host, username) is
+# stored encrypted on disk, so the next tasks skip the keygen request. The
+# cache file is encrypted with a key derived from the password, it can only be
+# read by a task that knows the password. When the device rejects a cached key
+# the key is generated again and the call is retried once.
+#
+# When the play uses the panos_xapi connection plugin, the requests are sent
+# through the persistent connection instead, which keeps one HTTPS connection
+# and API key per device open for the whole play.
+#
+# Either way the requests pass a RetryXapi (panos_retry), which retries a busy
+# management plane, waits out commit locks and limits the request rate.
+#
+# pan-python, cryptography and the persistent connection are imported when
+# first used, not when a module starts. The modules call load_pan() after the
+# arguments are validated; check mode and compile_to never load pan-python.
+
+import base64
+import hashlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.panos_retry import RetryXapi, device_limiter
+
+DEFAULT_KEY_CACHE_DIR = '~/.ansible/panos_keys'
+
+_KDF_ITERATIONS = 20000
+_AUTH_ERRORS = ('invalid credential', 'invalid key', 'code: 403', 'code=403')
+
+
+class PanXapiError(Exception):
+    # Stands in for pan.xapi.PanXapiError until load_pan() imports pan-python,
+    # nothing raises it before that
+    pass
+
+
+#Import pan-python, returns pan.xapi or None when pan-python is not installed.
+#PanXapiError of this module is the pan.xapi class afterwards.
+def load_pan():
+    global pan, PanXapiError
+    try:
+        import pan.xapi
+    except ImportError:
+        return None
+    PanXapiError = pan.xapi.PanXapiError
+    return pan.xapi
+
+
+#True when the cryptography library of the key cache is installed
+def has_cryptography():
+    try:
+        importlib.import_module('cryptography.fernet')
+    except ImportError:
+        return False
+    return True
+
+
+#True when the PanXapiError is caused by a rejected key or password
+def is_auth_error(exc):
+    message = str(getattr(exc, 'message', '') or exc).lower()
+    return any(e in message for e in _AUTH_ERRORS)
+
+
+class KeyCache(object):
+    # Encrypted, file backed cache of the api key of one (host, username)
+
+    def __init__(self, hostname, username, password, cache_dir=None, ttl=86400):
+        self.password = password
+        self.ttl = ttl
+        name = hashlib.sha256(('%s|%s' % (hostname, username)).encode('utf-8')).hexdigest()
+        self.path = os.path.join(os.path.expanduser(cache_dir or DEFAULT_KEY_CACHE_DIR), name + '.json')
+
+    def _fernet(self, salt):
+        from cryptography.fernet import Fernet
+        key = hashlib.pbkdf2_hmac('sha256', self.password.encode('utf-8'), salt, _KDF_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    #Cached api key, None when missing, expired or not readable with this password
+    def get(self):
+        from cryptography.fernet import InvalidToken
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            salt = base64.b64decode(data['salt'])
+            return self._fernet(salt).decrypt(data['token'].encode('ascii'), ttl=self.ttl).decode('utf-8')
+        except (ValueError, KeyError, InvalidToken):
+            return None
+
+    def store(self, api_key):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        salt = os.urandom(16)
+        data = dict(salt=base64.b64encode(salt).decode('ascii'),
+                    token=self._fernet(salt).encrypt(api_key.encode('utf-8')).decode('ascii'),
+                    created=time.time())
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, self.path)
+
+    def invalidate(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class KeyCacheXapi(object):
+    # Passes calls to the xapi, a rejected cached key is generated again once
+
+    def __init__(self, xapi, cache):
+        self._xapi = xapi
+        self._cache = cache
+        self._renewed = False
+        self.retries = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._xapi, name)
+        if not callable(attr) or name == 'keygen':
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except PanXapiError as exc:
+                if self._renewed or not is_auth_error(exc):
+                    raise
+                self._renewed = True
+                self.retries += 1
+                self._cache.invalidate()
+                self._xapi.api_key = None
+                self._cache.store(self._xapi.keygen())
+                return attr(*args, **kwargs)
+        return call
+
+
+class PersistentXapi(object):
+    # The part of PanXapi the modules use, sent through the panos_xapi connection plugin.
+    # The response is only parsed as far as needed, element_root builds the full tree on first use.
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._root = None
+        self.status = None
+        self.api_key = None
+        self.xml_document = None
+
+    @property
+    def element_root(self):
+        if self._root is None and self.xml_document is not None:
+            self._root = ET.fromstring(self.xml_document)
+        return self._root
+
+    def _events(self, events):
+        data = self.xml_document.encode('utf-8')
+        return ET.iterparse(io.BytesIO(data), events=events)
+
+    def _request(self, query):
+        from ansible.module_utils.connection import ConnectionError
+        try:
+            body = self._connection.xapi_request(dict((k, v) for k, v in query.items() if v is not None))
+        except ConnectionError as exc:
+            #A 503 or a dropped connection of the plugin, classified like the pan-python errors
+            raise PanXapiError(str(exc))
+        self.xml_document = body
+        self._root = None
+        try:
+            event, response = next(iter(self._events(('start',))))
+        except (ET.ParseError, StopIteration):
+            raise PanXapiError('Invalid response: %s' % body[:200])
+        self.status = response.get('status')
+        if self.status != 'success':
+            msg = ' '.join(t.strip() for t in self.element_root.itertext() if t.strip())
+            raise PanXapiError(msg or 'Request failed with status %s' % self.status)
+
+    #First child with tag of the result, parsing stops at its end tag
+    def find_result(self, tag):
+        depth = 0
+        for event, element in self._events(('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 2:
+                if element.tag == tag:
+                    return element
+                element.clear()
+            if depth == 1 and element.tag == 'result':
+                return None
+        return None
+
+    def get(self, xpath=None):
+        self._request(dict(type='config', action='get', xpath=xpath))
+
+    def show(self, xpath=None):
+        self._request(dict(type='config', action='show', xpath=xpath))
+
+    def set(self, xpath=None, element=None):
+        self._request(dict(type='config', action='set', xpath=xpath, element=element))
+
+    def edit(self, xpath=None, element=None):
+        self._request(dict(type='config', action='edit', xpath=xpath, element=element))
+
+    def delete(self, xpath=None):
+        self._request(dict(type='config', action='delete', xpath=xpath))
+
+    def op(self, cmd=None):
+        self._request(dict(type='op', cmd=cmd))
+
+    def multi_config(self, element=None):
+        self._request(dict(type='config', action='multi-config', element=element))
+
+    def commit(self, cmd=None, action=None, sync=False, interval=None, timeout=None):
+        self._request(dict(type='commit', cmd=cmd, action=action))
+        job = self.element_root.findtext('./result/job')
+        if not sync or not job:
+            return
+        start = time.time()
+        while True:
+            self.op(cmd='<show><jobs><id>%s</id></jobs></show>' % job)
+            if self.element_root.findtext('./result/job/status') == 'FIN':
+                return
+            if timeout is not None and time.time() - start > timeout:
+                raise PanXapiError('Timeout waiting for commit job %s' % job)
+            time.sleep(interval or 0.5)
+
+
+#PanXapi for the ip_address, username, password and api_key module parameters,
+#the requests are retried, rate limited and recorded by timer when given
+def connect(module, timer=None):
+    params = module.params
+    hostname = params['ip_address']
+    #The rate of a busy device is kept next to the key cache for the next tasks
+    limiter = device_limiter(hostname, params.get('api_rate') or 0,
+                             params.get('api_key_cache_dir') or DEFAULT_KEY_CACHE_DIR)
+    retries = params.get('api_retries')
+    lock_timeout = params.get('api_lock_timeout')
+
+    def wrap(xapi):
+        xapi = RetryXapi(xapi, limiter,
+                         retries=3 if retries is None else retries,
+                         lock_timeout=300 if lock_timeout is None else lock_timeout)
+        return timer.wrap(xapi) if timer else xapi
+
+    xapi_lib = load_pan()
+    if xapi_lib is None:
+        module.fail_json(msg='pan-python is required for this module')
+    if getattr(module, '_socket_path', None):
+        from ansible.module_utils.connection import Connection
+        return wrap(PersistentXapi(Connection(module._socket_path)))
+
+    username = params['username']
+    password = params.get('password')
+    api_key = params.get('api_key')
+
+    if not password and not api_key:
+        module.fail_json(msg='one of the following is required: password, api_key')
+    if api_key:
+        return wrap(xapi_lib.PanXapi(hostname=hostname, api_key=api_key))
+
+    key_cache = params.get('api_key_cache') and has_cryptography()
+    if params.get('api_key_cache') and not key_cache:
+        module.warn('cryptography is required for api_key_cache, the api key is not cached')
+    if not key_cache:
+        return wrap(xapi_lib.PanXapi(hostname=hostname, api_username=username, api_password=password))
+
+    cache = KeyCache(hostname, username, password, params.get('api_key_cache_dir'), params.get('api_key_ttl'))
+    xapi = wrap(xapi_lib.PanXapi(hostname=hostname, api_username=username, api_password=password,
+                                 api_key=cache.get()))
+    if xapi.api_key is None:
+        cache.store(xapi.keygen())
+    return KeyCacheXapi(xapi, cache)
+
+
+#First child with tag of the result of the last response, without parsing the
+#rest of the response where the xapi supports it
+def first_result(xapi, tag='entry'):
+    find = getattr(xapi, 'find_result', None)
+    if find is not None:
+        return find(tag)
+    if xapi.element_root is None:
+        return None
+    return xapi.element_root.find('./result/' + tag)
+
+
+#True when the entry at xpath exists, only the name of the entry is requested
+def entry_exists(xapi, xpath):
+    xapi.get(xpath=xpath + '/@name')
+    return first_result(xapi) is not None
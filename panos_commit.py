@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+#  Copyright 2018 ON2IT B.V.
+#  Based upon the ansible-pan modules by Palo Alto Networks, inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+DOCUMENTATION = '''
+---
+module: panos_commit
+short_description: commit the deferred changes of a device.
+description:
+    - Commit a device once for all changes made with commit_mode deferred by panos_vr, panos_interface and
+      panos_int_mgt_profile.
+author: "Rob Maas (@robm83)"
+requirements:
+    - pan-python can be obtained from PyPi U(https://pypi.python.org/pypi/pan-python)
+note:
+    - Based upon the 'ansible-pan' modules.
+    - Not extensively tested.
+options:
+    ip_address:
+        description:
+            - IP address (or hostname) of PAN-OS device being configured.
+        required: true
+    username:
+        description:
+            - Username credentials to use for auth.
+        default: "admin"
+    password:
+        description:
+            - Password credentials to use for auth, required unless api_key is given.
+    api_key:
+        description:
+            - API key to use instead of username and password.
+    api_key_cache:
+        description:
+            - Cache the generated API key encrypted on disk, so the next tasks for the device skip the keygen request.
+              Requires the cryptography library.
+        default: false
+    api_key_cache_dir:
+        description:
+            - Directory of the API key cache
+        default: "~/.ansible/panos_keys"
+    api_key_ttl:
+        description:
+            - Seconds a cached API key is used
+        default: 86400
+    api_retries:
+        description:
+            - Times a request is sent again when the management plane is busy or does not answer
+        default: 3
+    api_rate:
+        description:
+            - Maximum API requests per second to the device, 0 is unlimited. The rate is lowered when the device
+              is busy and raised again when it answers in time. A lowered rate is saved in api_key_cache_dir, the
+              next tasks for the device start from it, raised by 0.5 for every second since. It is forgotten
+              after 10 minutes.
+        default: 0
+    api_lock_timeout:
+        description:
+            - Seconds to wait for a config or commit lock of another admin or commit
+        default: 300
+    partial:
+        description:
+            - Partial commit of only the changes made by the admins that changed the device
+        default: false
+    force:
+        description:
+            - Commit even when no deferred changes are recorded for the device
+        default: false
+    wait:
+        description:
+            - Wait for the commit to finish. When false the job_id is returned right away, use panos_commit_wait to
+              wait for it
+        default: true
+    template:
+        description:
+            - Panorama template to push after the commit, ip_address is the Panorama
+    template_stack:
+        description:
+            - Panorama template stack to push after the commit, ip_address is the Panorama
+    device_group:
+        description:
+            - Panorama device group to push, with its templates, after the commit
+    commit_state_dir:
+        description:
+            - Directory with the deferred commit state
+        default: "~/.ansible/panos_commit"
+'''
+
+EXAMPLES = '''
+    - name: Create VR Inside
+      panos_vr:
+        ip_address: "pan-vm.westeurope.cloudapp.azure.com"
+        username: "admin"
+        password: "admin"
+        vr_name: "inside"
+        operation: "add"
+        commit_mode: "deferred"
+      notify: commit firewall
+
+  handlers:
+    - name: commit firewall
+      panos_commit:
+        ip_address: "pan-vm.westeurope.cloudapp.azure.com"
+        username: "admin"
+        password: "admin"
+        partial: True
+'''
+
+RETURN='''
+# Default return values
+job_id:
+    description: Id of the commit job
+    returned: changed
+    type: string
+duration:
+    description: Seconds the commit took
+    returned: changed and wait is true
+    type: float
+push_job_id:
+    description: Id of the commit-all push job
+    returned: changed and template, template_stack or device_group is set
+    type: string
+'''
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import get_exception
+from ansible.module_utils.panos_xapi import connect, load_pan
+from ansible.module_utils.panos_commit import read_state, commit_pending
+from ansible.module_utils.panos_panorama import push
+
+
+def main():
+    global PanXapiError
+    argument_spec = dict(
+        ip_address=dict(required=True),
+        password=dict(no_log=True),
+        username=dict(default='admin'),
+        api_key=dict(no_log=True),
+        api_key_cache=dict(type='bool', default=False),
+        api_key_cache_dir=dict(),
+        api_key_ttl=dict(type='int', default=86400),
+        api_retries=dict(type='int', default=3),
+        api_rate=dict(type='float', default=0),
+        api_lock_timeout=dict(type='int', default=300),
+        partial=dict(type='bool', default=False),
+        force=dict(type='bool', default=False),
+        wait=dict(type='bool', default=True),
+        template=dict(),
+        template_stack=dict(),
+        device_group=dict(),
+        commit_state_dir=dict()
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False,
+                           mutually_exclusive=[['template', 'template_stack']])
+    #pan-python is imported after argument validation
+    xapi_lib = load_pan()
+    if xapi_lib is None:
+        module.fail_json(msg='pan-python is required for this module')
+    PanXapiError = xapi_lib.PanXapiError
+
+    ip_address = module.params['ip_address']
+    username = module.params['username']
+    partial = module.params['partial']
+    force = module.params['force']
+    state_dir = module.params['commit_state_dir']
+    template = module.params['template']
+    template_stack = module.params['template_stack']
+    device_group = module.params['device_group']
+
+    admins = read_state(ip_address, state_dir).get('admins')
+    if not admins and not force:
+        module.exit_json(changed=False, msg="No deferred changes, not committed")
+
+    if partial:
+        admins = admins or [username]
+    else:
+        admins = None
+
+    xapi = connect(module)
+
+    pushed = (template or template_stack or device_group)
+    try:
+        #The push needs the Panorama commit to be finished
+        result = commit_pending(xapi, ip_address, admins, state_dir, module.params['wait'] or pushed)
+        output = dict(changed=True, job_id=result['job_id'], duration=result['duration'], msg="committed")
+        if pushed:
+            output['push_job_id'] = push(xapi, device_group, template, template_stack, module.params['wait'])
+    except PanXapiError:
+        exc = get_exception()
+        module.fail_json(msg=exc.message)
+
+    module.exit_json(**output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+#  Copyright 2018 ON2IT B.V.
+#  Based upon the ansible-pan modules by Palo Alto Networks, inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+DOCUMENTATION = '''
+---
+module: panos_commit_wait
+short_description: wait for commit jobs to finish.
+description:
+    - Wait for one or more jobs started with commit_mode async (or panos_commit wait false). All jobs are polled with
+      a single show jobs call per round, the interval between rounds grows exponentially and has some jitter.
+author: "Rob Maas (@robm83)"
+requirements:
+    - pan-python can be obtained from PyPi U(https://pypi.python.org/pypi/pan-python)
+note:
+    - Based upon the 'ansible-pan' modules.
+    - Not extensively tested.
+options:
+    ip_address:
+        description:
+            - IP address (or hostname) of PAN-OS device being configured.
+        required: true
+    username:
+        description:
+            - Username credentials to use for auth.
+        default: "admin"
+    password:
+        description:
+            - Password credentials to use for auth, required unless api_key is given.
+    api_key:
+        description:
+            - API key to use instead of username and password.
+    api_key_cache:
+        description:
+            - Cache the generated API key encrypted on disk, so the next tasks for the device skip the keygen request.
+              Requires the cryptography library.
+        default: false
+    api_key_cache_dir:
+        description:
+            - Directory of the API key cache
+        default: "~/.ansible/panos_keys"
+    api_key_ttl:
+        description:
+            - Seconds a cached API key is used
+        default: 86400
+    api_retries:
+        description:
+            - Times a request is sent again when the management plane is busy or does not answer
+        default: 3
+    api_rate:
+        description:
+            - Maximum API requests per second to the device, 0 is unlimited. The rate is lowered when the device
+              is busy and raised again when it answers in time. A lowered rate is saved in api_key_cache_dir, the
+              next tasks for the device start from it, raised by 0.5 for every second since. It is forgotten
+              after 10 minutes.
+        default: 0
+    api_lock_timeout:
+        description:
+            - Seconds to wait for a config or commit lock of another admin or commit
+        default: 300
+    job_ids:
+        description:
+            - List of job ids to wait for
+        required: true
+    timeout:
+        description:
+            - Seconds to wait for all jobs
+        default: 600
+    interval:
+        description:
+            - Seconds before the second poll, doubled after each round
+        default: 1
+    max_interval:
+        description:
+            - Maximum seconds between polls
+        default: 30
+'''
+
+EXAMPLES = '''
+    - name: Create VR Inside
+      panos_vr:
+        ip_address: "{{ inventory_hostname }}"
+        username: "admin"
+        password: "admin"
+        vr_name: "inside"
+        operation: "add"
+        commit_mode: "async"
+      register: vr
+
+    - name: Wait for the commit
+      panos_commit_wait:
+        ip_address: "{{ inventory_hostname }}"
+        username: "admin"
+        password: "admin"
+        job_ids: ["{{ vr.job_id }}"]
+      when: vr.job_id is defined
+'''
+
+RETURN='''
+# Default return values
+jobs:
+    description: Per job id, status, result, progress, tenq and tfin as reported by the device, and the seconds waited
+    returned: always
+    type: list
+'''
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import get_exception
+from ansible.module_utils.panos_xapi import connect, load_pan
+from ansible.module_utils.panos_commit import wait_jobs
+
+
+def main():
+    global PanXapiError
+    argument_spec = dict(
+        ip_address=dict(required=True),
+        password=dict(no_log=True),
+        username=dict(default='admin'),
+        api_key=dict(no_log=True),
+        api_key_cache=dict(type='bool', default=False),
+        api_key_cache_dir=dict(),
+        api_key_ttl=dict(type='int', default=86400),
+        api_retries=dict(type='int', default=3),
+        api_rate=dict(type='float', default=0),
+        api_lock_timeout=dict(type='int', default=300),
+        job_ids=dict(type='list', required=True),
+        timeout=dict(type='int', default=600),
+        interval=dict(type='float', default=1),
+        max_interval=dict(type='float', default=30)
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+    #pan-python is imported after argument validation
+    xapi_lib = load_pan()
+    if xapi_lib is None:
+        module.fail_json(msg='pan-python is required for this module')
+    PanXapiError = xapi_lib.PanXapiError
+
+    job_ids = [str(j) for j in module.params['job_ids'] if j]
+
+    if not job_ids:
+        module.exit_json(changed=False, jobs=[], msg="No jobs to wait for")
+
+    xapi = connect(module)
+
+    try:
+        jobs, pending = wait_jobs(xapi, job_ids,
+                                  timeout=module.params['timeout'],
+                                  interval=module.params['interval'],
+                                  max_interval=module.params['max_interval'])
+    except PanXapiError:
+        exc = get_exception()
+        module.fail_json(msg=exc.message)
+
+    jobs = [jobs[j] for j in job_ids]
+    if pending:
+        module.fail_json(msg="Timeout waiting for jobs %s" % ', '.join(sorted(pending)), jobs=jobs)
+    failed = [job['id'] for job in jobs if job.get('result') != 'OK']
+    if failed:
+        module.fail_json(msg="Jobs failed: %s" % ', '.join(failed), jobs=jobs)
+
+    module.exit_json(changed=False, jobs=jobs, msg="jobs finished")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+#  Copyright 2018 ON2IT B.V.
+#  Based upon the ansible-pan modules by Palo Alto Networks, inc.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+DOCUMENTATION = '''
+---
+module: panos_config_push
+short_description: push a compiled candidate config to a device.
+description:
+    - Push the candidate config file built by panos_vr, panos_interface and panos_int_mgt_profile with compile_to.
+      The file is imported once and the network and zone subtrees are loaded with load config partial, so the whole
+      desired state takes a few API calls instead of several per object.
+author: "Rob Maas (@robm83)"
+requirements:
+    - pan-python can be obtained from PyPi U(https://pypi.python.org/pypi/pan-python)
+note:
+    - Based upon the 'ansible-pan' modules.
+    - Not extensively tested.
+    - The file upload is not supported over the panos_xapi connection, use connection local.
+options:
+    ip_address:
+        description:
+            - IP address (or hostname) of PAN-OS device being configured.
+        required: true
+    username:
+        description:
+            - Username credentials to use for auth.
+        default: "admin"
+    password:
+        description:
+            - Password credentials to use for auth, required unless api_key is given.
+    api_key:
+        description:
+            - API key to use instead of username and password.
+    api_key_cache:
+        description:
+            - Cache the generated API key encrypted on disk, so the next tasks for the device skip the keygen request.
+              Requires the cryptography library.
+        default: false
+    api_key_cache_dir:
+        description:
+            - Directory of the API key cache
+        default: "~/.ansible/panos_keys"
+    api_key_ttl:
+        description:
+            - Seconds a cached API key is used
+        default: 86400
+    api_retries:
+        description:
+            - Times a request is sent again when the management plane is busy or does not answer
+        default: 3
+    api_rate:
+        description:
+            - Maximum API requests per second to the device, 0 is unlimited. The rate is lowered when the device
+              is busy and raised again when it answers in time. A lowered rate is saved in api_key_cache_dir, the
+              next tasks for the device start from it, raised by 0.5 for every second since. It is forgotten
+              after 10 minutes.
+        default: 0
+    api_lock_timeout:
+        description:
+            - Seconds to wait for a config or commit lock of another admin or commit
+        default: 300
+    src:
+        description:
+            - Path of the candidate config file written with compile_to
+        required: true
+    xpaths:
+        description:
+            - Xpaths of the subtrees to load, default the network and the vsys1 zone subtrees
+    mode:
+        description:
+            - Load mode of the subtrees, merge, replace or append
+        default: "merge"
+    commit:
+        description:
+            - Commit after loading
+        default: true
+    commit_mode:
+        description:
+            - sync commits right away, deferred only records the change so the panos_commit module can commit once,
+              async starts the commit and returns its job_id without waiting
+        default: "sync"
+    commit_state_dir:
+        description:
+            - Directory with the deferred commit state
+        default: "~/.ansible/panos_commit"
+'''
+
+EXAMPLES = '''
+    - name: Compile VR Inside
+      panos_vr:
+        ip_address: "{{ inventory_hostname }}"
+        vr_name: "inside"
+        operation: "add"
+        compile_to: "build/{{ inventory_hostname }}.xml"
+
+    - name: Compile ethernet1/1
+      panos_interface:
+        ip_address: "{{ inventory_hostname }}"
+        if_name: "ethernet1/1"
+        if_type: "dhcp"
+        zone_name: "inside"
+        vr_name: "inside"
+        compile_to: "build/{{ inventory_hostname }}.xml"
+
+    - name: Push the compiled config
+      panos_config_push:
+        ip_address: "{{ inventory_hostname }}"
+        username: "admin"
+        password: "admin"
+        src: "build/{{ inventory_hostname }}.xml"
+'''
+
+RETURN='''
+# Default return values
+xpaths:
+    description: Xpaths of the loaded subtrees
+    returned: always
+    type: list
+job_id:
+    description: Id of the commit job
+    returned: when commit_mode is async
+    type: string
+'''
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+import os
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import get_exception
+from ansible.module_utils.panos_xapi import connect, load_pan
+from ansible.module_utils.panos_commit import mark_dirty, commit_async
+from ansible.module_utils.panos_compile import push_config
+
+
+def main():
+    global PanXapiError
+    argument_spec = dict(
+        ip_address=dict(required=True),
+        password=dict(no_log=True),
+        username=dict(default='admin'),
+        api_key=dict(no_log=True),
+        api_key_cache=dict(type='bool', default=False),
+        api_key_cache_dir=dict(),
+        api_key_ttl=dict(type='int', default=86400),
+        api_retries=dict(type='int', default=3),
+        api_rate=dict(type='float', default=0),
+        api_lock_timeout=dict(type='int', default=300),
+        src=dict(required=True),
+        xpaths=dict(type='list'),
+        mode=dict(default='merge', choices=['merge', 'replace', 'append']),
+        commit=dict(type='bool', default=True),
+        commit_mode=dict(default='sync', choices=['sync', 'deferred', 'async']),
+        commit_state_dir=dict()
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False,
+                           required_one_of=[['password', 'api_key']])
+    #pan-python is imported after argument validation
+    xapi_lib = load_pan()
+    if xapi_lib is None:
+        module.fail_json(msg='pan-python is required for this module')
+    PanXapiError = xapi_lib.PanXapiError
+
+    ip_address = module.params['ip_address']
+    username = module.params['username']
+    src = module.params['src']
+
+    if not os.path.exists(os.path.expanduser(src)):
+        module.fail_json(msg="Compiled config %s does not exist" % src)
+
+    xapi = connect(module)
+    if not hasattr(xapi, 'import_file'):
+        module.fail_json(msg="The panos_xapi connection can not upload files, use connection local")
+
+    result = dict(changed=True, msg="config pushed")
+    try:
+        result['xpaths'] = push_config(xapi, src, module.params['xpaths'], module.params['mode'])
+        if module.params['commit']:
+            if (module.params['commit_mode'] == "deferred"):
+                mark_dirty(ip_address, username, module.params['commit_state_dir'])
+            elif (module.params['commit_mode'] == "async"):
+                result['job_id'] = commit_async(xapi)
+            else:
+                xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+    except PanXapiError:
+        exc = get_exception()
+        module.fail_json(msg=exc.message)
+
+    module.exit_json(**result)
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,48 @@ note:
     - Based upon the 'ansible-pan' modules.
     - Not extensively tested.
 options:
+    ip_address:
+        description:
+            - IP address (or hostname) of PAN-OS device being configured.
+        required: true
+    username:
+        description:
+            - Username credentials to use for auth.
+        default: "admin"
+    password:
+        description:
+            - Password credentials to use for auth, required unless api_key or compile_to is given.
+    api_key:
+        description:
+            - API key to use instead of username and password.
+    api_key_cache:
+        description:
+            - Cache the generated API key encrypted on disk, so the next tasks for the device skip the keygen request.
+              Requires the cryptography library.
+        default: false
+    api_key_cache_dir:
+        description:
+            - Directory of the API key cache
+        default: "~/.ansible/panos_keys"
+    api_key_ttl:
+        description:
+            - Seconds a cached API key is used
+        default: 86400
+    api_retries:
+        description:
+            - Times a request is sent again when the management plane is busy or does not answer
+        default: 3
+    api_rate:
+        description:
+            - Maximum API requests per second to the device, 0 is unlimited. The rate is lowered when the device
+              is busy and raised again when it answers in time. A lowered rate is saved in api_key_cache_dir, the
+              next tasks for the device start from it, raised by 0.5 for every second since. It is forgotten
+              after 10 minutes.
+        default: 0
+    api_lock_timeout:
+        description:
+            - Seconds to wait for a config or commit lock of another admin or commit
+        default: 300
     http:
         description:
             - Enable HTTP
@@ -72,23 +114,97 @@ options:
         description:
             - enable User-ID Sysog Listener-UDP
         default: false
-    iplist: 
+    iplist:
         description:
-            - Allowed IP addressess, seperated by comma
-        defailt: none
+            - Allowed IP addresses and networks, a list or a string seperated by comma. The prefixes are normalized,
+              deduplicated and adjacent networks are collapsed, the permitted IPs of the profile on the device the
+              same way. Only the prefixes that differ are added, the removed ones are deleted with one request. Without iplist and iplist_file the permitted IPs of the profile are not
+              changed, an empty list removes them all.
+        default: none
+    iplist_file:
+        description:
+            - File with allowed IP addresses and networks, one or more per line seperated by comma, # starts a comment.
+              Added to iplist.
     name: 
         description:
             - Name of the management profile
         default: Allow_Ping
     operation:
         description:
-            - Operation, add or del
+            - Operation, add or del. With add an existing profile is updated, only the settings that differ are sent
         required: True
         default: add
+    snapshot_ttl:
+        description:
+            - Seconds a cached config snapshot of the device is used for existence checks, 0 disables the snapshot
+        default: 0
+    snapshot_dir:
+        description:
+            - Directory for the config snapshots
+        default: "~/.ansible/panos_snapshot"
+    rollback_points:
+        description:
+            - Before the first change, save the profile as a rollback point in rollback_dir
+        default: false
+    rollback_dir:
+        description:
+            - Directory of the rollback points, shared by all devices
+        default: "~/.ansible/panos_rollback"
+    rollback:
+        description:
+            - Id of a rollback point to restore, or last for the newest panos_int_mgt_profile point of the device. The
+              saved profile is put back with one edit when it differs, a profile that did not exist is deleted,
+              operation is ignored. Reports a change only when something was sent. A point of the profile before the
+              rollback is saved first.
+    template:
+        description:
+            - Panorama template to configure instead of a firewall, ip_address is the Panorama
+    template_stack:
+        description:
+            - Panorama template stack to configure instead of a firewall, ip_address is the Panorama
+    vsys:
+        description:
+            - Vsys of the zones
+        default: "vsys1"
+    device_group:
+        description:
+            - Device group to push to after the Panorama commit, with its templates. Without device_group the
+              template or template stack is pushed
+    check_config:
+        description:
+            - In check mode, exported config file (for example a C(show config) export or a compile_to file) to plan the
+              changes on. Without it the cached config snapshot of the device in snapshot_dir is used. Check mode never
+              connects to the device.
+    compile_to:
+        description:
+            - Path of a local candidate config file. The changes are applied to this file instead of the device, no API
+              call is made and nothing is committed. Push the file with the panos_config_push module.
+    multi_config:
+        description:
+            - Send all changes of the task as one multi-config request, the device applies all of them or none.
+              Very large changes are split in several requests. Requires PAN-OS 9.0 or later.
+        default: false
+    timings:
+        description:
+            - Return the type, xpath, request and response size, latency and retries of every API call in timings
+        default: false
+    timings_log:
+        description:
+            - Append the timings of every API call as JSON lines to this file, to compare devices and xpaths across runs
     commit:
         description:
             - Commit if changed
         default: true
+    commit_mode:
+        description:
+            - sync commits right away, deferred only records the change so the panos_commit module can commit once,
+              async starts the commit and returns its job_id, use panos_commit_wait to wait for it
+        choices: ['sync', 'deferred', 'async']
+        default: sync
+    commit_state_dir:
+        description:
+            - Directory with the deferred commit state
+        default: "~/.ansible/panos_commit"
 '''
 
 EXAMPLES = '''
@@ -104,6 +220,35 @@ EXAMPLES = '''
 
 RETURN='''
 # Default return values
+permitted_ip:
+    description: Permitted IPs added to and removed from the profile
+    returned: when operation is add and the profile changed
+    type: dict
+timings:
+    description: API calls of the task with call, xpath, request_size, response_size, latency, retries and status,
+        their count and total latency
+    returned: when timings is true
+    type: dict
+operations:
+    description: Per operation of the multi-config request, id, action, xpath, status and msg
+    returned: when multi_config is true
+    type: list
+job_id:
+    description: Id of the commit job, with a template or template_stack the id of the commit-all push job
+    returned: when the device changed and commit_mode is async, or template or template_stack is set
+    type: string
+rollback_point:
+    description: Id of the rollback point saved before the change
+    returned: when rollback_points or rollback is set and the device changed
+    type: string
+plan:
+    description: Action, xpath and element of every set, edit and delete the task would send
+    returned: in check mode when the device would change
+    type: list
+diff:
+    description: The VRs, interfaces, profiles and zones that would change, before and after, as XML
+    returned: in check mode with --diff
+    type: dict
 '''
 
 ANSIBLE_METADATA = {'metadata_version': '1.0',
@@ -112,71 +257,118 @@ ANSIBLE_METADATA = {'metadata_version': '1.0',
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.basic import get_exception
-from ansible.utils.display import Display
-display = Display()
-
-try:
-    import pan.xapi
-    from pan.xapi import PanXapiError
-    HAS_LIB = True
-except ImportError:
-    HAS_LIB = False
+#PanXapiError is the stand-in of panos_xapi until main() loads pan-python, check mode and compile_to never do
+from ansible.module_utils.panos_xapi import connect, first_result, load_pan, PanXapiError  # noqa: F401
+from ansible.module_utils.panos_snapshot import Snapshot
+from ansible.module_utils.panos_commit import mark_dirty, commit_async
+from ansible.module_utils.panos_transaction import Transaction
+from ansible.module_utils.panos_compile import CompiledConfig, plan_config
+from ansible.module_utils.panos_panorama import TemplateXapi, target_name, commit_push
+from ansible.module_utils.panos_timing import Timer
+from ansible.module_utils.panos_rollback import RollbackStore, RollbackXapi, point_xpaths, replay_point
+from ansible.module_utils.panos_prefix import HAS_IPADDRESS, split_prefixes, read_prefixes, normalize_prefixes, diff_prefixes
 
 _MGT_PRF_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
             "/network/profiles/interface-management-profile/entry[@name='%s']"
 
+#Service flags of the profile, in element order
+def mgtprf_flags(http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet):
+    return [
+        ('http', http),
+        ('https', https),
+        ('http-ocsp', http_ocsp),
+        ('ssh', ssh),
+        ('snmp', snmp),
+        ('userid-service', userid),
+        ('userid-syslog-listener-ssl', userid_syslog_ssl),
+        ('userid-syslog-listener-udp', userid_syslog_udp),
+        ('ping', ping),
+        ('response-pages', response_pages),
+        ('telnet', telnet),
+    ]
+
 #Add Interface Management Profile
 def add_mgtprf(xapi, mgtprf_name, http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet, iplist):
 
     #Create IP list
+    ip_xml = ''
+    if iplist:
+        ip_xml = '<permitted-ip>' + ''.join('<entry name="%s"/>' % ip for ip in iplist) + '</permitted-ip>'
 
-    if len(iplist) > 0:
-        ips = iplist.split(',')
-
-        ip_xml = '<permitted-ip>'
-        for ip in ips:
-            ip_xml += '<entry name="' + ip + '"/>'
-        ip_xml += '</permitted-ip>'
-
-    mgtprf_xml = [
-        '<entry name="%s">',
-            ip_xml,
-            '<http>' + http + '</http>',
-            '<https>' + https + '</https>',
-            '<http-ocsp>' + http_ocsp + '</http-ocsp>',
-            '<ssh>' + ssh + '</ssh>',
-            '<snmp>' + snmp + '</snmp>',
-            '<userid-service>' + userid + '</userid-service>',
-            '<userid-syslog-listener-ssl>' + userid_syslog_ssl + '</userid-syslog-listener-ssl>',
-            '<userid-syslog-listener-udp>' + userid_syslog_udp + '</userid-syslog-listener-udp>',
-            '<ping>' + ping + '</ping>',
-            '<response-pages>' + response_pages + '</response-pages>',
-            '<telnet>' + telnet + '</telnet>',
-        '</entry>'
-    ]
+    flags = mgtprf_flags(http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet)
+    mgtprf_xml = ['<entry name="%s">', ip_xml]
+    for tag, value in flags:
+        mgtprf_xml.append('<' + tag + '>' + value + '</' + tag + '>')
+    mgtprf_xml.append('</entry>')
 
     mgtprf_xml = (''.join(mgtprf_xml) % mgtprf_name)
     xapi.edit(xpath=_MGT_PRF_XPATH % mgtprf_name, element=mgtprf_xml)
 
     return True
 
+#Permitted IPs to add to and remove from the profile, compared as normalized sets.
+#iplist None means the permitted IPs are not managed.
+def diff_permitted_ips(current, iplist):
+    if (iplist is None):
+        return [], []
+    return diff_prefixes(iplist, [e.get('name') for e in current.findall('permitted-ip/entry')])
+
+#Normalized prefixes of the iplist and iplist_file parameters, None when neither is given
+def load_iplist(iplist, iplist_file=None):
+    if (iplist is None and not iplist_file):
+        return None
+    prefixes = split_prefixes(iplist)
+    if iplist_file:
+        prefixes += read_prefixes(iplist_file)
+    return normalize_prefixes(prefixes)
+
+#Update the flags and permitted IPs of an existing profile that differ
+def update_mgtprf(xapi, mgtprf_name, current, http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet, iplist):
+    xpath = _MGT_PRF_XPATH % mgtprf_name
+    flags = mgtprf_flags(http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet)
+
+    set_xml = ''
+    for tag, value in flags:
+        if (current.findtext(tag) or 'no') != value:
+            set_xml += '<' + tag + '>' + value + '</' + tag + '>'
+
+    added, removed = diff_permitted_ips(current, iplist)
+    if added:
+        set_xml += '<permitted-ip>' + ''.join('<entry name="%s"/>' % ip for ip in added) + '</permitted-ip>'
+
+    if set_xml:
+        xapi.set(xpath=xpath, element=set_xml)
+    if removed:
+        xapi.delete(xpath=xpath + "/permitted-ip/entry[%s]" % ' or '.join("@name='%s'" % ip for ip in removed))
+
+    return bool(set_xml or removed)
+
 #Delete VR
 def del_mgtprf(xapi, mgtprf_name):
     xapi.delete(xpath=_MGT_PRF_XPATH % mgtprf_name)
     return True
 
-#Check if management profile exists
-def mgtprf_exists(xapi, mgtprf_name):
+#Get management profile, None when it does not exist
+def get_mgtprf(xapi, mgtprf_name, snapshot=None):
+    if snapshot:
+        return snapshot.find('profile', mgtprf_name)
     xpath = _MGT_PRF_XPATH % mgtprf_name
     xapi.get(xpath=xpath)
-    router = xapi.element_root.find('.//entry')
-    return (router is not None)
+    return first_result(xapi)
 
 def main():
+    global PanXapiError
     argument_spec = dict(
         ip_address=dict(required=True),
-        password=dict(required=True, no_log=True),
+        password=dict(no_log=True),
         username=dict(default='admin'),
+        api_key=dict(no_log=True),
+        api_key_cache=dict(type='bool', default=False),
+        api_key_cache_dir=dict(),
+        api_key_ttl=dict(type='int', default=86400),
+        api_retries=dict(type='int', default=3),
+        api_rate=dict(type='float', default=0),
+        api_lock_timeout=dict(type='int', default=300),
         http=dict(type='bool',default=False),
         https=dict(type='bool',default=False),
         telnet=dict(type='bool',default=False),
@@ -188,18 +380,41 @@ def main():
         userid=dict(type='bool',default=False),
         userid_syslog_ssl=dict(type='bool',default=False),
         userid_syslog_udp=dict(type='bool',default=False),
-        iplist=dict(),
+        iplist=dict(type='list'),
+        iplist_file=dict(),
         name=dict(required=True),
         operation=dict(default='add'), #Could be add or del
-        commit=dict(type='bool', default=True)
+        snapshot_ttl=dict(type='int', default=0),
+        snapshot_dir=dict(),
+        rollback_points=dict(type='bool', default=False),
+        rollback_dir=dict(),
+        rollback=dict(),
+        template=dict(),
+        template_stack=dict(),
+        vsys=dict(),
+        device_group=dict(),
+        check_config=dict(),
+        compile_to=dict(),
+        multi_config=dict(type='bool', default=False),
+        timings=dict(type='bool', default=False),
+        timings_log=dict(),
+        commit=dict(type='bool', default=True),
+        commit_mode=dict(default='sync', choices=['sync', 'deferred', 'async']),
+        commit_state_dir=dict()
     )
 
-    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
-    if not HAS_LIB:
-        module.fail_json(msg='pan-python is required for this module')
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True,
+                           mutually_exclusive=[['template', 'template_stack']])
+    #pan-python is imported after argument validation, check mode and compile_to run without it
+    if not (module.check_mode or module.params['compile_to']):
+        xapi_lib = load_pan()
+        if xapi_lib is None:
+            module.fail_json(msg='pan-python is required for this module')
+        PanXapiError = xapi_lib.PanXapiError
+    if not HAS_IPADDRESS and (module.params['iplist'] or module.params['iplist_file']):
+        module.fail_json(msg='ipaddress is required for iplist')
 
     ip_address = module.params['ip_address']
-    password = module.params['password']
     username = module.params['username']
     http = 'yes' if module.params['http'] else 'no'
     https = 'yes' if module.params['https'] else 'no'
@@ -212,24 +427,94 @@ def main():
     userid = 'yes' if module.params['userid'] else 'no'
     userid_syslog_ssl = 'yes' if module.params['userid_syslog_ssl'] else 'no'
     userid_syslog_udp = 'yes' if module.params['userid_syslog_udp'] else 'no'
-    iplist = module.params['iplist']
     name = module.params['name']
     operation = module.params['operation']
     commit = module.params['commit']
 
-    xapi = pan.xapi.PanXapi(
-        hostname=ip_address,
-        api_username=username,
-        api_password=password
-    )
+    try:
+        iplist = load_iplist(module.params['iplist'], module.params['iplist_file'])
+    except (IOError, ValueError):
+        exc = get_exception()
+        module.fail_json(msg="Invalid iplist: %s" % exc)
+
+    template = module.params['template']
+    template_stack = module.params['template_stack']
+
+    timer = None
+    if (module.params['timings'] or module.params['timings_log']):
+        timer = Timer(module.params['timings_log'], 'panos_int_mgt_profile')
+        timer.attach(module, ip_address, module.params['timings'])
+
+    compiled = None
+    if module.check_mode:
+        compiled = plan_config(module.params['check_config'],
+                               target_name(ip_address, template, template_stack, module.params['vsys']),
+                               module.params['snapshot_dir'])
+        if compiled is None:
+            module.fail_json(msg="check mode needs check_config or a config snapshot of the device, "
+                                 "run once with snapshot_ttl")
+        xapi = compiled
+    elif module.params['compile_to']:
+        compiled = CompiledConfig(module.params['compile_to'])
+        xapi = compiled
+    else:
+        xapi = connect(module, timer)
+        if (template or template_stack or module.params['vsys']):
+            xapi = TemplateXapi(xapi, template, template_stack, module.params['vsys'])
+
+    snapshot = None
+    if module.params['snapshot_ttl'] and compiled is None:
+        snapshot = Snapshot(xapi, target_name(ip_address, template, template_stack, module.params['vsys']),
+                            module.params['snapshot_dir'], module.params['snapshot_ttl'])
+        xapi = snapshot.wrap()
+
+    rollback_id = module.params['rollback']
+    store = None
+    recorder = None
+    if (module.params['rollback_points'] or rollback_id):
+        store = RollbackStore(module.params['rollback_dir'])
+        if compiled is None:
+            recorder = RollbackXapi(xapi, store, target_name(ip_address, template, template_stack, module.params['vsys']),
+                                    'panos_int_mgt_profile', snapshot)
+            recorder.xpaths = [_MGT_PRF_XPATH % name]
+            xapi = recorder
+
+    tx = None
+    if module.params['multi_config']:
+        tx = Transaction(xapi)
+        xapi = tx
 
     changed = False
-    mgtprfExists = mgtprf_exists(xapi, name)
+    if not rollback_id:
+        current = get_mgtprf(xapi, name, snapshot)
+        mgtprfExists = (current is not None)
+        if recorder is not None:
+            recorder.known[_MGT_PRF_XPATH % name] = current
 
-    if (operation == "add"):
+    if (rollback_id):
+        point = store.find_point(target_name(ip_address, template, template_stack, module.params['vsys']),
+                                 rollback_id, 'panos_int_mgt_profile')
+        if (point is None):
+            module.fail_json(msg="Rollback point %s not found in %s" % (rollback_id, store.directory))
+        if recorder is not None:
+            recorder.xpaths = point_xpaths(point)
+        try:
+            changed = replay_point(xapi, store, point, snapshot, recorder.known if recorder is not None else None)
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message)
+    elif (operation == "add"):
         if (mgtprfExists):
-            module.exit_json(changed=False, msg="Interface Management Profile exists, not changed")
+            added, removed = diff_permitted_ips(current, iplist)
+            try:
+                changed = update_mgtprf(xapi, name, current, http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet, iplist)
+            except PanXapiError:
+                exc = get_exception()
+                module.fail_json(msg=exc.message)
+            if (not changed):
+                module.exit_json(changed=False, msg="Interface Management Profile exists, not changed")
         else:
+            added, removed = iplist or [], []
             try:
                 changed = add_mgtprf(xapi, name, http, https, http_ocsp, ssh, snmp, userid, userid_syslog_ssl, userid_syslog_udp, ping, response_pages, telnet, iplist)
             except PanXapiError:
@@ -248,10 +533,36 @@ def main():
         module.exit_json(changed=False, msg="Operation not clear, use add or del")
         changed = False
 
-    if changed and commit:
-        xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+    result = dict(changed=changed, msg="yippie ka yee")
+    if (operation == "add" and not rollback_id):
+        result['permitted_ip'] = dict(added=added, removed=removed)
+    if tx is not None:
+        try:
+            result['operations'] = tx.flush()
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message, operations=tx.results)
+    if compiled is not None:
+        if changed:
+            compiled.save()
+        if module.check_mode:
+            result['plan'] = compiled.plan
+            if module._diff:
+                result['diff'] = compiled.diff()
+    elif changed and commit:
+        if (module.params['commit_mode'] == "deferred"):
+            mark_dirty(ip_address, username, module.params['commit_state_dir'])
+        elif (template or template_stack):
+            result['job_id'] = commit_push(xapi, module.params['device_group'], template, template_stack,
+                                           module.params['commit_mode'] == "sync")
+        elif (module.params['commit_mode'] == "async"):
+            result['job_id'] = commit_async(xapi)
+        else:
+            xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
 
-    module.exit_json(changed=changed, msg="yippie ka yee")
+    if recorder is not None and recorder.point is not None:
+        result['rollback_point'] = recorder.point['id']
+    module.exit_json(**result)
 
 if __name__ == '__main__':
     main()
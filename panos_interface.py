@@ -41,12 +41,41 @@ options:
         default: "admin"
     password:
         description:
-            - Password credentials to use for auth.
-        required: true
+            - Password credentials to use for auth, required unless api_key or compile_to is given.
+    api_key:
+        description:
+            - API key to use instead of username and password.
+    api_key_cache:
+        description:
+            - Cache the generated API key encrypted on disk, so the next tasks for the device skip the keygen request.
+              Requires the cryptography library.
+        default: false
+    api_key_cache_dir:
+        description:
+            - Directory of the API key cache
+        default: "~/.ansible/panos_keys"
+    api_key_ttl:
+        description:
+            - Seconds a cached API key is used
+        default: 86400
+    api_retries:
+        description:
+            - Times a request is sent again when the management plane is busy or does not answer
+        default: 3
+    api_rate:
+        description:
+            - Maximum API requests per second to the device, 0 is unlimited. The rate is lowered when the device
+              is busy and raised again when it answers in time. A lowered rate is saved in api_key_cache_dir, the
+              next tasks for the device start from it, raised by 0.5 for every second since. It is forgotten
+              after 10 minutes.
+        default: 0
+    api_lock_timeout:
+        description:
+            - Seconds to wait for a config or commit lock of another admin or commit
+        default: 300
     if_name:
         description:
-            - Name of the interface to configure.
-        required: true
+            - Name of the interface to configure, required unless interfaces is given.
     if_type: 
         description:
             - Type of interface static or dhcp
@@ -64,15 +93,99 @@ options:
     zone_name:
         description:
             - Name of the zone for the interface. If the zone does not exist it is created but if the zone exists and it is not of the layer3 type the operation will fail.
-        required: true
+              Required with if_name.
     create_default_route:
         description:
             - Whether or not to add default route with router learned via DHCP.
         default: "false"
+    interfaces:
+        description:
+            - List of interfaces to configure at once, each with if_name and optionally if_type, if_address, vr_name,
+              zone_name and create_default_route. Missing keys default to the module parameters. All new interfaces are
+              sent in one call, and their zone and VR memberships in one call each.
+    snapshot_ttl:
+        description:
+            - Seconds a cached config snapshot of the device is used for existence checks, 0 disables the snapshot
+        default: 0
+    snapshot_dir:
+        description:
+            - Directory for the config snapshots
+        default: "~/.ansible/panos_snapshot"
+    rollback_points:
+        description:
+            - Before the first change, save the interfaces and the member lists of their zones and VRs as a rollback
+              point in rollback_dir
+        default: false
+    rollback_dir:
+        description:
+            - Directory of the rollback points, shared by all devices
+        default: "~/.ansible/panos_rollback"
+    rollback:
+        description:
+            - Id of a rollback point to restore, or last for the newest panos_interface point of the device. Every
+              saved subtree that differs is put back with one edit, the interface parameters are ignored. A subtree
+              that did not exist is deleted with the containers created for it, like a new zone. Reports a change
+              only when something was sent. A point of the config before the rollback is saved first.
+    template:
+        description:
+            - Panorama template to configure instead of a firewall, ip_address is the Panorama
+    template_stack:
+        description:
+            - Panorama template stack to configure instead of a firewall, ip_address is the Panorama
+    vsys:
+        description:
+            - Vsys of the zones
+        default: "vsys1"
+    device_group:
+        description:
+            - Device group to push to after the Panorama commit, with its templates. Without device_group the
+              template or template stack is pushed
+    check_config:
+        description:
+            - In check mode, exported config file (for example a C(show config) export or a compile_to file) to plan the
+              changes on. Without it the cached config snapshot of the device in snapshot_dir is used. Check mode never
+              connects to the device.
+    compile_to:
+        description:
+            - Path of a local candidate config file. The changes are applied to this file instead of the device, no API
+              call is made and nothing is committed. Push the file with the panos_config_push module.
+    multi_config:
+        description:
+            - Send all changes of the task as one multi-config request, the device applies all of them or none.
+              Very large changes are split in several requests. Requires PAN-OS 9.0 or later.
+        default: false
+    timings:
+        description:
+            - Return the type, xpath, request and response size, latency and retries of every API call in timings
+        default: false
+    timings_log:
+        description:
+            - Append the timings of every API call as JSON lines to this file, to compare devices and xpaths across runs
+    verify:
+        description:
+            - After the commit, check that the changed interfaces are up in their zone and VR with their static
+              address or a DHCP lease, with one show interface all per poll until all interfaces are or
+              verify_timeout passes. The task fails when an interface is not. Needs a sync commit on a firewall,
+              with other commit modes or a template it is skipped with a warning.
+        default: false
+    verify_timeout:
+        description:
+            - Seconds to wait for the interfaces of verify, a DHCP lease can take a while
+        default: 60
     commit:
         description:
             - Commit if changed
         default: true
+    commit_mode:
+        description:
+            - sync commits right away, deferred only records the change so the panos_commit module can commit once,
+              async starts the commit and returns its job_id, use panos_commit_wait to wait for it
+        choices: ['sync', 'deferred', 'async']
+        default: sync
+    commit_state_dir:
+        description:
+            - Directory with the deferred commit state
+        default: "~/.ansible/panos_commit"
 '''
 
 EXAMPLES = '''
@@ -100,35 +213,77 @@ EXAMPLES = '''
 
 RETURN='''
 # Default return values
+timings:
+    description: API calls of the task with call, xpath, request_size, response_size, latency, retries and status,
+        their count and total latency
+    returned: when timings is true
+    type: dict
+operations:
+    description: Per operation of the multi-config request, id, action, xpath, status and msg
+    returned: when multi_config is true
+    type: list
+interfaces:
+    description: Per interface result, if_name and changed
+    returned: when interfaces is given
+    type: list
+job_id:
+    description: Id of the commit job, with a template or template_stack the id of the commit-all push job
+    returned: when the device changed and commit_mode is async, or template or template_stack is set
+    type: string
+verified:
+    description: Per changed interface name, verified, msg (ok or what is wrong) and the seconds waited
+    returned: when verify is true and the device was committed
+    type: list
+rollback_point:
+    description: Id of the rollback point saved before the change
+    returned: when rollback_points or rollback is set and the device changed
+    type: string
+plan:
+    description: Action, xpath and element of every set, edit and delete the task would send
+    returned: in check mode when the device would change
+    type: list
+diff:
+    description: The VRs, interfaces, profiles and zones that would change, before and after, as XML
+    returned: in check mode with --diff
+    type: dict
 '''
 
 ANSIBLE_METADATA = {'metadata_version': '1.1',
                     'status': ['preview'],
                     'supported_by': 'community'}
 
+import xml.etree.ElementTree as ET
+
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.basic import get_exception
+from ansible.module_utils.panos_xapi import connect, load_pan, PanXapiError
+from ansible.module_utils.panos_snapshot import Snapshot
+from ansible.module_utils.panos_commit import mark_dirty, commit_async
+from ansible.module_utils.panos_transaction import Transaction
+from ansible.module_utils.panos_compile import CompiledConfig, plan_config
+from ansible.module_utils.panos_panorama import TemplateXapi, target_name, commit_push
+from ansible.module_utils.panos_timing import Timer
+from ansible.module_utils.panos_rollback import RollbackStore, RollbackXapi, point_xpaths, replay_point
+from ansible.module_utils.panos_verify import INTERFACES_CMD, check_interface, interface_index, wait_converged
 
 
-try:
-    import pan.xapi
-    from pan.xapi import PanXapiError
-    HAS_LIB = True
-except ImportError:
-    HAS_LIB = False
-
-_IF_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
-            "/network/interface/ethernet/entry[@name='%s']"
+_ETHERNET_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
+                  "/network/interface/ethernet"
+_IF_XPATH = _ETHERNET_XPATH + "/entry[@name='%s']"
 
 _ZONE_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
               "/vsys/entry/zone/entry"
-_ZONE_XPATH_QUERY = _ZONE_XPATH+"[network/layer3/member/text()='%s']"
 _ZONE_XPATH_IF = _ZONE_XPATH+"[@name='%s']/network/layer3/member[text()='%s']"
 _VR_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
             "/network/virtual-router/entry"
+_VR_XPATH_IF = _VR_XPATH+"[@name='%s']/interface/member[text()='%s']"
+_ZONES_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
+               "/vsys/entry/zone"
+_VRS_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
+             "/network/virtual-router"
 
 
-def add_if(xapi, if_name, if_type, if_address, vr_name, zone_name, create_default_route):
+def if_entry_xml(if_name, if_type, if_address, create_default_route):
     if_xml = [
         '<entry name="%s">',
         '<layer3>',
@@ -146,52 +301,367 @@ def add_if(xapi, if_name, if_type, if_address, vr_name, zone_name, create_defaul
     elif (if_type == "static"):
         if_ip = '<ip><entry name="' + if_address + '"/></ip>'
     else:
+        return None
+
+    return (''.join(if_xml)) % (if_name, if_ip)
+
+
+def add_if(xapi, if_name, if_type, if_address, vr_name, zone_name, create_default_route, zone_of=None, vr_of=None):
+    if_xml = if_entry_xml(if_name, if_type, if_address, create_default_route)
+    if (if_xml is None):
         return False
 
-    if_xml = (''.join(if_xml)) % (if_name, if_ip)
     xapi.edit(xpath=_IF_XPATH % if_name, element=if_xml)
+    update_members(xapi, if_name, zone_name, vr_name, zone_of or {}, vr_of or {})
+
+    return True
+
 
-    xapi.set(xpath=_ZONE_XPATH+"[@name='%s']/network/layer3" % zone_name,
-             element='<member>%s</member>' % if_name)
-    xapi.set(xpath=_VR_XPATH+"[@name='" + vr_name + "']/interface",
-             element='<member>%s</member>' % if_name)
+def update_if(xapi, if_name, current, if_type, if_address, create_default_route):
+    layer3 = current.find('layer3')
+    layer3_path = _IF_XPATH % if_name + "/layer3"
+    changed = False
+
+    if (if_type == "dhcp"):
+        cdr = 'yes' if create_default_route else 'no'
+        dhcp = layer3.find('dhcp-client')
+        if (layer3.find('ip') is not None):
+            xapi.delete(xpath=layer3_path + "/ip")
+            changed = True
+        if (dhcp is None):
+            xapi.edit(xpath=layer3_path + "/dhcp-client",
+                      element='<dhcp-client><create-default-route>' + cdr + '</create-default-route></dhcp-client>')
+            changed = True
+        elif ((dhcp.findtext('create-default-route') or 'yes') != cdr):
+            xapi.edit(xpath=layer3_path + "/dhcp-client/create-default-route",
+                      element='<create-default-route>' + cdr + '</create-default-route>')
+            changed = True
+    elif (if_type == "static"):
+        addresses = [e.get('name') for e in layer3.findall('ip/entry')]
+        if (layer3.find('dhcp-client') is not None):
+            xapi.delete(xpath=layer3_path + "/dhcp-client")
+            changed = True
+        if (addresses != [if_address]):
+            xapi.edit(xpath=layer3_path + "/ip",
+                      element='<ip><entry name="' + if_address + '"/></ip>')
+            changed = True
+    else:
+        return False
 
+    return changed
+
+
+#Reverse index of the zone and VR memberships: interface -> zone names and interface -> VR names
+def membership_index(zones, vrs):
+    zone_of = {}
+    vr_of = {}
+    for zone in zones:
+        for member in zone.findall('network/layer3/member'):
+            zone_of.setdefault(member.text, []).append(zone.get('name'))
+    for vr in vrs:
+        for member in vr.findall('interface/member'):
+            vr_of.setdefault(member.text, []).append(vr.get('name'))
+    return zone_of, vr_of
+
+
+#Member lists of zones and VRs by xpath, None for a zone or VR without one
+def member_lists(zones, vrs):
+    lists = {}
+    for zone in zones:
+        lists[_ZONE_XPATH + "[@name='%s']/network/layer3" % zone.get('name')] = zone.find('network/layer3')
+    for vr in vrs:
+        lists[_VR_XPATH + "[@name='%s']/interface" % vr.get('name')] = vr.find('interface')
+    return lists
+
+
+#VR entries with only their interface list from a vr/entry/@name|vr/entry/interface
+#result. The VR names are entries without children and every interface list
+#follows the name of its VR, so the interface of a single interface get, an
+#entry with children, is left out by its shape and not by its name. Only an
+#empty entry named skip that no interface list follows is left out too, it is
+#the interface or a VR without interfaces, which adds no memberships.
+def vr_member_entries(result, skip=None):
+    nodes = list(result)
+    vrs = []
+    for i, node in enumerate(nodes):
+        if (node.tag == "entry" and not len(node)):
+            following = nodes[i + 1] if i + 1 < len(nodes) else None
+            if (node.get('name') == skip and (following is None or following.tag != "interface")):
+                continue
+            vrs.append(ET.Element('entry', name=node.get('name')))
+        elif (node.tag == "interface" and vrs):
+            vrs[-1].append(node)
+    return vrs
+
+
+#The interfaces (if_name or all ethernet interfaces) by name and the reverse
+#index of the zones and VRs, from the snapshot or with a single get. Of the
+#VRs only the names and interface lists are requested, not their routes. The
+#member lists of the zones and VRs are added to lists when given.
+def get_if_state(xapi, if_name=None, snapshot=None, lists=None):
+    if snapshot:
+        snapshot.load()
+        interfaces = dict(snapshot.index['interface'])
+        if if_name:
+            interfaces = dict((k, v) for k, v in interfaces.items() if k == if_name)
+        zones, vrs = snapshot.index['zone'].values(), snapshot.index['vr'].values()
+    else:
+        if_xpath = _IF_XPATH % if_name if if_name else _ETHERNET_XPATH
+        xapi.get(xpath='|'.join((if_xpath, _ZONES_XPATH, _VR_XPATH + "/@name", _VR_XPATH + "/interface")))
+        result = xapi.element_root.find('./result')
+        if result is None:
+            return {}, {}, {}
+        if if_name:
+            #The interface is the entry with content, the VR names are empty entries
+            entries = [e for e in result.findall('./entry') if e.get('name') == if_name and len(e)]
+        else:
+            entries = result.findall('./ethernet/entry')
+        interfaces = dict((e.get('name'), e) for e in entries)
+        zones, vrs = result.findall('./zone/entry'), vr_member_entries(result, if_name)
+    if lists is not None:
+        lists.update(member_lists(zones, vrs))
+    zone_of, vr_of = membership_index(zones, vrs)
+    return interfaces, zone_of, vr_of
+
+
+#Subtrees an interface change touches, saved in the rollback point: the
+#interface and the member lists of its current and new zone and VR
+def rollback_xpaths(if_name, zone_name, vr_name, zone_of, vr_of):
+    xpaths = [_IF_XPATH % if_name]
+    zones = sorted(set(zone_of.get(if_name, []) + [zone_name]))
+    vrs = sorted(set(vr_of.get(if_name, []) + [vr_name]))
+    xpaths += [_ZONE_XPATH + "[@name='%s']/network/layer3" % zone for zone in zones]
+    xpaths += [_VR_XPATH + "[@name='%s']/interface" % vr for vr in vrs]
+    return xpaths
+
+
+#Memberships of the interface in other zones and VRs than zone_name and vr_name
+def stale_members(if_name, zone_name, vr_name, zone_of, vr_of):
+    xpaths = [_ZONE_XPATH_IF % (zone, if_name) for zone in zone_of.get(if_name, []) if zone != zone_name]
+    xpaths += [_VR_XPATH_IF % (vr, if_name) for vr in vr_of.get(if_name, []) if vr != vr_name]
+    return xpaths
+
+
+#Delete the stale members and set the new ones in one multi-config request, so
+#an interface is never in two zones or VRs. New members of an interface
+#without stale members are set directly.
+def move_members(xapi, stale, sets):
+    if not stale and not isinstance(xapi, Transaction):
+        for xpath, element in sets:
+            xapi.set(xpath=xpath, element=element)
+        return
+    tx = xapi if isinstance(xapi, Transaction) else Transaction(xapi)
+    for xpath in stale:
+        tx.delete(xpath=xpath)
+    for xpath, element in sets:
+        tx.set(xpath=xpath, element=element)
+    if tx is not xapi:
+        tx.flush()
+
+
+#Move the interface to zone_name and vr_name, returns True when a membership changed
+def update_members(xapi, if_name, zone_name, vr_name, zone_of, vr_of):
+    stale = stale_members(if_name, zone_name, vr_name, zone_of, vr_of)
+    sets = []
+    if zone_name not in zone_of.get(if_name, []):
+        sets.append((_ZONE_XPATH+"[@name='%s']/network/layer3" % zone_name, '<member>%s</member>' % if_name))
+    if vr_name not in vr_of.get(if_name, []):
+        sets.append((_VR_XPATH+"[@name='%s']/interface" % vr_name, '<member>%s</member>' % if_name))
+    if not stale and not sets:
+        return False
+    move_members(xapi, stale, sets)
     return True
 
 
-def if_exists(xapi, if_name):
-    xpath = _IF_XPATH % if_name
-    xapi.get(xpath=xpath)
-    network = xapi.element_root.find('.//layer3')
-    return (network is not None)
+def group_members(interfaces, key, wrap):
+    groups = {}
+    for interface in interfaces:
+        groups.setdefault(interface[key], []).append(interface['if_name'])
+    entries = ''
+    for name in sorted(groups):
+        members = ''.join('<member>%s</member>' % i for i in groups[name])
+        entries += '<entry name="%s">%s</entry>' % (name, wrap % members)
+    return entries
+
+
+def interface_params(interface, defaults):
+    params = dict(defaults)
+    params.update(dict((k, v) for k, v in interface.items() if v is not None))
+    return params
+
+
+#Why an interface of the interfaces parameter is invalid, None when it is valid
+def interface_error(interface):
+    if not interface.get('if_name') or not interface.get('zone_name'):
+        return "Each interface needs an if_name and zone_name: %s" % interface
+    if (interface['if_type'] not in ("dhcp", "static")):
+        return "Invalid interface type (if_type), use static of dhcp: %s" % interface['if_name']
+    if (interface['if_type'] == "static" and not interface['if_address']):
+        return "if_address is required for a static interface: %s" % interface['if_name']
+    return None
+
+
+def add_ifs_bulk(xapi, interfaces, snapshot=None, state=None):
+    current, zone_of, vr_of = state or get_if_state(xapi, None, snapshot)
+    results = []
+    new = []
+    stale = []
+    zone_adds = []
+    vr_adds = []
+
+    for interface in interfaces:
+        if_name = interface['if_name']
+        entry = current.get(if_name)
+        if (entry is not None and entry.find('layer3') is not None):
+            changed = update_if(xapi, if_name, entry, interface['if_type'],
+                                interface['if_address'], interface['create_default_route'])
+        else:
+            new.append(interface)
+            changed = True
+
+        moved = stale_members(if_name, interface['zone_name'], interface['vr_name'], zone_of, vr_of)
+        add_zone = interface['zone_name'] not in zone_of.get(if_name, [])
+        add_vr = interface['vr_name'] not in vr_of.get(if_name, [])
+        stale.extend(moved)
+        if add_zone:
+            zone_adds.append(interface)
+        if add_vr:
+            vr_adds.append(interface)
+        changed = changed or bool(moved) or add_zone or add_vr
+        results.append(dict(if_name=if_name, changed=changed))
+
+    if new:
+        xapi.set(xpath=_ETHERNET_XPATH,
+                 element=''.join(if_entry_xml(i['if_name'], i['if_type'], i['if_address'], i['create_default_route'])
+                                 for i in new))
+    sets = []
+    if zone_adds:
+        sets.append((_ZONES_XPATH, group_members(zone_adds, 'zone_name', '<network><layer3>%s</layer3></network>')))
+    if vr_adds:
+        sets.append((_VRS_XPATH, group_members(vr_adds, 'vr_name', '<interface>%s</interface>')))
+    if stale or sets:
+        move_members(xapi, stale, sets)
+
+    return results
+
+
+#Wait until the interfaces are up as configured with one show interface all per
+#poll, fails the task when an interface is not after verify_timeout
+def verify_interfaces(module, xapi, interfaces):
+    try:
+        verified, polls = wait_converged(xapi, INTERFACES_CMD, interface_index, check_interface,
+                                         [(i['if_name'], i) for i in interfaces], module.params['verify_timeout'])
+    except PanXapiError:
+        exc = get_exception()
+        module.fail_json(msg=exc.message, changed=True)
+    failed = [v for v in verified if not v['verified']]
+    if failed:
+        module.fail_json(msg="%d of %d interfaces not verified after %d polls: %s" % (
+                             len(failed), len(verified), polls,
+                             '; '.join('%s %s' % (v['name'], v['msg']) for v in failed[:10])),
+                         changed=True, verified=verified)
+    return verified
 
 
 def main():
+    global PanXapiError
     argument_spec = dict(
         ip_address=dict(required=True),
-        password=dict(required=True, no_log=True),
+        password=dict(no_log=True),
         username=dict(default='admin'),
-        if_name=dict(required=True),
+        api_key=dict(no_log=True),
+        api_key_cache=dict(type='bool', default=False),
+        api_key_cache_dir=dict(),
+        api_key_ttl=dict(type='int', default=86400),
+        api_retries=dict(type='int', default=3),
+        api_rate=dict(type='float', default=0),
+        api_lock_timeout=dict(type='int', default=300),
+        if_name=dict(),
         if_type=dict(default='dhcp'), #dhcp or static
         if_address=dict(),
         vr_name=dict(default='default'),
-        zone_name=dict(required=True),
+        zone_name=dict(),
         create_default_route=dict(type='bool', default=False),
-        commit=dict(type='bool', default=True)
+        interfaces=dict(type='list'),
+        snapshot_ttl=dict(type='int', default=0),
+        snapshot_dir=dict(),
+        rollback_points=dict(type='bool', default=False),
+        rollback_dir=dict(),
+        rollback=dict(),
+        template=dict(),
+        template_stack=dict(),
+        vsys=dict(),
+        device_group=dict(),
+        check_config=dict(),
+        compile_to=dict(),
+        multi_config=dict(type='bool', default=False),
+        timings=dict(type='bool', default=False),
+        timings_log=dict(),
+        verify=dict(type='bool', default=False),
+        verify_timeout=dict(type='int', default=60),
+        commit=dict(type='bool', default=True),
+        commit_mode=dict(default='sync', choices=['sync', 'deferred', 'async']),
+        commit_state_dir=dict()
     )
-    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
-    if not HAS_LIB:
-        module.fail_json(msg='pan-python is required for this module')
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True,
+                           required_one_of=[['if_name', 'interfaces', 'rollback']],
+                           mutually_exclusive=[['template', 'template_stack']],
+                           required_together=[['if_name', 'zone_name']])
+    #pan-python is imported after argument validation, check mode and compile_to run without it
+    if not (module.check_mode or module.params['compile_to']):
+        xapi_lib = load_pan()
+        if xapi_lib is None:
+            module.fail_json(msg='pan-python is required for this module')
+        PanXapiError = xapi_lib.PanXapiError
 
     ip_address = module.params["ip_address"]
-    password = module.params["password"]
     username = module.params['username']
 
-    xapi = pan.xapi.PanXapi(
-        hostname=ip_address,
-        api_username=username,
-        api_password=password
-    )
+    template = module.params['template']
+    template_stack = module.params['template_stack']
+
+    timer = None
+    if (module.params['timings'] or module.params['timings_log']):
+        timer = Timer(module.params['timings_log'], 'panos_interface')
+        timer.attach(module, ip_address, module.params['timings'])
+
+    compiled = None
+    if module.check_mode:
+        compiled = plan_config(module.params['check_config'],
+                               target_name(ip_address, template, template_stack, module.params['vsys']),
+                               module.params['snapshot_dir'])
+        if compiled is None:
+            module.fail_json(msg="check mode needs check_config or a config snapshot of the device, "
+                                 "run once with snapshot_ttl")
+        xapi = compiled
+    elif module.params['compile_to']:
+        compiled = CompiledConfig(module.params['compile_to'])
+        xapi = compiled
+    else:
+        xapi = connect(module, timer)
+        if (template or template_stack or module.params['vsys']):
+            xapi = TemplateXapi(xapi, template, template_stack, module.params['vsys'])
+
+    snapshot = None
+    if module.params['snapshot_ttl'] and compiled is None:
+        snapshot = Snapshot(xapi, target_name(ip_address, template, template_stack, module.params['vsys']),
+                            module.params['snapshot_dir'], module.params['snapshot_ttl'])
+        xapi = snapshot.wrap()
+
+    rollback_id = module.params['rollback']
+    store = None
+    recorder = None
+    if (module.params['rollback_points'] or rollback_id):
+        store = RollbackStore(module.params['rollback_dir'])
+        if compiled is None:
+            recorder = RollbackXapi(xapi, store, target_name(ip_address, template, template_stack, module.params['vsys']),
+                                    'panos_interface', snapshot)
+            xapi = recorder
+
+    tx = None
+    if module.params['multi_config']:
+        tx = Transaction(xapi)
+        xapi = tx
 
     if_name = module.params['if_name']
     if_type = module.params['if_type']
@@ -199,25 +669,114 @@ def main():
     vr_name = module.params['vr_name']
     zone_name = module.params['zone_name']
     create_default_route = module.params['create_default_route']
+    interfaces = module.params['interfaces']
     commit = module.params['commit']
+    results = None
+    state = None
+    changed_ifs = []
 
-    ifexists = if_exists(xapi, if_name)
+    if (if_type not in ("dhcp", "static") and not rollback_id):
+        module.exit_json(changed=False, msg="Invalid interface type (if_type), use static of dhcp")
 
-    if ifexists:
-        module.exit_json(changed=False, msg="interface exists, not changed")
+    if (rollback_id):
+        point = store.find_point(target_name(ip_address, template, template_stack, module.params['vsys']),
+                                 rollback_id, 'panos_interface')
+        if (point is None):
+            module.fail_json(msg="Rollback point %s not found in %s" % (rollback_id, store.directory))
+        if recorder is not None:
+            recorder.xpaths = point_xpaths(point)
+    elif interfaces:
+        defaults = dict(if_type=if_type, if_address=if_address, vr_name=vr_name, zone_name=zone_name,
+                        create_default_route=create_default_route)
+        interfaces = [interface_params(i, defaults) for i in interfaces]
+        for interface in interfaces:
+            error = interface_error(interface)
+            if error:
+                module.fail_json(msg=error)
+        if recorder is not None:
+            try:
+                state = get_if_state(xapi, None, snapshot, recorder.known)
+            except PanXapiError:
+                exc = get_exception()
+                module.fail_json(msg=exc.message)
+            for interface in interfaces:
+                recorder.xpaths += [x for x in rollback_xpaths(interface['if_name'], interface['zone_name'],
+                                                               interface['vr_name'], state[1], state[2])
+                                    if x not in recorder.xpaths]
+                recorder.known[_IF_XPATH % interface['if_name']] = state[0].get(interface['if_name'])
+    else:
+        try:
+            current, zone_of, vr_of = get_if_state(xapi, if_name, snapshot,
+                                                   recorder.known if recorder is not None else None)
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message)
+        current = current.get(if_name)
+        if recorder is not None:
+            recorder.xpaths = rollback_xpaths(if_name, zone_name, vr_name, zone_of, vr_of)
+            recorder.known[_IF_XPATH % if_name] = current
+    #All zones and VRs were read, the member lists that are not known do not exist
+    if (recorder is not None and not rollback_id):
+        for xpath in recorder.xpaths:
+            recorder.known.setdefault(xpath, None)
 
     try:
-        changed = add_if(xapi, if_name, if_type, if_address, vr_name, zone_name, create_default_route)
-        if (not changed):
-            module.exit_json(changed=False, msg="Invalid interface type (if_type), use static of dhcp")
+        if (rollback_id):
+            changed = replay_point(xapi, store, point, snapshot, recorder.known if recorder is not None else None)
+        elif interfaces:
+            results = add_ifs_bulk(xapi, interfaces, snapshot, state)
+            changed = any(r['changed'] for r in results)
+            changed_names = set(r['if_name'] for r in results if r['changed'])
+            changed_ifs = [i for i in interfaces if i['if_name'] in changed_names]
+        elif (current is not None and current.find('layer3') is not None):
+            changed = update_if(xapi, if_name, current, if_type, if_address, create_default_route)
+            changed = update_members(xapi, if_name, zone_name, vr_name, zone_of, vr_of) or changed
+            if (not changed):
+                module.exit_json(changed=False, msg="interface exists, not changed")
+        else:
+            changed = add_if(xapi, if_name, if_type, if_address, vr_name, zone_name, create_default_route,
+                             zone_of, vr_of)
+        if (changed and not rollback_id and not interfaces):
+            changed_ifs = [dict(if_name=if_name, if_type=if_type, if_address=if_address, vr_name=vr_name,
+                                zone_name=zone_name)]
     except PanXapiError:
         exc = get_exception()
         module.fail_json(msg=exc.message)
 
-    if changed and commit:
-        xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+    result = dict(changed=changed, msg="okey dokey")
+    if tx is not None:
+        try:
+            result['operations'] = tx.flush()
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message, operations=tx.results)
+    if compiled is not None:
+        if changed:
+            compiled.save()
+        if module.check_mode:
+            result['plan'] = compiled.plan
+            if module._diff:
+                result['diff'] = compiled.diff()
+    elif changed and commit:
+        if (module.params['commit_mode'] == "deferred"):
+            mark_dirty(ip_address, username, module.params['commit_state_dir'])
+        elif (template or template_stack):
+            result['job_id'] = commit_push(xapi, module.params['device_group'], template, template_stack,
+                                           module.params['commit_mode'] == "sync")
+        elif (module.params['commit_mode'] == "async"):
+            result['job_id'] = commit_async(xapi)
+        else:
+            xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+            if module.params['verify']:
+                result['verified'] = verify_interfaces(module, xapi, changed_ifs)
+    if (module.params['verify'] and changed and 'verified' not in result and not module.check_mode):
+        module.warn("verify needs a sync commit on a firewall, the interfaces are not verified")
 
-    module.exit_json(changed=changed, msg="okey dokey")
+    if results is not None:
+        result['interfaces'] = results
+    if recorder is not None and recorder.point is not None:
+        result['rollback_point'] = recorder.point['id']
+    module.exit_json(**result)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -38,15 +38,46 @@ options:
         default: "admin"
     password:
         description:
-            - Password credentials to use for auth.
-        required: true
+            - Password credentials to use for auth, required unless api_key or compile_to is given.
+    api_key:
+        description:
+            - API key to use instead of username and password.
+    api_key_cache:
+        description:
+            - Cache the generated API key encrypted on disk, so the next tasks for the device skip the keygen request.
+              Requires the cryptography library.
+        default: false
+    api_key_cache_dir:
+        description:
+            - Directory of the API key cache
+        default: "~/.ansible/panos_keys"
+    api_key_ttl:
+        description:
+            - Seconds a cached API key is used
+        default: 86400
+    api_retries:
+        description:
+            - Times a request is sent again when the management plane is busy or does not answer
+        default: 3
+    api_rate:
+        description:
+            - Maximum API requests per second to the device, 0 is unlimited. The rate is lowered when the device
+              is busy and raised again when it answers in time. A lowered rate is saved in api_key_cache_dir, the
+              next tasks for the device start from it, raised by 0.5 for every second since. It is forgotten
+              after 10 minutes.
+        default: 0
+    api_lock_timeout:
+        description:
+            - Seconds to wait for a config or commit lock of another admin or commit
+        default: 300
     vr_name:
         description:
             - Virtual Router name
         required: True
     operation:
         description:
-            - Operation, add (vr), del (vr) or addstatic (add static route)
+            - Operation, add (vr), del (vr), addstatic (add static route), addstatic_bulk (add a list of static routes)
+              or export (read the static routes, optionally diffed with routes)
         required: True
         default: add
     sr_name:
@@ -59,10 +90,133 @@ options:
         description:
             - Nexthop type, could be ip or vr (next-vr)
         default: ip
+    routes:
+        description:
+            - List of static routes for addstatic_bulk or state, each with name, destination, nexthop and optional nexthoptype (ip or vr).
+              With export the desired routes to diff the VR with
+    dest:
+        description:
+            - File the export is written to, the routes are returned in the result when not given
+    format:
+        description:
+            - Format of the export file
+        choices: ['json', 'csv']
+        default: json
+    page_size:
+        description:
+            - Number of static routes fetched per call by export, 0 fetches all routes in one call
+        default: 500
+    state:
+        description:
+            - Declarative mode, the VR is compared with routes and interfaces and only the differences are sent.
+              merged adds the given interfaces and adds or replaces the given routes.
+              replaced does the same and removes interfaces that are not listed.
+              overridden also removes all routes and interfaces that are not listed.
+              deleted removes the listed routes and interfaces, or the VR when neither is given.
+              When state is set, operation is ignored. The VR is created when it does not exist.
+        choices: ['merged', 'replaced', 'overridden', 'deleted']
+    interfaces:
+        description:
+            - List of interface names of the VR, used with state
+    max_payload:
+        description:
+            - Maximum size in bytes of the static routes sent in a single set call, larger lists are split
+        default: 100000
+    snapshot_ttl:
+        description:
+            - Seconds a cached config snapshot of the device is used for existence checks, 0 disables the snapshot
+        default: 0
+    snapshot_dir:
+        description:
+            - Directory for the config snapshots
+        default: "~/.ansible/panos_snapshot"
+    rollback_points:
+        description:
+            - Before the first change, save the config the task changes (the VR, the static route or the static routes
+              of the VR for addstatic_bulk) as a rollback point in rollback_dir
+        default: false
+    rollback_dir:
+        description:
+            - Directory of the rollback points, shared by all devices
+        default: "~/.ansible/panos_rollback"
+    rollback:
+        description:
+            - Id of a rollback point to restore, or last for the newest panos_vr point of the device. Every saved
+              subtree that differs is put back with one edit, a route that did not exist is deleted, operation and
+              state are ignored. Reports a change only when something was sent. A point of the config before the
+              rollback is saved first.
+    template:
+        description:
+            - Panorama template to configure instead of a firewall, ip_address is the Panorama
+    template_stack:
+        description:
+            - Panorama template stack to configure instead of a firewall, ip_address is the Panorama
+    vsys:
+        description:
+            - Vsys of the zones
+        default: "vsys1"
+    device_group:
+        description:
+            - Device group to push to after the Panorama commit, with its templates. Without device_group the
+              template or template stack is pushed
+    check_config:
+        description:
+            - In check mode, exported config file (for example a C(show config) export or a compile_to file) to plan the
+              changes on. Without it the cached config snapshot of the device in snapshot_dir is used. Check mode never
+              connects to the device.
+    compile_to:
+        description:
+            - Path of a local candidate config file. The changes are applied to this file instead of the device, no API
+              call is made and nothing is committed. Push the file with the panos_config_push module.
+    multi_config:
+        description:
+            - Send all changes of the task as one multi-config request, the device applies all of them or none.
+              Very large changes are split in several requests. Requires PAN-OS 9.0 or later.
+        default: false
+    timings:
+        description:
+            - Return the type, xpath, request and response size, latency and retries of every API call in timings
+        default: false
+    timings_log:
+        description:
+            - Append the timings of every API call as JSON lines to this file, to compare devices and xpaths across runs
+    route_check:
+        description:
+            - Check the routes of addstatic, addstatic_bulk and state against the static routes of all VRs before
+              anything is sent. Reports routes to a destination that another route already has with the same
+              nexthop (duplicate), routes to a destination that another route has with another nexthop and routes
+              that are part of the longest route covering them with the same nexthop, in either direction (shadows),
+              and next-vr routes that lead back to a VR they passed (loop). More specific routes with another
+              nexthop are normal routing and not reported. warn returns the conflicts with a warning, fail fails the
+              task without changing the device. Costs one request for the static routes of all VRs, none with a
+              snapshot.
+        choices: ['off', 'warn', 'fail']
+        default: 'off'
+    verify:
+        description:
+            - After the commit, check that the added and changed static routes are installed and active, with one
+              show routing route of the VR per poll until all routes are there or verify_timeout passes. The task
+              fails when a route is not. Needs a sync commit on a firewall, with other commit modes or a template
+              it is skipped with a warning. Routes to an address object are not checked.
+        default: false
+    verify_timeout:
+        description:
+            - Seconds to wait for the routes of verify
+        default: 60
     commit:
         description:
             - Commit if changed
         default: true
+    commit_mode:
+        description:
+            - sync commits right away, deferred only records the change so the panos_commit module can commit once,
+              async starts the commit and returns its job_id, use panos_commit_wait to wait for it
+        choices: ['sync', 'deferred', 'async']
+        default: sync
+    commit_state_dir:
+        description:
+            - Directory with the deferred commit state
+        default: "~/.ansible/panos_commit"
 '''
 
 EXAMPLES = '''
@@ -93,28 +247,119 @@ EXAMPLES = '''
         destination: "0.0.0.0/0"
         nexthop: "1.1.1.1"
         commit: "True"
+     - name: Add static routes in bulk
+      panos_vr:
+        ip_address: "pan-vm.westeurope.cloudapp.azure.com"
+        username: "admin"
+        password: "admin"
+        vr_name: "internal"
+        operation: "addstatic_bulk"
+        routes:
+          - name: "net-a"
+            destination: "10.1.0.0/16"
+            nexthop: "1.1.1.1"
+          - name: "net-b"
+            destination: "10.2.0.0/16"
+            nexthop: "outside"
+            nexthoptype: "vr"
+        commit: "True"
+     - name: Add static routes, fail on duplicate, shadowing and looping routes
+      panos_vr:
+        ip_address: "pan-vm.westeurope.cloudapp.azure.com"
+        username: "admin"
+        password: "admin"
+        vr_name: "internal"
+        operation: "addstatic_bulk"
+        route_check: "fail"
+        routes: "{{ internal_routes }}"
 '''
 
 RETURN='''
 # Default return values
+timings:
+    description: API calls of the task with call, xpath, request_size, response_size, latency, retries and status,
+        their count and total latency
+    returned: when timings is true
+    type: dict
+operations:
+    description: Per operation of the multi-config request, id, action, xpath, status and msg
+    returned: when multi_config is true
+    type: list
+job_id:
+    description: Id of the commit job, with a template or template_stack the id of the commit-all push job
+    returned: when the device changed and commit_mode is async, or template or template_stack is set
+    type: string
+routes:
+    description: Per route result of addstatic_bulk, name and changed
+    returned: when operation is addstatic_bulk
+    type: list
+exported:
+    description: Number of exported static routes
+    returned: when operation is export
+    type: int
+static_routes:
+    description: The static routes with name, destination, nexthop and nexthoptype
+    returned: when operation is export and dest is not given
+    type: list
+route_diff:
+    description: missing, the desired routes of which (destination, nexthop) is not on the VR, extra, the routes
+        on the VR that are not desired, and renamed, the desired routes found under another name (name, found)
+    returned: when operation is export and routes is given
+    type: dict
+route_conflicts:
+    description: Conflicts of the routes with the static routes of the VRs, with route, type (duplicate, shadows or
+        loop), conflicts (vr/name of the other routes, or the VRs of the loop) and msg
+    returned: when route_check is warn or fail
+    type: list
+verified:
+    description: Per added or changed route name, verified, msg (ok or what is wrong) and the seconds waited
+    returned: when verify is true and the device was committed
+    type: list
+vr_changes:
+    description: Names of the added, changed and removed routes and the added and removed interfaces
+    returned: when state is set
+    type: dict
+rollback_point:
+    description: Id of the rollback point saved before the change
+    returned: when rollback_points or rollback is set and the device changed
+    type: string
+plan:
+    description: Action, xpath and element of every set, edit and delete the task would send
+    returned: in check mode when the device would change
+    type: list
+diff:
+    description: The VRs, interfaces, profiles and zones that would change, before and after, as XML
+    returned: in check mode with --diff
+    type: dict
 '''
 
 ANSIBLE_METADATA = {'metadata_version': '1.0',
                     'status': ['preview'],
                     'supported_by': 'community'}
 
+import csv
+import json
+import os
+
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.basic import get_exception
+from ansible.module_utils.panos_xapi import connect, entry_exists, first_result, load_pan, PanXapiError
+from ansible.module_utils.panos_snapshot import Snapshot
+from ansible.module_utils.panos_commit import mark_dirty, commit_async
+from ansible.module_utils.panos_transaction import Transaction
+from ansible.module_utils.panos_compile import CompiledConfig, plan_config
+from ansible.module_utils.panos_panorama import TemplateXapi, target_name, commit_push
+from ansible.module_utils.panos_timing import Timer
+from ansible.module_utils.panos_prefix import PrefixTable
+from ansible.module_utils.panos_rollback import RollbackStore, RollbackXapi, point_xpaths, replay_point
+from ansible.module_utils.panos_verify import check_route, route_index, routes_cmd, unverifiable, wait_converged
 
-try:
-    import pan.xapi
-    from pan.xapi import PanXapiError
-    HAS_LIB = True
-except ImportError:
-    HAS_LIB = False
-
-_VR_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
-            "/network/virtual-router/entry[@name='%s']"
+_VRS_XPATH = "/config/devices/entry[@name='localhost.localdomain']" +\
+             "/network/virtual-router/entry"
+_VR_XPATH = _VRS_XPATH + "[@name='%s']"
+_SR_PARENT_XPATH = _VR_XPATH + "/routing-table/ip"
+_SR_XPATH = _SR_PARENT_XPATH + "/static-route"
+_EXPORT_FIELDS = ('name', 'destination', 'nexthop', 'nexthoptype')
 
 #Add VR
 def add_vr(xapi, vr_name):
@@ -131,8 +376,16 @@ def del_vr(xapi, vr_name):
     xapi.delete(xpath=_VR_XPATH % vr_name)
     return True
 
-#Add static route
-def add_static_route(xapi, vr_name, sr_name, destination, nexthop, nexthoptype):
+#Build nexthop content, None when the nexthoptype is invalid
+def nexthop_xml(nexthop, nexthoptype):
+    if (nexthoptype == "ip"):
+        return '<ip-address>' + nexthop + '</ip-address>'
+    elif (nexthoptype == "vr"):
+        return '<next-vr>' + nexthop + '</next-vr>'
+    return None
+
+#Build static route entry, None when the nexthoptype is invalid
+def static_route_xml(sr_name, destination, nexthop, nexthoptype):
     sr_xml = [
         '<entry name="%s">',
             '<destination>%s</destination>',
@@ -142,47 +395,506 @@ def add_static_route(xapi, vr_name, sr_name, destination, nexthop, nexthoptype):
         '</entry>',
     ]
 
-    if (nexthoptype == "ip"):
-        nh_xml = '<ip-address>' + nexthop + '</ip-address>'
-    elif (nexthoptype == "vr"):
-        nh_xml = '<next-vr>' + nexthop + '</next-vr>'
-    else: 
+    nh_xml = nexthop_xml(nexthop, nexthoptype)
+    if (nh_xml is None):
+        return None
+
+    return (''.join(sr_xml) % (sr_name, destination, nh_xml))
+
+#Add static route
+def add_static_route(xapi, vr_name, sr_name, destination, nexthop, nexthoptype):
+    sr_xml = static_route_xml(sr_name, destination, nexthop, nexthoptype)
+    if (sr_xml is None):
         return False
 
-    sr_xml = (''.join(sr_xml) % (sr_name, destination, nh_xml))
-    vr_sr_path = _VR_XPATH % vr_name 
-    vr_sr_path += "/routing-table/ip/static-route"    
-    xapi.set(xpath=vr_sr_path, element=sr_xml)
+    xapi.set(xpath=_SR_XPATH % vr_name, element=sr_xml)
 
     return True
 
+#Update the fields of an existing static route that differ
+def update_static_route(xapi, vr_name, sr_name, current, destination, nexthop, nexthoptype):
+    nh_xml = nexthop_xml(nexthop, nexthoptype)
+    if (nh_xml is None):
+        return False
+
+    entry_path = _SR_XPATH % vr_name + "/entry[@name='%s']" % sr_name
+    changed = False
+    if (current['destination'] != destination):
+        xapi.edit(xpath=entry_path + "/destination",
+                  element='<destination>%s</destination>' % destination)
+        changed = True
+    if (current['nexthop'] != nexthop or current['nexthoptype'] != nexthoptype):
+        xapi.edit(xpath=entry_path + "/nexthop", element='<nexthop>' + nh_xml + '</nexthop>')
+        changed = True
+
+    return changed
+
+#Parse a static route entry into a dict
+def parse_static_route(entry):
+    route = dict(destination=entry.findtext('destination'),
+                 nexthop=None,
+                 nexthoptype=None)
+    if (entry.find('nexthop/ip-address') is not None):
+        route['nexthop'] = entry.findtext('nexthop/ip-address')
+        route['nexthoptype'] = 'ip'
+    elif (entry.find('nexthop/next-vr') is not None):
+        route['nexthop'] = entry.findtext('nexthop/next-vr')
+        route['nexthoptype'] = 'vr'
+    return route
+
+#Get the static routes of a VR, keyed by route name
+def get_static_routes(xapi, vr_name, snapshot=None):
+    if snapshot:
+        static_route = snapshot.get(_SR_XPATH % vr_name)
+        entries = static_route.findall('entry') if static_route is not None else []
+    else:
+        xapi.get(xpath=_SR_XPATH % vr_name)
+        entries = xapi.element_root.findall('.//static-route/entry')
+    routes = {}
+    for entry in entries:
+        routes[entry.get('name')] = parse_static_route(entry)
+    return routes
+
+#Whether the VR exists and its static route sr_name, None when it does not
+#exist, with one get of the VR name and the route. The route is the entry with
+#content, the VR name comes back as an empty entry.
+def get_vr_route(xapi, vr_name, sr_name, snapshot=None):
+    xpath = _SR_XPATH % vr_name + "/entry[@name='%s']" % sr_name
+    if snapshot:
+        entry = snapshot.get(xpath)
+        exists = snapshot.exists('vr', vr_name)
+    else:
+        xapi.get(xpath=_VR_XPATH % vr_name + "/@name|" + xpath)
+        entries = xapi.element_root.findall('./result/entry')
+        routes = [e for e in entries if len(e)]
+        entry = routes[0] if routes else None
+        exists = bool(entries)
+    if (entry is None):
+        return exists, None
+    return exists, parse_static_route(entry)
+
+#Desired state of a route from the routes parameter
+def desired_route(route):
+    return dict(destination=route['destination'],
+                nexthop=route['nexthop'],
+                nexthoptype=route.get('nexthoptype') or 'ip')
+
+#Split xml snippets in chunks of at most max_payload bytes
+def chunk_xml(xml_list, max_payload):
+    chunks = [[]]
+    size = 0
+    for xml in xml_list:
+        if (chunks[-1] and size + len(xml) > max_payload):
+            chunks.append([])
+            size = 0
+        chunks[-1].append(xml)
+        size += len(xml)
+    return [''.join(chunk) for chunk in chunks if chunk]
+
+#Why a route of the routes parameter is invalid, None when it is valid
+def route_error(route):
+    if not isinstance(route, dict) or not all(route.get(k) for k in ('name', 'destination', 'nexthop')):
+        return "Each route needs a name, destination and nexthop: %s" % route
+    if (route.get('nexthoptype') or 'ip') not in ('ip', 'vr'):
+        return "Invalid nexthoptype use, ip or vr: %s" % route['name']
+    return None
+
+#Add static routes in bulk, one set call per max_payload bytes for the new
+#routes. A changed route is replaced with an edit of its entry, a set would
+#merge into it and keep the old nexthop next to the new one.
+def add_static_routes_bulk(xapi, vr_name, routes, max_payload, snapshot=None):
+    existing = get_static_routes(xapi, vr_name, snapshot)
+    results = []
+    sr_xml = []
+
+    for route in routes:
+        desired = desired_route(route)
+        current = existing.get(route['name'])
+        if (current == desired):
+            results.append(dict(name=route['name'], changed=False))
+            continue
+        entry_xml = static_route_xml(route['name'], desired['destination'], desired['nexthop'], desired['nexthoptype'])
+        if (current is None):
+            sr_xml.append(entry_xml)
+        else:
+            xapi.edit(xpath=_SR_XPATH % vr_name + "/entry[@name='%s']" % route['name'], element=entry_xml)
+        results.append(dict(name=route['name'], changed=True))
+
+    for chunk in chunk_xml(sr_xml, max_payload):
+        xapi.set(xpath=_SR_PARENT_XPATH % vr_name,
+                 element='<static-route>' + chunk + '</static-route>')
+
+    return results
+
+#Names of the static routes of a VR, only the names are requested
+def get_static_route_names(xapi, vr_name):
+    xapi.get(xpath=_SR_XPATH % vr_name + "/entry/@name")
+    return [e.get('name') for e in xapi.element_root.findall('./result/entry')]
+
+#Static routes of a VR with their name, fetched in pages of page_size routes
+def iter_static_routes(xapi, vr_name, page_size, snapshot=None):
+    if (snapshot or not page_size):
+        routes = get_static_routes(xapi, vr_name, snapshot)
+        for name in sorted(routes):
+            yield dict(routes[name], name=name)
+        return
+    names = get_static_route_names(xapi, vr_name)
+    for i in range(0, len(names), page_size):
+        predicate = ' or '.join("@name='%s'" % name for name in names[i:i + page_size])
+        xapi.get(xpath=_SR_XPATH % vr_name + "/entry[%s]" % predicate)
+        for entry in xapi.element_root.findall('./result/entry'):
+            yield dict(parse_static_route(entry), name=entry.get('name'))
+
+#Write the routes to a json or csv file as they come in, returns the routes written
+def export_routes(routes, dest, fmt):
+    count = 0
+    with open(os.path.expanduser(dest), 'w') as f:
+        if (fmt == "csv"):
+            writer = csv.writer(f)
+            writer.writerow(_EXPORT_FIELDS)
+        else:
+            f.write('[')
+        for route in routes:
+            if (fmt == "csv"):
+                writer.writerow([route[k] for k in _EXPORT_FIELDS])
+            else:
+                f.write((',\n ' if count else '\n ') + json.dumps(route, sort_keys=True))
+            count += 1
+        if (fmt != "csv"):
+            f.write('\n]\n')
+    return count
+
+#Diff desired routes with the routes of a VR on (destination, nexthop), linear in the number of routes
+class RouteDiff(object):
+    # The routes of the VR are added one page at a time, matched on their name
+    # before (destination, nexthop), so a route is only renamed when no route
+    # with its key has its name
+
+    def __init__(self, desired):
+        self.desired = {}
+        for route in desired:
+            self.desired.setdefault((route['destination'], route['nexthop']), []).append(route['name'])
+        self.found = {}
+        self.extra = []
+
+    def add(self, route):
+        key = (route['destination'], route['nexthop'])
+        if key not in self.desired:
+            self.extra.append(route['name'])
+            return
+        self.found.setdefault(key, []).append(route['name'])
+
+    def result(self):
+        missing = []
+        renamed = []
+        extra = list(self.extra)
+        for key, names in self.desired.items():
+            found = self.found.get(key)
+            if not found:
+                missing.extend(names)
+                continue
+            others = [name for name in found if name not in names]
+            unmatched = [name for name in names if name not in found]
+            renamed.extend(dict(name=name, found=other) for name, other in zip(unmatched, others))
+            extra.extend(others[len(unmatched):])
+        return dict(missing=sorted(missing), extra=extra, renamed=renamed)
+
+#Get a VR entry, None when it does not exist
+def get_vr(xapi, vr_name, snapshot=None):
+    if snapshot:
+        return snapshot.find('vr', vr_name)
+    xapi.get(xpath=_VR_XPATH % vr_name)
+    return first_result(xapi)
+
+#Compare the VR with the desired routes and interfaces for a state.
+#routes or interfaces None means not managed, except for overridden.
+def vr_state_diff(current, state, routes, interfaces):
+    diff = dict(added=[], changed=[], removed=[], interfaces_added=[], interfaces_removed=[])
+    existing = {}
+    members = []
+    if (current is not None):
+        for entry in current.findall('routing-table/ip/static-route/entry'):
+            existing[entry.get('name')] = parse_static_route(entry)
+        members = [m.text for m in current.findall('interface/member')]
+
+    if (state == "overridden"):
+        routes = routes or []
+        interfaces = interfaces or []
+
+    if (state == "deleted"):
+        for route in (routes or []):
+            if route['name'] in existing:
+                diff['removed'].append(route['name'])
+        diff['interfaces_removed'] = [i for i in (interfaces or []) if i in members]
+        return diff
+
+    if routes is not None:
+        names = set()
+        for route in routes:
+            names.add(route['name'])
+            current_route = existing.get(route['name'])
+            if (current_route is None):
+                diff['added'].append(route)
+            elif (current_route != desired_route(route)):
+                diff['changed'].append(route)
+        if (state == "overridden"):
+            diff['removed'] = [name for name in existing if name not in names]
+
+    if interfaces is not None:
+        diff['interfaces_added'] = [i for i in interfaces if i not in members]
+        if (state in ("replaced", "overridden")):
+            diff['interfaces_removed'] = [m for m in members if m not in interfaces]
+
+    return diff
+
+#Apply a VR diff: one set for everything that is added, edits for changed routes, one delete for the removed
+#routes and one for the removed interfaces.
+#A set would merge a changed route into its entry and keep the old nexthop, so changed routes are always edited.
+def apply_vr_diff(xapi, vr_name, diff, exists, max_payload):
+    vr_path = _VR_XPATH % vr_name
+    sr_xml = []
+    for route in diff['added']:
+        desired = desired_route(route)
+        sr_xml.append(static_route_xml(route['name'], desired['destination'], desired['nexthop'], desired['nexthoptype']))
+
+    if_xml = ''
+    if diff['interfaces_added']:
+        if_xml = '<interface>' + ''.join('<member>%s</member>' % i for i in diff['interfaces_added']) + '</interface>'
+
+    chunks = chunk_xml(sr_xml, max_payload) or ['']
+    for chunk in chunks:
+        element = if_xml
+        if chunk:
+            element += '<routing-table><ip><static-route>' + chunk + '</static-route></ip></routing-table>'
+        if not exists:
+            xapi.edit(xpath=vr_path, element='<entry name="%s">%s</entry>' % (vr_name, element))
+            exists = True
+        elif element:
+            xapi.set(xpath=vr_path, element=element)
+        if_xml = ''
+
+    for route in diff['changed']:
+        desired = desired_route(route)
+        xapi.edit(xpath=_SR_XPATH % vr_name + "/entry[@name='%s']" % route['name'],
+                  element=static_route_xml(route['name'], desired['destination'], desired['nexthop'], desired['nexthoptype']))
+
+    delete_many(xapi, _SR_XPATH % vr_name + "/entry", "@name", diff['removed'], max_payload)
+    delete_many(xapi, vr_path + "/interface/member", "text()", diff['interfaces_removed'], max_payload)
+
+    return True
+
+#Delete the nodes at xpath whose key (@name or text()) is one of values with
+#one delete per max_payload bytes, [@name='a' or @name='b'] selects them all
+def delete_many(xapi, xpath, key, values, max_payload):
+    terms = [" or %s='%s'" % (key, value) for value in values]
+    for chunk in chunk_xml(terms, max_payload):
+        xapi.delete(xpath=xpath + "[%s]" % chunk[len(" or "):])
+
+#Subtrees a task changes, saved in the rollback point before the first change
+def rollback_xpaths(vr_name, operation, state, sr_name):
+    if (not state and operation == "addstatic"):
+        return [_SR_XPATH % vr_name + "/entry[@name='%s']" % sr_name]
+    if (not state and operation == "addstatic_bulk"):
+        return [_SR_XPATH % vr_name]
+    return [_VR_XPATH % vr_name]
+
 #Check if VR exists
-def vr_exists(xapi, vr_name):
-    xpath = _VR_XPATH % vr_name
-    xapi.get(xpath=xpath)
-    router = xapi.element_root.find('.//entry')
-    return (router is not None)
+def vr_exists(xapi, vr_name, snapshot=None):
+    if snapshot:
+        return snapshot.exists('vr', vr_name)
+    return entry_exists(xapi, _VR_XPATH % vr_name)
+
+#Static routes of all VRs, keyed by VR and route name, in one request
+def get_route_tables(xapi, snapshot=None):
+    if snapshot:
+        snapshot.load()
+        entries = snapshot.index['vr'].values()
+    else:
+        xapi.get(xpath=_VRS_XPATH)
+        entries = xapi.element_root.findall('./result/entry')
+    tables = {}
+    for vr in entries:
+        tables[vr.get('name')] = dict((e.get('name'), parse_static_route(e))
+                                      for e in vr.findall('routing-table/ip/static-route/entry'))
+    return tables
+
+#VRs a next-vr route passes by longest match of its destination, ending with
+#the VR that comes back, None when it does not loop
+def next_vr_loop(prefixes, vr_name, route):
+    path = [vr_name]
+    vr = route['nexthop']
+    while vr not in path:
+        path.append(vr)
+        match = prefixes[vr].longest(route['destination']) if vr in prefixes else []
+        if not match or match[0]['nexthoptype'] != "vr":
+            return None
+        vr = match[0]['nexthop']
+    return path + [vr]
+
+#Duplicate, shadowing and looping routes of the routes for vr_name. The table
+#of the VR holds its existing routes and all of the routes before any is
+#checked, so the order of the routes does not matter. Routes to the same
+#destination are duplicate with the same nexthop and shadow each other with
+#another one. A route is shadowed by the longest route it is part of when that
+#has the same nexthop, it never decides where traffic goes; default routes
+#excepted. The routes named in replaced are left out of the existing routes.
+def find_route_conflicts(tables, vr_name, routes, replaced=()):
+    replaced = set(replaced) | set(route['name'] for route in routes)
+    prefixes = {}
+    vr_routes = []
+    for vr, existing in tables.items():
+        prefixes[vr] = PrefixTable()
+        for name, route in existing.items():
+            if not (vr == vr_name and name in replaced) and route['destination']:
+                route = dict(route, name=name, vr=vr, new=False)
+                if (prefixes[vr].add(route['destination'], route) and vr == vr_name):
+                    vr_routes.append(route)
+    table = prefixes.setdefault(vr_name, PrefixTable())
+    for route in routes:
+        desired = dict(desired_route(route), name=route['name'], vr=vr_name, new=True)
+        if table.add(desired['destination'], desired):
+            vr_routes.append(desired)
+
+    def hop(route):
+        return (route['nexthop'], route['nexthoptype'])
+
+    def names(others):
+        return ['%s/%s' % (vr_name, o['name']) for o in others]
+
+    conflicts = []
+    for route in vr_routes:
+        found = table.covering(route['destination'])
+        if route['new']:
+            same = [o for o in found[0][1] if o is not route]
+            duplicates = names(o for o in same if hop(o) == hop(route))
+            if duplicates:
+                conflicts.append(dict(route=route['name'], type='duplicate', conflicts=duplicates,
+                                      msg="%s: destination %s is also routed to %s by %s" %
+                                          (route['name'], route['destination'], route['nexthop'],
+                                           ', '.join(duplicates))))
+            contradicting = names(o for o in same if hop(o) != hop(route))
+            if contradicting:
+                conflicts.append(dict(route=route['name'], type='shadows', conflicts=contradicting,
+                                      msg="%s: destination %s is routed to another nexthop by %s" %
+                                          (route['name'], route['destination'], ', '.join(contradicting))))
+        if (len(found) < 2 or not found[1][0] or any(hop(o) != hop(route) for o in found[1][1])):
+            continue
+        if route['new']:
+            covering = names(found[1][1])
+            conflicts.append(dict(route=route['name'], type='shadows', conflicts=covering,
+                                  msg="%s: %s is part of %s with the same nexthop" %
+                                      (route['name'], route['destination'], ', '.join(covering))))
+            continue
+        for other in found[1][1]:
+            if other['new']:
+                conflicts.append(dict(route=other['name'], type='shadows', conflicts=names([route]),
+                                      msg="%s: %s covers %s with the same nexthop" %
+                                          (other['name'], other['destination'], names([route])[0])))
+
+    for route in routes:
+        desired = desired_route(route)
+        if (desired['nexthoptype'] != "vr"):
+            continue
+        path = next_vr_loop(prefixes, vr_name, desired)
+        if path is not None:
+            conflicts.append(dict(route=route['name'], type='loop', conflicts=path,
+                                  msg="%s: %s loops over next-vr %s" %
+                                      (route['name'], desired['destination'], ' -> '.join(path))))
+    return conflicts
+
+#Check routes before they are sent as route_check says, fails the task on conflicts with fail
+def check_routes(module, xapi, vr_name, routes, snapshot=None, replaced=()):
+    try:
+        conflicts = find_route_conflicts(get_route_tables(xapi, snapshot), vr_name, routes, replaced)
+    except PanXapiError:
+        exc = get_exception()
+        module.fail_json(msg=exc.message)
+    if conflicts and module.params['route_check'] == "fail":
+        module.fail_json(msg="Route conflicts, nothing changed: " + '; '.join(c['msg'] for c in conflicts[:10]),
+                         route_conflicts=conflicts)
+    if conflicts:
+        module.warn("%d route conflicts: %s" % (len(conflicts), '; '.join(c['msg'] for c in conflicts[:10])))
+    return conflicts
+
+#Wait until the routes are active in the route table of the VR with one op call
+#per poll, fails the task when a route is not after verify_timeout
+def verify_routes(module, xapi, vr_name, routes):
+    checked = [(r['name'], r) for r in routes if not unverifiable(r)]
+    try:
+        verified, polls = wait_converged(xapi, routes_cmd(vr_name), route_index, check_route, checked,
+                                         module.params['verify_timeout'])
+    except PanXapiError:
+        exc = get_exception()
+        module.fail_json(msg=exc.message, changed=True)
+    verified += [dict(name=r['name'], verified=None, msg="destination is not an IP prefix, not checked")
+                 for r in routes if unverifiable(r)]
+    failed = [v for v in verified if v['verified'] is False]
+    if failed:
+        module.fail_json(msg="%d of %d routes not verified after %d polls: %s" % (
+                             len(failed), len(checked), polls,
+                             '; '.join('%s %s' % (v['name'], v['msg']) for v in failed[:10])),
+                         changed=True, verified=verified)
+    return verified
+
 
 def main():
+    global PanXapiError
     argument_spec = dict(
         ip_address=dict(required=True),
-        password=dict(required=True, no_log=True),
+        password=dict(no_log=True),
         username=dict(default='admin'),
+        api_key=dict(no_log=True),
+        api_key_cache=dict(type='bool', default=False),
+        api_key_cache_dir=dict(),
+        api_key_ttl=dict(type='int', default=86400),
+        api_retries=dict(type='int', default=3),
+        api_rate=dict(type='float', default=0),
+        api_lock_timeout=dict(type='int', default=300),
         vr_name=dict(required=True),
-        operation=dict(default='add'), #Could be add or del, addstatic
+        operation=dict(default='add'), #Could be add or del, addstatic, addstatic_bulk, export
         sr_name=dict(),
         destination=dict(),
         nexthop=dict(),
         nexthoptype=dict(default='ip'), #Could be ip or vr
-        commit=dict(type='bool', default=True)
+        routes=dict(type='list'),
+        interfaces=dict(type='list'),
+        state=dict(choices=['merged', 'replaced', 'overridden', 'deleted']),
+        max_payload=dict(type='int', default=100000),
+        dest=dict(),
+        format=dict(default='json', choices=['json', 'csv']),
+        page_size=dict(type='int', default=500),
+        snapshot_ttl=dict(type='int', default=0),
+        snapshot_dir=dict(),
+        rollback_points=dict(type='bool', default=False),
+        rollback_dir=dict(),
+        rollback=dict(),
+        template=dict(),
+        template_stack=dict(),
+        vsys=dict(),
+        device_group=dict(),
+        check_config=dict(),
+        compile_to=dict(),
+        multi_config=dict(type='bool', default=False),
+        timings=dict(type='bool', default=False),
+        timings_log=dict(),
+        route_check=dict(default='off', choices=['off', 'warn', 'fail']),
+        verify=dict(type='bool', default=False),
+        verify_timeout=dict(type='int', default=60),
+        commit=dict(type='bool', default=True),
+        commit_mode=dict(default='sync', choices=['sync', 'deferred', 'async']),
+        commit_state_dir=dict()
     )
 
-    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
-    if not HAS_LIB:
-        module.fail_json(msg='pan-python is required for this module')
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True,
+                           mutually_exclusive=[['template', 'template_stack']])
+    #pan-python is imported after argument validation, check mode and compile_to run without it
+    if not (module.check_mode or module.params['compile_to']):
+        xapi_lib = load_pan()
+        if xapi_lib is None:
+            module.fail_json(msg='pan-python is required for this module')
+        PanXapiError = xapi_lib.PanXapiError
 
     ip_address = module.params['ip_address']
-    password = module.params['password']
     username = module.params['username']
     vr_name = module.params['vr_name']
     operation = module.params['operation']
@@ -190,18 +902,117 @@ def main():
     destination = module.params['destination']
     nexthop = module.params['nexthop']
     nexthoptype = module.params['nexthoptype']
+    routes = module.params['routes']
+    interfaces = module.params['interfaces']
+    state = module.params['state']
+    max_payload = module.params['max_payload']
     commit = module.params['commit']
+    route_check = module.params['route_check'] != "off"
 
-    xapi = pan.xapi.PanXapi(
-        hostname=ip_address,
-        api_username=username,
-        api_password=password
-    )
+    template = module.params['template']
+    template_stack = module.params['template_stack']
+
+    timer = None
+    if (module.params['timings'] or module.params['timings_log']):
+        timer = Timer(module.params['timings_log'], 'panos_vr')
+        timer.attach(module, ip_address, module.params['timings'])
+
+    compiled = None
+    if module.check_mode:
+        compiled = plan_config(module.params['check_config'],
+                               target_name(ip_address, template, template_stack, module.params['vsys']),
+                               module.params['snapshot_dir'])
+        if compiled is None:
+            module.fail_json(msg="check mode needs check_config or a config snapshot of the device, "
+                                 "run once with snapshot_ttl")
+        xapi = compiled
+    elif module.params['compile_to']:
+        compiled = CompiledConfig(module.params['compile_to'])
+        xapi = compiled
+    else:
+        xapi = connect(module, timer)
+        if (template or template_stack or module.params['vsys']):
+            xapi = TemplateXapi(xapi, template, template_stack, module.params['vsys'])
+
+    snapshot = None
+    if module.params['snapshot_ttl'] and compiled is None:
+        snapshot = Snapshot(xapi, target_name(ip_address, template, template_stack, module.params['vsys']),
+                            module.params['snapshot_dir'], module.params['snapshot_ttl'])
+        xapi = snapshot.wrap()
+
+    rollback_id = module.params['rollback']
+    store = None
+    recorder = None
+    if (module.params['rollback_points'] or rollback_id):
+        store = RollbackStore(module.params['rollback_dir'])
+        if compiled is None:
+            recorder = RollbackXapi(xapi, store, target_name(ip_address, template, template_stack, module.params['vsys']),
+                                    'panos_vr', snapshot)
+            recorder.xpaths = rollback_xpaths(vr_name, operation, state, sr_name)
+            xapi = recorder
+
+    tx = None
+    if module.params['multi_config']:
+        tx = Transaction(xapi)
+        xapi = tx
+
+    if (operation == "addstatic_bulk" and not state and not routes):
+        module.fail_json(msg="routes is required for addstatic_bulk")
+    if (operation == "export" and not state):
+        for route in (routes or []):
+            if not isinstance(route, dict) or not all(route.get(k) for k in ('name', 'destination', 'nexthop')):
+                module.fail_json(msg="Each route needs a name, destination and nexthop: %s" % route)
+    if (operation == "addstatic_bulk" or state):
+        for route in (routes or []):
+            if (state == "deleted" and isinstance(route, dict) and route.get('name')):
+                continue
+            error = route_error(route)
+            if error:
+                module.fail_json(msg=error)
 
     changed = False
-    vrExists = vr_exists(xapi, vr_name)
+    results = None
+    vr_changes = None
+    conflicts = None
+    changed_routes = []
+    #addstatic reads the VR name together with the route
+    if (not state and not rollback_id and operation != "addstatic"):
+        vrExists = vr_exists(xapi, vr_name, snapshot)
 
-    if (operation == "add"):
+    if (rollback_id):
+        point = store.find_point(target_name(ip_address, template, template_stack, module.params['vsys']),
+                                 rollback_id, 'panos_vr')
+        if (point is None):
+            module.fail_json(msg="Rollback point %s not found in %s" % (rollback_id, store.directory))
+        if recorder is not None:
+            recorder.xpaths = point_xpaths(point)
+        try:
+            changed = replay_point(xapi, store, point, snapshot, recorder.known if recorder is not None else None)
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message)
+    elif (state):
+        try:
+            current = get_vr(xapi, vr_name, snapshot)
+            if recorder is not None:
+                recorder.known[_VR_XPATH % vr_name] = current
+            if (state == "deleted" and routes is None and interfaces is None):
+                if (current is None):
+                    module.exit_json(changed=False, msg="VR does not exists, not changed")
+                changed = del_vr(xapi, vr_name)
+            else:
+                vr_changes = vr_state_diff(current, state, routes, interfaces)
+                if (route_check and state != "deleted"):
+                    conflicts = check_routes(module, xapi, vr_name, vr_changes['added'] + vr_changes['changed'],
+                                             snapshot, vr_changes['removed'])
+                if (any(vr_changes.values()) or (current is None and state != "deleted")):
+                    changed = apply_vr_diff(xapi, vr_name, vr_changes, current is not None, max_payload)
+                if (state != "deleted"):
+                    changed_routes = vr_changes['added'] + vr_changes['changed']
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message)
+    elif (operation == "add"):
         if (vrExists):
             module.exit_json(changed=False, msg="VR exists, not changed")
         else:
@@ -220,25 +1031,113 @@ def main():
                 exc = get_exception()
                 module.fail_json(msg=exc.message)   
     elif (operation == "addstatic"):
+        if (nexthoptype not in ("ip", "vr")):
+            module.exit_json(changed=False, msg="Invalid nexthoptype use, ip or vr")
+        try:
+            vrExists, current = get_vr_route(xapi, vr_name, sr_name, snapshot)
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message)
         if (not vrExists):
             module.exit_json(changed=False, msg="VR does not exists, not changed")
         else:
+            if route_check:
+                conflicts = check_routes(module, xapi, vr_name, [dict(name=sr_name, destination=destination,
+                                         nexthop=nexthop, nexthoptype=nexthoptype)], snapshot)
             try:
-                changed = add_static_route(xapi, vr_name, sr_name, destination, nexthop, nexthoptype)
-                if (not changed):
-                    module.exit_json(changed=False, msg="Invalid nexthoptype use, ip or vr")
+                if recorder is not None and current is None:
+                    recorder.known[_SR_XPATH % vr_name + "/entry[@name='%s']" % sr_name] = None
+                if (current is None):
+                    changed = add_static_route(xapi, vr_name, sr_name, destination, nexthop, nexthoptype)
+                else:
+                    changed = update_static_route(xapi, vr_name, sr_name, current, destination, nexthop, nexthoptype)
+                if changed:
+                    changed_routes = [dict(name=sr_name, destination=destination, nexthop=nexthop,
+                                          nexthoptype=nexthoptype)]
             except PanXapiError:
                 exc = get_exception()
                 module.fail_json(msg=exc.message)               
+    elif (operation == "addstatic_bulk"):
+        if (not vrExists):
+            module.exit_json(changed=False, msg="VR does not exists, not changed")
+        else:
+            if route_check:
+                conflicts = check_routes(module, xapi, vr_name, routes, snapshot)
+            try:
+                results = add_static_routes_bulk(xapi, vr_name, routes, max_payload, snapshot)
+                changed = any(r['changed'] for r in results)
+                changed_names = set(r['name'] for r in results if r['changed'])
+                changed_routes = [r for r in routes if r['name'] in changed_names]
+            except PanXapiError:
+                exc = get_exception()
+                module.fail_json(msg=exc.message)
+    elif (operation == "export"):
+        if (not vrExists):
+            module.exit_json(changed=False, msg="VR does not exists, not changed")
+        try:
+            static_routes = iter_static_routes(xapi, vr_name, module.params['page_size'], snapshot)
+            diff = RouteDiff(routes) if routes is not None else None
+            if diff is not None:
+                static_routes = (diff.add(route) or route for route in static_routes)
+            if module.params['dest']:
+                export = dict(exported=export_routes(static_routes, module.params['dest'], module.params['format']))
+            else:
+                export = dict(static_routes=list(static_routes))
+                export['exported'] = len(export['static_routes'])
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message)
+        if diff is not None:
+            export['route_diff'] = diff.result()
+        module.exit_json(changed=False, msg="exported", **export)
     else:
-        module.exit_json(changed=False, msg="Operation not clear, use add, del or addstatic")
+        module.exit_json(changed=False, msg="Operation not clear, use add, del, addstatic, addstatic_bulk or export")
         changed = False
 
 
-    if changed and commit:
-        xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+    result = dict(changed=changed, msg="yippie ka yee")
+    if tx is not None:
+        try:
+            result['operations'] = tx.flush()
+        except PanXapiError:
+            exc = get_exception()
+            module.fail_json(msg=exc.message, operations=tx.results)
+    if compiled is not None:
+        if changed:
+            compiled.save()
+        if module.check_mode:
+            result['plan'] = compiled.plan
+            if module._diff:
+                result['diff'] = compiled.diff()
+    elif changed and commit:
+        if (module.params['commit_mode'] == "deferred"):
+            mark_dirty(ip_address, username, module.params['commit_state_dir'])
+        elif (template or template_stack):
+            result['job_id'] = commit_push(xapi, module.params['device_group'], template, template_stack,
+                                           module.params['commit_mode'] == "sync")
+        elif (module.params['commit_mode'] == "async"):
+            result['job_id'] = commit_async(xapi)
+        else:
+            xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+            if module.params['verify']:
+                result['verified'] = verify_routes(module, xapi, vr_name, changed_routes)
+    if (module.params['verify'] and changed and 'verified' not in result and not module.check_mode):
+        module.warn("verify needs a sync commit on a firewall, the routes are not verified")
 
-    module.exit_json(changed=changed, msg="yippie ka yee")
+    if results is not None:
+        result['routes'] = results
+    if conflicts is not None:
+        result['route_conflicts'] = conflicts
+    if recorder is not None and recorder.point is not None:
+        result['rollback_point'] = recorder.point['id']
+    if vr_changes is not None:
+        result['vr_changes'] = dict(
+            added=[r['name'] for r in vr_changes['added']],
+            changed=[r['name'] for r in vr_changes['changed']],
+            removed=vr_changes['removed'],
+            interfaces_added=vr_changes['interfaces_added'],
+            interfaces_removed=vr_changes['interfaces_removed'])
+    module.exit_json(**result)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,45 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# VR memberships of panos_interface from the union get of the interface, the
+# zones and the VR names and interface lists.
+
+import xml.etree.ElementTree as ET
+
+from panos_interface import vr_member_entries
+
+
+def members(result, skip=None):
+    return dict((vr.get('name'), [m.text for m in vr.findall('interface/member')])
+                for vr in vr_member_entries(ET.fromstring(result), skip))
+
+
+def test_interface_entry_is_left_out():
+    result = ('<result><entry name="ae1"><layer3/></entry>'
+              '<entry name="default"/><interface><member>ae1</member></interface>'
+              '<entry name="inside"/></result>')
+    assert members(result, 'ae1') == dict(default=['ae1'], inside=[])
+
+
+def test_vr_named_like_the_interface_keeps_its_interface_list():
+    result = ('<result><entry name="ae1"><layer3/></entry>'
+              '<entry name="default"/><interface><member>ethernet1/1</member></interface>'
+              '<entry name="ae1"/><interface><member>ae1</member></interface></result>')
+    assert members(result, 'ae1') == dict(default=['ethernet1/1'], ae1=['ae1'])
+
+
+def test_bare_interface_entry_is_left_out():
+    result = ('<result><entry name="default"/><interface><member>ae1</member></interface>'
+              '<entry name="ae1"/></result>')
+    assert members(result, 'ae1') == dict(default=['ae1'])
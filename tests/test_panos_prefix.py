@@ -0,0 +1,31 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Permitted IP diffs of panos_int_mgt_profile: both sides are collapsed.
+
+from ansible.module_utils.panos_prefix import diff_prefixes
+
+
+def test_same_addresses_in_another_notation_are_no_change():
+    assert diff_prefixes(['10.0.0.0/24', '1.2.3.4/32'], ['10.0.0.0/25', '10.0.0.128/25', '1.2.3.4']) == ([], [])
+
+
+def test_removed_keep_the_notation_of_the_device():
+    assert diff_prefixes(['10.0.0.0/24'], ['10.0.0.0/24', '10.1.0.1', 'not-a-prefix']) == (
+        [], ['10.1.0.1', 'not-a-prefix'])
+
+
+def test_changed_network_is_replaced():
+    assert diff_prefixes(['10.0.0.0/24'], ['10.0.0.0/25', '10.1.0.0/16']) == (
+        ['10.0.0.0/24'], ['10.0.0.0/25', '10.1.0.0/16'])
@@ -0,0 +1,115 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Replay of rollback points against the simulator: a replay that changes
+# nothing reports no change, and containers the change created are removed.
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from ansible.module_utils.panos_rollback import RollbackStore, RollbackXapi, point_xpaths, replay_point
+from panos_simulator import Simulator
+
+ZONE = "/config/devices/entry[@name='localhost.localdomain']/vsys/entry[@name='vsys1']/zone"
+LAYER3 = ZONE + "/entry[@name='dmz']/network/layer3"
+
+
+class Xapi(object):
+    # The config calls of PanXapi, answered by the simulator without HTTP
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.element_root = None
+        self.calls = []
+
+    def _request(self, **query):
+        self.calls.append(query['action'])
+        query.update(type='config', key=self.simulator.api_key)
+        self.element_root = ET.fromstring(self.simulator.handle(query))
+
+    def get(self, xpath=None):
+        self._request(action='get', xpath=xpath)
+
+    def edit(self, xpath=None, element=None):
+        self._request(action='edit', xpath=xpath, element=element)
+
+    def set(self, xpath=None, element=None):
+        self._request(action='set', xpath=xpath, element=element)
+
+    def delete(self, xpath=None):
+        self._request(action='delete', xpath=xpath)
+
+
+@pytest.fixture
+def device(tmpdir):
+    xapi = Xapi(Simulator())
+    return xapi, RollbackStore(str(tmpdir))
+
+
+def zones(xapi):
+    xapi.get(xpath=ZONE)
+    return ET.tostring(xapi.element_root.find('./result/zone')).decode('utf-8')
+
+
+def record(xapi, store, xpaths, change):
+    recorder = RollbackXapi(xapi, store, 'fw', 'panos_interface')
+    recorder.xpaths = xpaths
+    change(recorder)
+    return recorder.point
+
+
+def test_new_zone_is_removed_with_its_member_list(device):
+    xapi, store = device
+    before = zones(xapi)
+    point = record(xapi, store, [LAYER3],
+                   lambda x: x.set(xpath=LAYER3, element='<member>ethernet1/3</member>'))
+    assert point['subtrees'] == [[LAYER3, None, ZONE + "/entry[@name='dmz']"]]
+
+    assert replay_point(xapi, store, point) is True
+    assert zones(xapi) == before
+    assert replay_point(xapi, store, point) is False
+
+
+def test_existing_zone_keeps_its_other_config(device):
+    xapi, store = device
+    xapi.set(xpath=ZONE + "/entry[@name='dmz']", element='<enable-user-identification>yes</enable-user-identification>')
+    before = zones(xapi)
+    point = record(xapi, store, [LAYER3],
+                   lambda x: x.set(xpath=LAYER3, element='<member>ethernet1/3</member>'))
+
+    assert replay_point(xapi, store, point) is True
+    assert zones(xapi) == before
+
+
+def test_unchanged_subtree_is_not_sent(device):
+    xapi, store = device
+    xapi.set(xpath=LAYER3, element='<member>ethernet1/1</member>')
+    point = record(xapi, store, [LAYER3], lambda x: x.set(xpath=LAYER3, element='<member>ethernet1/2</member>'))
+
+    assert replay_point(xapi, store, point) is True
+    del xapi.calls[:]
+    assert replay_point(xapi, store, point) is False
+    assert xapi.calls == ['get']
+
+
+def test_rollback_of_a_rollback_restores_the_new_zone(device):
+    xapi, store = device
+    point = record(xapi, store, [LAYER3],
+                   lambda x: x.set(xpath=LAYER3, element='<member>ethernet1/3</member>'))
+    changed = zones(xapi)
+    undo = record(xapi, store, point_xpaths(point), lambda x: replay_point(x, store, point, known=x.known))
+
+    assert replay_point(xapi, store, undo) is True
+    assert zones(xapi) == changed
@@ -0,0 +1,98 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# route_check of panos_vr: the conflicts do not depend on the order of the
+# routes, and ordinary routing tables and re-runs have none. The route diff of
+# export matches routes on their name first.
+
+import pytest
+
+from panos_vr import RouteDiff, find_route_conflicts
+
+
+def route(name, destination, nexthop, nexthoptype='ip'):
+    return dict(name=name, destination=destination, nexthop=nexthop, nexthoptype=nexthoptype)
+
+
+def table(*routes):
+    return dict((r['name'], dict(destination=r['destination'], nexthop=r['nexthop'], nexthoptype=r['nexthoptype']))
+                for r in routes)
+
+
+def conflicts(existing, routes):
+    found = find_route_conflicts(dict(inside=table(*existing)), 'inside', routes)
+    return sorted((c['route'], c['type'], tuple(c['conflicts'])) for c in found)
+
+
+AGGREGATE = route('aggregate', '10.0.0.0/8', '192.168.0.1')
+SPECIFIC = route('specific', '10.1.0.0/16', '192.168.0.2')
+SAME_HOP = route('same-hop', '10.1.0.0/16', '192.168.0.1')
+
+
+@pytest.mark.parametrize('routes', [[AGGREGATE, SPECIFIC], [SPECIFIC, AGGREGATE]])
+def test_more_specific_route_to_another_nexthop_is_not_a_conflict(routes):
+    assert conflicts([], routes) == []
+
+
+@pytest.mark.parametrize('routes', [[AGGREGATE, SAME_HOP], [SAME_HOP, AGGREGATE]])
+def test_covered_route_with_the_same_nexthop_in_either_order(routes):
+    assert conflicts([], routes) == [('same-hop', 'shadows', ('inside/aggregate',))]
+
+
+def test_new_aggregate_over_existing_route_with_the_same_nexthop():
+    assert conflicts([SAME_HOP], [AGGREGATE]) == [('aggregate', 'shadows', ('inside/same-hop',))]
+
+
+def test_new_aggregate_over_existing_route_to_another_nexthop():
+    assert conflicts([SPECIFIC], [AGGREGATE]) == []
+
+
+def test_same_destination():
+    other = route('other', '10.1.0.0/16', '192.168.0.1')
+    assert conflicts([other], [SPECIFIC]) == [('specific', 'shadows', ('inside/other',))]
+    assert conflicts([other], [SAME_HOP]) == [('same-hop', 'duplicate', ('inside/other',))]
+
+
+@pytest.mark.parametrize('routes', [
+    [AGGREGATE, SPECIFIC, route('default', '0.0.0.0/0', '192.168.0.1')],
+    [route('default', '0.0.0.0/0', '192.168.0.1'), SPECIFIC, AGGREGATE],
+])
+def test_rerun_of_an_unchanged_batch(routes):
+    assert conflicts(routes, routes) == []
+    assert conflicts(routes, list(reversed(routes))) == []
+
+
+def test_next_vr_loop():
+    tables = dict(inside=table(), outside=table(route('back', '10.0.0.0/8', 'inside', 'vr')))
+    found = find_route_conflicts(tables, 'inside', [route('to-outside', '10.1.0.0/16', 'outside', 'vr')])
+    assert [(c['route'], c['type'], c['conflicts']) for c in found] == [
+        ('to-outside', 'loop', ['inside', 'outside', 'inside'])]
+
+
+def route_diff(desired, existing):
+    diff = RouteDiff(desired)
+    for r in existing:
+        diff.add(r)
+    return diff.result()
+
+
+def test_route_diff_matches_the_name_before_the_key():
+    copy = route('copy', '10.1.0.0/16', '192.168.0.1')
+    assert route_diff([SAME_HOP], [copy, SAME_HOP]) == dict(missing=[], extra=['copy'], renamed=[])
+
+
+def test_route_diff_renamed_and_missing():
+    renamed = route('old-name', '10.1.0.0/16', '192.168.0.1')
+    assert route_diff([SAME_HOP, AGGREGATE], [renamed, SPECIFIC]) == dict(
+        missing=['aggregate'], extra=['specific'], renamed=[dict(name='same-hop', found='old-name')])
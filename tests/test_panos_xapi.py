@@ -0,0 +1,150 @@
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Transport failures of the panos_xapi persistent connection: a 503 and a
+# dropped socket are retried by RetryXapi and slow down the limiter.
+
+import importlib
+import socket
+
+import pytest
+
+from ansible.errors import AnsibleConnectionFailure
+from ansible.module_utils.connection import ConnectionError
+from ansible.module_utils import panos_xapi
+from ansible.module_utils.panos_retry import TRANSIENT, Limiter, RetryXapi, classify
+
+plugin = importlib.import_module('connection_plugins.panos_xapi')
+
+OK = '<response status="success"><result><entry name="default"/></result></response>'
+
+
+@pytest.fixture(autouse=True)
+def pan():
+    assert panos_xapi.load_pan() is not None
+
+
+class Response(object):
+
+    def __init__(self, status, body, reason='OK'):
+        self.status = status
+        self.reason = reason
+        self._body = body
+
+    def read(self):
+        return self._body.encode('utf-8')
+
+
+class HTTPConnection(object):
+    # Answers with the next of responses, an exception is raised instead
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.closed = False
+
+    def request(self, method, url, body, headers):
+        if isinstance(self.responses[0], Exception):
+            raise self.responses.pop(0)
+
+    def getresponse(self):
+        return self.responses.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class Plugin(object):
+    # The state _send uses of the connection plugin, every new connection
+    # answers with the remaining responses
+
+    _send = plugin.Connection._send
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.connections = 0
+        self._conn = self._new_conn()
+
+    def _new_conn(self):
+        self.connections += 1
+        return HTTPConnection(self.responses)
+
+
+class RPC(object):
+    # Connection to the plugin, raises the errors of the plugin like the
+    # ansible-connection JSON-RPC does
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+
+    def xapi_request(self, query):
+        try:
+            return self.plugin._send(query)
+        except AnsibleConnectionFailure as exc:
+            raise ConnectionError(str(exc))
+
+
+def retry_xapi(responses):
+    return RetryXapi(panos_xapi.PersistentXapi(RPC(Plugin(responses))), Limiter(), sleep=lambda seconds: None)
+
+
+def test_send_raises_http_status():
+    with pytest.raises(AnsibleConnectionFailure) as exc:
+        Plugin([Response(503, '<html>busy</html>', 'Service Unavailable')])._send(dict(type='op'))
+    assert 'code: 503' in str(exc.value)
+    assert classify(exc.value) == TRANSIENT
+
+
+def test_send_reconnects_once_after_dropped_socket():
+    connection = Plugin([socket.error(104, 'Connection reset by peer'), Response(200, OK)])
+    assert connection._send(dict(type='op')) == OK
+    assert connection.connections == 2
+
+
+def test_send_raises_connection_failure_after_second_drop():
+    connection = Plugin([socket.error(32, 'Broken pipe'), socket.error(32, 'Broken pipe')])
+    with pytest.raises(AnsibleConnectionFailure) as exc:
+        connection._send(dict(type='op'))
+    assert 'connection failed' in str(exc.value)
+    assert classify(exc.value) == TRANSIENT
+
+
+def test_503_is_retried_and_slows_the_limiter():
+    xapi = retry_xapi([Response(503, '<html>busy</html>', 'Service Unavailable'), Response(200, OK)])
+    xapi.get(xpath='/config')
+    assert xapi.retries == 1
+    assert xapi.element_root.find('./result/entry').get('name') == 'default'
+    assert xapi._limiter.slowed
+
+
+def test_dropped_socket_is_retried():
+    drop = socket.error(32, 'Broken pipe')
+    xapi = retry_xapi([drop, drop, Response(200, OK)])
+    xapi.get(xpath='/config')
+    assert xapi.retries == 1
+    assert xapi._limiter.slowed
+
+
+def test_persistent_failure_raises_pan_xapi_error():
+    xapi = retry_xapi([socket.error(32, 'Broken pipe')] * 8)
+    with pytest.raises(panos_xapi.load_pan().PanXapiError) as exc:
+        xapi.get(xpath='/config')
+    assert 'connection failed' in str(exc.value)
+    assert xapi.retries == 3
+
+
+def test_commit_is_not_sent_again_after_503():
+    xapi = retry_xapi([Response(503, '<html>busy</html>', 'Service Unavailable'), Response(200, OK)])
+    with pytest.raises(panos_xapi.load_pan().PanXapiError):
+        xapi.commit(cmd='<commit></commit>')
+    assert xapi.retries == 0
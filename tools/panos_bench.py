@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Benchmark of the ON2IT panos modules against the XML API simulator.
+#
+# Runs workloads of increasing size with panos_vr, panos_interface and
+# panos_int_mgt_profile against tools/panos_simulator.py and reports per
+# workload and size the tasks, API calls, calls per task, bytes sent and
+# received and the wall time. The modules run in this process with the same
+# arguments a play would pass, pan-python is pointed at the simulator.
+#
+#   python tools/panos_bench.py --sizes 10,100,1000,10000 --latency 0.005
+#
+# Compare the JSON output (--json) of two revisions to see changes in call
+# counts before they reach a device.
+#
+# --import-time RUNS imports every module in RUNS fresh interpreters instead and
+# reports the median import time, the number of modules loaded and whether
+# pan-python was loaded, the start-up cost every task pays.
+#
+#   python tools/panos_bench.py --import-time 20
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pan.xapi
+
+from ansible.module_utils import basic
+from ansible.module_utils.six import StringIO
+from panos_simulator import Simulator, serve
+
+_MODULES = ('panos_vr', 'panos_interface', 'panos_int_mgt_profile', 'panos_commit', 'panos_commit_wait',
+            'panos_config_push')
+_IMPORT_SCRIPT = '''
+import sys, time
+loaded = len(sys.modules)
+start = time.time()
+import %s
+sys.stdout.write('%%f %%d %%d' %% (time.time() - start, len(sys.modules) - loaded, 'pan.xapi' in sys.modules))
+'''
+
+_ARGS = dict(ip_address='127.0.0.1', username='admin', password='admin', commit=False)
+
+
+def route(i):
+    return dict(name='r%d' % i, destination='10.%d.%d.0/24' % (i // 256 % 256, i % 256), nexthop='192.168.0.1')
+
+
+def interface(i):
+    return dict(if_name='ethernet%d/%d' % (i // 100 + 1, i % 100 + 1), if_type='dhcp', zone_name='bench',
+                vr_name='bench')
+
+
+#Workloads: name -> function returning the (module, args) tasks of size n
+def vr_addstatic(n):
+    return ([('panos_vr', dict(vr_name='bench', operation='add'))] +
+            [('panos_vr', dict(vr_name='bench', operation='addstatic', sr_name=r['name'],
+                               destination=r['destination'], nexthop=r['nexthop'])) for r in map(route, range(n))])
+
+
+def vr_addstatic_bulk(n):
+    return [('panos_vr', dict(vr_name='bench', operation='add')),
+            ('panos_vr', dict(vr_name='bench', operation='addstatic_bulk', routes=[route(i) for i in range(n)]))]
+
+
+def vr_state(n):
+    return [('panos_vr', dict(vr_name='bench', state='merged', routes=[route(i) for i in range(n)]))]
+
+
+def interfaces_bulk(n):
+    return [('panos_vr', dict(vr_name='bench', operation='add')),
+            ('panos_interface', dict(interfaces=[interface(i) for i in range(n)]))]
+
+
+def mgt_profile(n):
+    iplist = ','.join('10.%d.%d.%d' % (i // 65536 % 256, i // 256 % 256, i % 256) for i in range(n))
+    return [('panos_int_mgt_profile', dict(name='bench', ping=True, ssh=True, iplist=iplist))]
+
+
+WORKLOADS = dict(vr_addstatic=vr_addstatic, vr_addstatic_bulk=vr_addstatic_bulk, vr_state=vr_state,
+                 interfaces_bulk=interfaces_bulk, mgt_profile=mgt_profile)
+
+
+#Import the modules in runs fresh interpreters, returns per module the median
+#and minimum import time, the modules loaded and whether pan.xapi was loaded
+def import_times(modules, runs):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    results = []
+    for name in modules:
+        samples = []
+        for _ in range(runs):
+            output = subprocess.check_output([sys.executable, '-c', _IMPORT_SCRIPT % name], env=env)
+            seconds, loaded, pan_loaded = output.decode('ascii').split()
+            samples.append(float(seconds))
+        samples.sort()
+        results.append(dict(module=name, runs=runs, median=samples[len(samples) // 2], min=samples[0],
+                            modules_loaded=int(loaded), pan_xapi=pan_loaded == '1'))
+    return results
+
+
+#Run one module in this process, returns its result
+def run_task(name, args):
+    module = importlib.import_module(name)
+    basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args)).encode('utf-8')
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        module.main()
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout = stdout
+    try:
+        return json.loads(output.getvalue())
+    except ValueError:
+        return dict(failed=True, msg=output.getvalue())
+
+
+#Run the tasks of a workload against a clean simulator, returns the measurements
+def run_workload(simulator, tasks, extra_args):
+    simulator.reset()
+    snapshot_dir = tempfile.mkdtemp()
+    failed = []
+    start = time.time()
+    for name, args in tasks:
+        params = dict(_ARGS, snapshot_dir=snapshot_dir)
+        params.update(extra_args)
+        params.update(args)
+        result = run_task(name, params)
+        if result.get('failed'):
+            failed.append(result.get('msg'))
+    wall = time.time() - start
+    shutil.rmtree(snapshot_dir)
+    stats = simulator.stats
+    return dict(tasks=len(tasks), api_calls=stats['requests'],
+                calls_per_task=round(float(stats['requests']) / len(tasks), 2),
+                bytes_out=stats['bytes_in'], bytes_in=stats['bytes_out'], busy=stats['busy'],
+                wall=round(wall, 3), calls=dict(stats['types']), failed=failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the panos modules against the XML API simulator')
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated workload sizes')
+    parser.add_argument('--workloads', default=','.join(sorted(WORKLOADS)), help='comma separated workloads')
+    parser.add_argument('--latency', type=float, default=0, help='seconds the simulator adds to every request')
+    parser.add_argument('--capacity', type=int, default=0, help='requests per second the simulator handles')
+    parser.add_argument('--rate', type=float, default=0, help='run the modules with api_rate')
+    parser.add_argument('--commit', action='store_true', help='commit after every changed task')
+    parser.add_argument('--multi-config', action='store_true', help='run the modules with multi_config')
+    parser.add_argument('--snapshot-ttl', type=int, default=0, help='run the modules with snapshot_ttl')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--import-time', type=int, default=0, metavar='RUNS',
+                        help='measure the import time of the modules over RUNS fresh interpreters')
+    args = parser.parse_args()
+
+    if args.import_time:
+        results = import_times(_MODULES, args.import_time)
+        if args.json:
+            json.dump(results, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write('\n')
+        else:
+            for result in results:
+                sys.stdout.write('%-22s runs %4d  median %8.2fms  min %8.2fms  modules %5d  pan.xapi %s\n' % (
+                    result['module'], result['runs'], result['median'] * 1000, result['min'] * 1000,
+                    result['modules_loaded'], 'loaded' if result['pan_xapi'] else 'not loaded'))
+        sys.exit(0)
+
+    simulator = Simulator(latency=args.latency, capacity=args.capacity)
+    server = serve(simulator)
+    port = server.server_address[1]
+
+    #Point pan-python at the simulator
+    real_xapi = pan.xapi.PanXapi
+
+    def simulator_xapi(**kwargs):
+        kwargs.update(hostname='127.0.0.1', port=port, use_http=True)
+        return real_xapi(**kwargs)
+    pan.xapi.PanXapi = simulator_xapi
+
+    extra_args = dict(commit=args.commit, multi_config=args.multi_config, snapshot_ttl=args.snapshot_ttl,
+                      api_rate=args.rate)
+    results = []
+    for name in args.workloads.split(','):
+        for size in [int(s) for s in args.sizes.split(',')]:
+            result = run_workload(simulator, WORKLOADS[name](size), extra_args)
+            result.update(workload=name, size=size)
+            results.append(result)
+            if not args.json:
+                sys.stdout.write('%-18s %6d  tasks %6d  calls %6d  calls/task %6.2f  out %10d  in %10d  busy %5d  wall %8.3fs%s\n' % (
+                    name, size, result['tasks'], result['api_calls'], result['calls_per_task'],
+                    result['bytes_out'], result['bytes_in'], result['busy'], result['wall'],
+                    '  FAILED %d' % len(result['failed']) if result['failed'] else ''))
+
+    server.shutdown()
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    sys.exit(1 if any(r['failed'] for r in results) else 0)
+
+if __name__ == '__main__':
+    main()
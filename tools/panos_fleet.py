@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Fleet mode for the ON2IT panos modules.
+#
+# Applies one desired state file to all devices of an inventory file from a
+# single process. Every device is handled by a worker thread of a bounded pool,
+# using the functions of panos_int_mgt_profile, panos_vr and panos_interface, so
+# pan-python is imported once instead of once per host per task. The calls to a
+# device go through the retry layer of the modules: a busy device is retried
+# and slowed down, starting from at most --rate requests per second. The result
+# of every device and a summary are printed as JSON. The desired state is
+# checked with the checks of the modules before any device is contacted.
+#
+# The modules import their shared code from ansible.module_utils, install the
+# module_utils files as described in the README first.
+#
+# Inventory (YAML or JSON):
+#
+#   defaults:
+#     username: admin
+#     password: admin
+#   devices:
+#     - ip_address: fw1.example.com
+#     - ip_address: fw2.example.com
+#       api_key: "..."
+#
+# Desired state (YAML or JSON):
+#
+#   profiles:
+#     - name: allow_ping
+#       ping: true
+#       iplist: "10.0.0.0/8"
+#     - name: allow_management
+#       ssh: true
+#       iplist_file: mgmt_prefixes.txt
+#   vrs:
+#     - name: inside
+#       routes:
+#         - {name: default, destination: 0.0.0.0/0, nexthop: 10.0.0.1}
+#   interfaces:
+#     - {if_name: ethernet1/1, if_type: dhcp, zone_name: inside, vr_name: inside}
+
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pan.xapi
+from pan.xapi import PanXapiError
+
+from panos_int_mgt_profile import add_mgtprf, update_mgtprf, get_mgtprf, load_iplist
+from panos_vr import add_vr, vr_exists, add_static_routes_bulk, route_error
+from panos_interface import add_ifs_bulk, interface_params, interface_error
+from ansible.module_utils.panos_retry import RetryXapi, device_limiter
+from ansible.module_utils.panos_transaction import Transaction
+
+try:
+    import yaml
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
+PROFILE_DEFAULTS = dict(http=False, https=False, http_ocsp=False, ssh=False, snmp=False, userid=False,
+                        userid_syslog_ssl=False, userid_syslog_udp=False, ping=True, response_pages=False,
+                        telnet=False, iplist=None)
+INTERFACE_DEFAULTS = dict(if_type='dhcp', if_address=None, vr_name='default', zone_name=None,
+                          create_default_route=False)
+MAX_PAYLOAD = 100000
+
+
+#Load a YAML or JSON file
+def load_file(path):
+    with open(path) as f:
+        if HAS_YAML:
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+#PanXapi for an inventory device
+def device_xapi(device):
+    if device.get('api_key'):
+        return pan.xapi.PanXapi(hostname=device['ip_address'], api_key=device['api_key'])
+    return pan.xapi.PanXapi(hostname=device['ip_address'], api_username=device.get('username', 'admin'),
+                            api_password=device.get('password'))
+
+
+#Service flags of a profile of the desired state, as yes or no
+def profile_flags(profile):
+    params = dict(PROFILE_DEFAULTS)
+    params.update(profile)
+    flags = dict((k, 'yes' if params[k] else 'no') for k in PROFILE_DEFAULTS if k != 'iplist')
+    flags['iplist'] = load_iplist(params['iplist'], params.get('iplist_file'))
+    return flags
+
+
+#Apply the desired state to one device, returns the result of the device
+def apply_device(device, desired, rate=0, multi_config=False, commit=True, retries=3):
+    start = time.time()
+    result = dict(ip_address=device['ip_address'], changed=False, profiles=[], vrs=[], interfaces=[])
+    limited = RetryXapi(device_xapi(device), device_limiter(device['ip_address'], rate), retries=retries)
+    xapi = limited
+    tx = None
+    if multi_config:
+        tx = Transaction(xapi)
+        xapi = tx
+
+    try:
+        for profile in desired.get('profiles') or []:
+            flags = profile_flags(profile)
+            current = get_mgtprf(xapi, profile['name'])
+            if (current is None):
+                changed = add_mgtprf(xapi, profile['name'], **flags)
+            else:
+                changed = update_mgtprf(xapi, profile['name'], current, **flags)
+            result['profiles'].append(dict(name=profile['name'], changed=changed))
+
+        for vr in desired.get('vrs') or []:
+            changed = False
+            if not vr_exists(xapi, vr['name']):
+                changed = add_vr(xapi, vr['name'])
+            routes = add_static_routes_bulk(xapi, vr['name'], vr.get('routes') or [], MAX_PAYLOAD)
+            changed = changed or any(r['changed'] for r in routes)
+            result['vrs'].append(dict(name=vr['name'], changed=changed, routes=routes))
+
+        interfaces = [interface_params(i, INTERFACE_DEFAULTS) for i in desired.get('interfaces') or []]
+        if interfaces:
+            result['interfaces'] = add_ifs_bulk(xapi, interfaces)
+
+        result['changed'] = any(r['changed'] for key in ('profiles', 'vrs', 'interfaces') for r in result[key])
+        if tx is not None:
+            tx.flush()
+        if result['changed'] and commit:
+            xapi.commit(cmd="<commit></commit>", sync=True, interval=1)
+    except PanXapiError as exc:
+        result['failed'] = True
+        result['msg'] = str(exc)
+    except Exception as exc:
+        #Any other error fails this device only, the other devices go on
+        result['failed'] = True
+        result['msg'] = '%s: %s' % (type(exc).__name__, exc)
+
+    result['api_calls'] = limited.calls
+    result['retries'] = limited.retries
+    result['duration'] = round(time.time() - start, 3)
+    return result
+
+
+#Errors of the desired state, checked with the checks of the modules
+def desired_errors(desired):
+    errors = []
+    for profile in desired.get('profiles') or []:
+        if not isinstance(profile, dict) or not profile.get('name'):
+            errors.append("Each profile needs a name: %s" % profile)
+    for vr in desired.get('vrs') or []:
+        if not isinstance(vr, dict) or not vr.get('name'):
+            errors.append("Each vr needs a name: %s" % vr)
+            continue
+        errors.extend(e for e in (route_error(r) for r in vr.get('routes') or []) if e)
+    for interface in desired.get('interfaces') or []:
+        if not isinstance(interface, dict):
+            errors.append("Each interface needs an if_name and zone_name: %s" % interface)
+            continue
+        error = interface_error(interface_params(interface, INTERFACE_DEFAULTS))
+        if error:
+            errors.append(error)
+    return errors
+
+
+#Apply the desired state to all devices with a pool of workers threads. An
+#invalid desired state raises ValueError before any device is contacted.
+def apply_fleet(devices, desired, workers=32, rate=0, multi_config=False, commit=True, retries=3):
+    start = time.time()
+    errors = desired_errors(desired)
+    #The permitted IPs are read and normalized once for all devices
+    profiles = []
+    for profile in desired.get('profiles') or []:
+        if not isinstance(profile, dict) or not profile.get('name'):
+            continue
+        try:
+            profiles.append(dict(profile, iplist=load_iplist(profile.get('iplist'), profile.get('iplist_file')),
+                                 iplist_file=None))
+        except (IOError, ValueError) as exc:
+            errors.append("Invalid iplist of profile %s: %s" % (profile['name'], exc))
+    if errors:
+        raise ValueError('; '.join(errors))
+    desired = dict(desired, profiles=profiles)
+    pool = ThreadPool(max(1, min(workers, len(devices))))
+    try:
+        results = pool.map(lambda device: apply_device(device, desired, rate, multi_config, commit, retries),
+                           devices)
+    finally:
+        pool.close()
+        pool.join()
+
+    summary = dict(devices=len(results),
+                   changed=len([r for r in results if r['changed']]),
+                   failed=len([r for r in results if r.get('failed')]),
+                   api_calls=sum(r['api_calls'] for r in results),
+                   retries=sum(r['retries'] for r in results),
+                   duration=round(time.time() - start, 3))
+    return dict(results=results, summary=summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a desired state to many PAN-OS devices at once')
+    parser.add_argument('inventory', help='YAML or JSON file with the devices')
+    parser.add_argument('state', help='YAML or JSON file with the desired state')
+    parser.add_argument('--workers', type=int, default=32, help='devices handled at the same time')
+    parser.add_argument('--rate', type=float, default=0, help='maximum API calls per second per device, 0 is unlimited')
+    parser.add_argument('--retries', type=int, default=3, help='times a request to a busy device is sent again')
+    parser.add_argument('--multi-config', action='store_true', help='send the changes of a device as one multi-config request')
+    parser.add_argument('--no-commit', action='store_true', help='do not commit the changed devices')
+    args = parser.parse_args()
+
+    inventory = load_file(args.inventory)
+    defaults = inventory.get('defaults') or {}
+    devices = []
+    for device in inventory.get('devices') or []:
+        params = dict(defaults)
+        params.update(device)
+        devices.append(params)
+
+    try:
+        fleet = apply_fleet(devices, load_file(args.state), args.workers, args.rate, args.multi_config,
+                            not args.no_commit, args.retries)
+    except ValueError as exc:
+        sys.stderr.write('Invalid desired state: %s\n' % exc)
+        sys.exit(2)
+    json.dump(fleet, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    sys.exit(1 if fleet['summary']['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
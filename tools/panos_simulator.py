@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+#  Copyright 2018 ON2IT B.V.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Local stand-in for the PAN-OS XML API.
+#
+# Serves /api/ from an in-memory config tree: keygen, config get, show, set,
+# edit, delete and multi-config, commit and commit-all jobs, import of config
+# files with load config partial, show jobs, and show interface all and show
+# routing route built from the committed config. Every request can be delayed
+# by --latency seconds and a commit job takes --commit-time seconds. The
+# operational state follows a commit --converge seconds after the job is done,
+# DHCP interfaces get a lease from 192.0.2.0/24 and the ports of --link-down
+# stay down. With
+# --capacity the requests above that many per second are answered with HTTP
+# 503, like an overloaded management plane. Requests and bytes are counted per
+# type, so tools/panos_bench.py can report the API load of the modules.
+#
+# Without --certfile the simulator speaks plain HTTP. With a certificate it can
+# be used from a play through the panos_xapi connection (ansible_port).
+
+import argparse
+import email
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from copy import deepcopy
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ansible.module_utils.six.moves import BaseHTTPServer, socketserver
+from ansible.module_utils.six.moves.urllib.parse import urlparse, parse_qsl
+from ansible.module_utils.panos_snapshot import apply_config, find_xpath, merge_element, select_xpath
+from ansible.module_utils.panos_compile import empty_config, NETWORK_XPATH, ZONE_XPATH
+
+DEFAULT_API_KEY = 'LUFRPT1TaW11bGF0b3I='
+
+
+def response_xml(result='', status='success', code=None):
+    attrs = ' code="%s"' % code if code else ''
+    return '<response status="%s"%s><result>%s</result></response>' % (status, attrs, result)
+
+
+def error_xml(msg, code=None):
+    attrs = ' code="%s"' % code if code else ''
+    return '<response status="error"%s><msg><line>%s</line></msg></response>' % (attrs, escape(msg))
+
+
+class ApiError(Exception):
+    pass
+
+
+class Busy(Exception):
+    pass
+
+
+class Simulator(object):
+    # In-memory PAN-OS device, handle() answers one XML API query
+
+    def __init__(self, username='admin', password='admin', api_key=DEFAULT_API_KEY, latency=0, commit_time=0,
+                 capacity=0, converge=0, links_down=()):
+        self.username = username
+        self.password = password
+        self.api_key = api_key
+        self.latency = latency
+        self.commit_time = commit_time
+        self.capacity = capacity
+        self.converge = converge
+        self.links_down = set(links_down)
+        self.recent = []
+        self.lock = threading.Lock()
+        self.reset()
+
+    #Empty config, no jobs and zero counters
+    def reset(self):
+        with self.lock:
+            self.root = empty_config()
+            self.jobs = {}
+            self.files = {}
+            self.commits = [(0, empty_config())]
+            self.stats = dict(requests=0, bytes_in=0, bytes_out=0, busy=0, types={})
+
+    def count(self, query, bytes_in, bytes_out):
+        kind = query.get('type', '')
+        if query.get('action'):
+            kind += '/' + query['action']
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+            self.stats['types'][kind] = self.stats['types'].get(kind, 0) + 1
+
+    #Raise Busy when the requests of the last second exceed the capacity
+    def admit(self):
+        if not self.capacity:
+            return
+        with self.lock:
+            now = time.time()
+            self.recent = [t for t in self.recent if now - t < 1.0]
+            if len(self.recent) >= self.capacity:
+                self.stats['busy'] += 1
+                raise Busy()
+            self.recent.append(now)
+
+    def handle(self, query, files=None):
+        self.admit()
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            if query.get('type') == 'keygen':
+                return self.keygen(query)
+            if query.get('key') != self.api_key:
+                return error_xml('Invalid Credential', code=403)
+            with self.lock:
+                handler = getattr(self, 'type_' + (query.get('type') or 'none').replace('-', '_'), None)
+                if handler is None:
+                    raise ApiError('Unsupported type %s' % query.get('type'))
+                return handler(query, files or {})
+        except (ApiError, ValueError, ET.ParseError) as exc:
+            return error_xml(str(exc))
+
+    def keygen(self, query):
+        if query.get('user') != self.username or query.get('password') != self.password:
+            return error_xml('Invalid Credential', code=403)
+        return response_xml('<key>%s</key>' % self.api_key)
+
+    def type_config(self, query, files):
+        action = query.get('action')
+        xpath = query.get('xpath')
+        if action in ('get', 'show'):
+            nodes = select_xpath(self.root, xpath) if xpath else [self.root]
+            if not nodes:
+                return response_xml(code=7)
+            return response_xml(''.join(ET.tostring(n).decode('utf-8') for n in nodes), code=19)
+        if action in ('set', 'edit'):
+            if not xpath or query.get('element') is None:
+                raise ApiError('Missing xpath or element')
+            apply_config(self.root, action, xpath, query['element'])
+            return response_xml('command succeeded', code=20)
+        if action == 'delete':
+            apply_config(self.root, action, xpath)
+            return response_xml('command succeeded', code=20)
+        if action == 'multi-config':
+            return self.multi_config(query.get('element'))
+        raise ApiError('Unsupported config action %s' % action)
+
+    #All operations or none, like the device
+    def multi_config(self, element):
+        backup = deepcopy(self.root)
+        results = []
+        for op in ET.fromstring(element):
+            inner = ''.join(ET.tostring(child).decode('utf-8') for child in op)
+            try:
+                if op.tag not in ('set', 'edit', 'delete'):
+                    raise ApiError('Unsupported operation %s' % op.tag)
+                apply_config(self.root, op.tag, op.get('xpath'), inner or None)
+            except (ApiError, ValueError, ET.ParseError, AttributeError) as exc:
+                self.root = backup
+                return error_xml('operation %s failed: %s' % (op.get('id'), exc))
+            results.append('<response status="success" code="20" id="%s"><msg>command succeeded</msg></response>'
+                           % op.get('id'))
+        return response_xml(''.join(results), code=20)
+
+    def add_job(self, kind):
+        job = str(len(self.jobs) + 1)
+        self.jobs[job] = dict(id=job, type=kind, enqueued=time.time())
+        return job
+
+    def job_xml(self, job):
+        done = time.time() - job['enqueued'] >= self.commit_time
+        return ('<job><id>%s</id><type>%s</type><status>%s</status><result>%s</result><progress>%s</progress>'
+                '<tenq>%s</tenq><tfin>%s</tfin></job>') % (
+            job['id'], job['type'], 'FIN' if done else 'ACT', 'OK' if done else 'PEND', 100 if done else 50,
+            time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(job['enqueued'])),
+            time.strftime('%Y/%m/%d %H:%M:%S') if done else '')
+
+    def type_commit(self, query, files):
+        job = self.add_job('CommitAll' if query.get('action') == 'all' else 'Commit')
+        self.commits.append((self.jobs[job]['enqueued'] + self.commit_time + self.converge, deepcopy(self.root)))
+        return response_xml('<msg><line>Commit job enqueued with jobid %s</line></msg><job>%s</job>' % (job, job),
+                            code=19)
+
+    def type_import(self, query, files):
+        for filename, data in files.items():
+            self.files[filename] = ET.fromstring(data)
+        return response_xml('<msg><line>%s saved</line></msg>' % ', '.join(files))
+
+    def type_op(self, query, files):
+        cmd = ET.fromstring(query.get('cmd') or '<none/>')
+        if cmd.find('jobs/id') is not None:
+            job = self.jobs.get(cmd.findtext('jobs/id').strip('"'))
+            if job is None:
+                raise ApiError('job %s not found' % cmd.findtext('jobs/id'))
+            return response_xml(self.job_xml(job))
+        if cmd.find('jobs/all') is not None:
+            return response_xml(''.join(self.job_xml(j) for j in self.jobs.values()))
+        if cmd.find('config/partial') is not None:
+            return self.load_partial(cmd.find('config/partial'))
+        if cmd.find('interface') is not None and cmd.findtext('interface') == 'all':
+            return response_xml(self.show_interfaces())
+        if cmd.find('routing/route') is not None:
+            return response_xml(self.show_routes(cmd.findtext('routing/route/virtual-router')))
+        raise ApiError('Unsupported op command %s' % ET.tostring(cmd).decode('utf-8'))
+
+    #Config of the last commit that converged, older commits are dropped
+    def running(self):
+        now = time.time()
+        ready = [i for i, (t, root) in enumerate(self.commits) if t <= now]
+        self.commits = self.commits[ready[-1]:]
+        return self.commits[0][1]
+
+    def show_interfaces(self):
+        running = self.running()
+        network = find_xpath(running, NETWORK_XPATH)
+        zone_of = {}
+        for zone in find_xpath(running, ZONE_XPATH).findall('entry'):
+            for member in zone.findall('network/layer3/member'):
+                zone_of[member.text] = zone.get('name')
+        vr_of = {}
+        for vr in network.findall('virtual-router/entry'):
+            for member in vr.findall('interface/member'):
+                vr_of[member.text] = vr.get('name')
+        ifnet = []
+        hw = []
+        for n, port in enumerate(network.findall('interface/ethernet/entry')):
+            name = port.get('name')
+            hw.append('<entry><name>%s</name><state>%s</state><id>%d</id></entry>' % (
+                name, 'down' if name in self.links_down else 'up', n + 16))
+            for entry in [port] + port.findall('layer3/units/entry'):
+                if entry.find('layer3/dhcp-client') is not None or entry.find('dhcp-client') is not None:
+                    ip = '192.0.2.%d/24' % (n + 10) if name not in self.links_down else 'N/A'
+                else:
+                    ip = entry.find('layer3/ip/entry')
+                    ip = ip.get('name') if ip is not None else 'N/A'
+                ifnet.append('<entry><name>%s</name><zone>%s</zone><fwd>%s</fwd><ip>%s</ip></entry>' % (
+                    entry.get('name'), zone_of.get(entry.get('name'), ''),
+                    'vr:' + vr_of[entry.get('name')] if entry.get('name') in vr_of else 'N/A', ip))
+        return '<ifnet>%s</ifnet><hw>%s</hw>' % (''.join(ifnet), ''.join(hw))
+
+    def show_routes(self, vr_name):
+        vr = find_xpath(self.running(), NETWORK_XPATH + "/virtual-router/entry[@name='%s']" % vr_name)
+        if vr is None:
+            raise ApiError('virtual-router %s does not exist' % vr_name)
+        entries = []
+        for route in vr.findall('routing-table/ip/static-route/entry'):
+            nexthop = route.findtext('nexthop/ip-address') or route.findtext('nexthop/next-vr') or ''
+            entries.append('<entry><virtual-router>%s</virtual-router><destination>%s</destination>'
+                           '<nexthop>%s</nexthop><metric>10</metric><flags>A S</flags><age/>'
+                           '<interface/><route-table>unicast</route-table></entry>' % (
+                               vr_name, route.findtext('destination'), nexthop))
+        return '<flags>flags: A:active, C:connect, S:static</flags>' + ''.join(entries)
+
+    def load_partial(self, partial):
+        source = self.files.get(partial.findtext('from'))
+        if source is None:
+            raise ApiError('%s not found' % partial.findtext('from'))
+        node = find_xpath(source, partial.findtext('from-xpath'))
+        if node is None:
+            raise ApiError('from-xpath not found')
+        xpath = partial.findtext('to-xpath')
+        if partial.findtext('mode') == 'replace':
+            apply_config(self.root, 'edit', xpath, ET.tostring(node).decode('utf-8'))
+        else:
+            merge_element(find_xpath(self.root, xpath, create=True), deepcopy(node))
+        return response_xml('<msg><line>Config loaded from %s</line></msg>' % partial.findtext('from'))
+
+
+#Uploaded files of a multipart/form-data body
+def multipart_files(content_type, body):
+    parse = getattr(email, 'message_from_bytes', email.message_from_string)
+    message = parse(b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body)
+    files = {}
+    for part in message.get_payload():
+        if part.get_filename():
+            files[part.get_filename()] = part.get_payload(decode=True)
+    return files
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    simulator = None
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type') or ''
+        files = {}
+        if content_type.startswith('multipart/form-data'):
+            files = multipart_files(content_type, body)
+        elif body:
+            query.update(parse_qsl(body.decode('utf-8')))
+
+        if url.path != '/api/':
+            self.send_error(404)
+            return
+        try:
+            data = self.simulator.handle(query, files).encode('utf-8')
+        except Busy:
+            self.send_error(503)
+            return
+        self.simulator.count(query, len(self.path) + len(body), len(data))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+#Start the simulator in a background thread, returns the server
+def serve(simulator, host='127.0.0.1', port=0, certfile=None, keyfile=None):
+    handler = type('SimulatorHandler', (Handler,), dict(simulator=simulator))
+    server = Server((host, port), handler)
+    if certfile:
+        import ssl
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the PAN-OS XML API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--commit-time', type=float, default=0, help='seconds a commit job takes')
+    parser.add_argument('--capacity', type=int, default=0, help='requests per second before answering 503')
+    parser.add_argument('--converge', type=float, default=0,
+                        help='seconds after a commit before the operational state follows')
+    parser.add_argument('--link-down', action='append', default=[], help='port whose link is down')
+    parser.add_argument('--certfile', help='certificate to serve HTTPS')
+    parser.add_argument('--keyfile', help='key of the certificate')
+    args = parser.parse_args()
+
+    simulator = Simulator(args.username, args.password, latency=args.latency, commit_time=args.commit_time,
+                          capacity=args.capacity, converge=args.converge, links_down=args.link_down)
+    server = serve(simulator, args.host, args.port, args.certfile, args.keyfile)
+    sys.stderr.write('PAN-OS XML API simulator on %s://%s:%d/api/\n' % (
+        'https' if args.certfile else 'http', args.host, server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()